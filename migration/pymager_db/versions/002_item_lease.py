@@ -0,0 +1,15 @@
+from sqlalchemy import *
+from migrate import *
+
+meta = MetaData(migrate_engine)
+item_lease = Table('item_lease', meta,
+    Column('id', String(255), primary_key=True),
+    Column('owner', String(255), nullable=False),
+    Column('last_heartbeat_date', DateTime, index=True, nullable=False)
+)
+
+def upgrade():
+    item_lease.create()
+
+def downgrade():
+    item_lease.drop()
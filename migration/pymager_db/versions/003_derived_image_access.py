@@ -0,0 +1,18 @@
+from sqlalchemy import *
+from migrate import *
+
+meta = MetaData(migrate_engine)
+derived_image_metadata = Table('derived_image_metadata', meta, autoload=True)
+
+last_access_date = Column('last_access_date', DateTime, nullable=True)
+file_size = Column('file_size', Integer, nullable=True)
+
+def upgrade():
+    last_access_date.create(derived_image_metadata)
+    Index('ix_derived_image_metadata_last_access_date', derived_image_metadata.c.last_access_date).create()
+    file_size.create(derived_image_metadata)
+
+def downgrade():
+    Index('ix_derived_image_metadata_last_access_date', derived_image_metadata.c.last_access_date).drop()
+    derived_image_metadata.c.last_access_date.drop()
+    derived_image_metadata.c.file_size.drop()
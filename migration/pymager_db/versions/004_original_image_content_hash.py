@@ -0,0 +1,15 @@
+from sqlalchemy import *
+from migrate import *
+
+meta = MetaData(migrate_engine)
+original_image_metadata = Table('original_image_metadata', meta, autoload=True)
+
+content_hash = Column('content_hash', String(40), nullable=True)
+
+def upgrade():
+    content_hash.create(original_image_metadata)
+    Index('ix_original_image_metadata_content_hash', original_image_metadata.c.content_hash).create()
+
+def downgrade():
+    Index('ix_original_image_metadata_content_hash', original_image_metadata.c.content_hash).drop()
+    original_image_metadata.c.content_hash.drop()
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+from pymager import config
+from pymager.resources.impl.pilimageformatmapper import PilImageFormatMapper
+from pymager.resources.impl.stripedpathgenerator import StripedPathGenerator, link_disks
+from pymager.imgengine.impl.diskrebalancer import DiskRebalancer
+import logging
+import sys
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    pymager_config = config.parse_config(__file__, config.PYMAGER_CONFIG_FILENAME)['pymager']
+    if not pymager_config.get('data_directories'):
+        sys.exit('data_directories is not configured')
+    data_directory = pymager_config['data_directory']
+    data_directories = pymager_config['data_directories']
+    
+    link_disks(data_directory, data_directories)
+    path_generator = StripedPathGenerator(PilImageFormatMapper(), data_directory, len(data_directories))
+    print "Moved %s images" % (DiskRebalancer(path_generator, data_directory, len(data_directories)).rebalance(),)
@@ -15,6 +15,7 @@
 """
 
 import os
+import shutil
 import logging
 from sqlalchemy import create_engine, Table, Column, Integer, String, MetaData, ForeignKey, DateTime #, UniqueConstraint
 from sqlalchemy.orm import mapper, relation, sessionmaker, scoped_session, backref #, eagerload
@@ -23,18 +24,105 @@ from pymager import imgengine
 from pymager import persistence
 from pymager import domain
 from pymager import resources
+from pymager import caching
 from pymager.imgengine import image_transformation_security_decorator
 from pymager.imgengine.impl.defaultimagerequestprocessor import DefaultImageRequestProcessor
+from pymager.imgengine.impl import defaultimagerequestprocessor
+from pymager.imgengine.impl.filelockmanager import FileLockManager
+from pymager.imgengine.impl.databaseleaselockmanager import DatabaseLeaseLockManager
+from pymager.imgengine.impl.inlinederivationexecutor import InlineDerivationExecutor
+from pymager.imgengine.impl.processpoolderivationexecutor import ProcessPoolDerivationExecutor
+from pymager.imgengine.impl.derivationqueue import DerivationQueue
+from pymager.imgengine.impl.derivedimageindex import DerivedImageIndex
+from pymager.imgengine.impl.accesstracker import AccessTracker
+from pymager.imgengine.impl.derivedimagecollector import DerivedImageCollector
+from pymager.imgengine.impl.derivedimagetiers import DerivedImageTiers
+from pymager.imgengine.impl.contentstore import ContentStore
+from pymager.imgengine.impl.publictree import PublicTree
+from pymager.caching.impl.lrucache import LruCache
+from pymager.caching.impl.invalidatingimagemetadatalistener import InvalidatingImageMetadataListener
+from pymager.caching.impl.negativelookupimagemetadatarepository import NegativeLookupImageMetadataRepository
+from pymager.caching.impl import negativelookupimagemetadatarepository
+from pymager.caching.impl.cachingimagemetadatarepository import CachingImageMetadataRepository
 from pymager.resources.impl.pilimageformatmapper import PilImageFormatMapper
 from pymager.resources.impl.flatpathgenerator import FlatPathGenerator
 from pymager.resources.impl.nestedpathgenerator import NestedPathGenerator
+from pymager.resources.impl.tieredpathgenerator import TieredPathGenerator
+from pymager.resources.impl.stripedpathgenerator import StripedPathGenerator, link_disks
+from pymager.resources.impl.packfileimagestore import PackfileImageStore
+from pymager.resources.impl.imagestorecompactor import ImageStoreCompactor
+
+LOCK_MANAGER_FILE = 'file'
+LOCK_MANAGER_DATABASE = 'database'
+
+ASYNC_DERIVATION_OFF = 'off'
+ASYNC_DERIVATION_ACCEPTED = 'accepted'
+ASYNC_DERIVATION_PLACEHOLDER = 'placeholder'
+
+SENDFILE_OFF = 'off'
+SENDFILE_X_SENDFILE = 'x-sendfile'
+SENDFILE_X_ACCEL_REDIRECT = 'x-accel-redirect'
 
 class ServiceConfiguration(object):
-    def __init__(self, data_directory, dburi, allowed_sizes, dev_mode):
+    def __init__(self, data_directory, dburi, allowed_sizes, dev_mode, 
+                 lock_manager=LOCK_MANAGER_FILE, lock_timeout_seconds=10, lock_lease_seconds=30,
+                 derivation_processes=0, derivation_queue_size=100, derivative_source_ratio=0,
+                 mezzanine_max_size=0, background_derivation_workers=0, background_derivation_queue_size=100,
+                 pregenerate_on_upload=False, pregenerate_formats=None, async_derivation_mode=ASYNC_DERIVATION_OFF,
+                 derived_image_cache_max_bytes=0, decoded_image_cache_max_bytes=0,
+                 image_metadata_cache_ttl_seconds=0, image_metadata_cache_max_entries=10000,
+                 negative_lookup_cache_ttl_seconds=0, negative_lookup_cache_max_entries=100000, known_image_ids_rebuild_seconds=0,
+                 derived_image_index=False, derived_image_index_rebuild_seconds=3600,
+                 derived_image_quota_bytes=0, derived_image_collection_seconds=60,
+                 hot_directory=None, hot_tier_max_bytes=1073741824, hot_tier_promotion_accesses=3, hot_tier_rebalance_seconds=60,
+                 packfile_directory=None, packfile_max_image_bytes=65536, packfile_segment_bytes=268435456, 
+                 packfile_compaction_ratio=0.5, packfile_compaction_seconds=3600, data_directories=None,
+                 deduplicate_originals=False, sendfile_mode=SENDFILE_OFF, sendfile_prefix='/pymager-files/',
+                 public_directory=None, derived_image_max_age_seconds=0, etag_cache_ttl_seconds=0, etag_cache_max_entries=100000):
         self.data_directory = data_directory
         self.dburi = dburi
         self.allowed_sizes = allowed_sizes
         self.dev_mode = dev_mode
+        self.lock_manager = lock_manager
+        self.lock_timeout_seconds = lock_timeout_seconds
+        self.lock_lease_seconds = lock_lease_seconds
+        self.derivation_processes = derivation_processes
+        self.derivation_queue_size = derivation_queue_size
+        self.derivative_source_ratio = derivative_source_ratio
+        self.mezzanine_max_size = mezzanine_max_size
+        self.background_derivation_workers = background_derivation_workers
+        self.background_derivation_queue_size = background_derivation_queue_size
+        self.pregenerate_on_upload = pregenerate_on_upload
+        self.pregenerate_formats = pregenerate_formats if pregenerate_formats is not None else [domain.IMAGE_FORMAT_JPEG]
+        self.async_derivation_mode = async_derivation_mode
+        self.derived_image_cache_max_bytes = derived_image_cache_max_bytes
+        self.decoded_image_cache_max_bytes = decoded_image_cache_max_bytes
+        self.image_metadata_cache_ttl_seconds = image_metadata_cache_ttl_seconds
+        self.image_metadata_cache_max_entries = image_metadata_cache_max_entries
+        self.negative_lookup_cache_ttl_seconds = negative_lookup_cache_ttl_seconds
+        self.negative_lookup_cache_max_entries = negative_lookup_cache_max_entries
+        self.known_image_ids_rebuild_seconds = known_image_ids_rebuild_seconds
+        self.derived_image_index = derived_image_index
+        self.derived_image_index_rebuild_seconds = derived_image_index_rebuild_seconds
+        self.derived_image_quota_bytes = derived_image_quota_bytes
+        self.derived_image_collection_seconds = derived_image_collection_seconds
+        self.hot_directory = hot_directory
+        self.hot_tier_max_bytes = hot_tier_max_bytes
+        self.hot_tier_promotion_accesses = hot_tier_promotion_accesses
+        self.hot_tier_rebalance_seconds = hot_tier_rebalance_seconds
+        self.packfile_directory = packfile_directory
+        self.packfile_max_image_bytes = packfile_max_image_bytes
+        self.packfile_segment_bytes = packfile_segment_bytes
+        self.packfile_compaction_ratio = packfile_compaction_ratio
+        self.packfile_compaction_seconds = packfile_compaction_seconds
+        self.data_directories = data_directories
+        self.deduplicate_originals = deduplicate_originals
+        self.sendfile_mode = sendfile_mode
+        self.sendfile_prefix = sendfile_prefix
+        self.public_directory = public_directory
+        self.derived_image_max_age_seconds = derived_image_max_age_seconds
+        self.etag_cache_ttl_seconds = etag_cache_ttl_seconds
+        self.etag_cache_max_entries = etag_cache_max_entries
 
 class ImageServerFactory(object):
     def __init__(self, config):
@@ -48,6 +136,22 @@ class ImageServerFactory(object):
         self._sessionmaker = None
         self._image_format_mapper = None
         self._path_generator = None
+        self._lock_manager = None
+        self._derivation_executor = None
+        self._derivation_queue = None
+        self._derived_image_cache = None
+        self._decoded_image_cache = None
+        self._image_metadata_cache = None
+        self._negative_lookup_repository = None
+        self._derived_image_index = None
+        self._access_tracker = None
+        self._derived_image_collector = None
+        self._derived_image_tiers = None
+        self._packed_image_store = None
+        self._image_store_compactor = None
+        self._content_store = None
+        self._public_tree = None
+        self._etag_cache = None
 
     def get_schema_migrator(self):
         return self._schema_migrator
@@ -73,8 +177,75 @@ class ImageServerFactory(object):
     def get_path_generator(self):
         return self._path_generator
     
+    def get_lock_manager(self):
+        return self._lock_manager
+    
+    def get_derivation_executor(self):
+        return self._derivation_executor
+    
+    def get_derivation_queue(self):
+        return self._derivation_queue
+    
+    def get_derived_image_cache(self):
+        return self._derived_image_cache
+    
+    def get_decoded_image_cache(self):
+        return self._decoded_image_cache
+    
+    def get_image_metadata_cache(self):
+        return self._image_metadata_cache
+    
+    def get_negative_lookup_repository(self):
+        return self._negative_lookup_repository
+    
+    def get_derived_image_index(self):
+        return self._derived_image_index
+    
+    def get_access_tracker(self):
+        return self._access_tracker
+    
+    def get_derived_image_collector(self):
+        return self._derived_image_collector
+    
+    def get_derived_image_tiers(self):
+        return self._derived_image_tiers
+    
+    def get_packed_image_store(self):
+        return self._packed_image_store
+    
+    def get_image_store_compactor(self):
+        return self._image_store_compactor
+    
+    def get_content_store(self):
+        return self._content_store
+    
+    def get_public_tree(self):
+        return self._public_tree
+    
+    def get_etag_cache(self):
+        return self._etag_cache
+    
+    def statistics(self):
+        """ @return: a dictionary describing the activity of the image server """
+        return {'derivation_queue': self._derivation_queue.statistics() if self._derivation_queue is not None else None,
+                'derived_image_cache': self._derived_image_cache.statistics() if self._derived_image_cache is not None else None,
+                'decoded_image_cache': self._decoded_image_cache.statistics() if self._decoded_image_cache is not None else None,
+                'image_metadata_cache': self._image_metadata_cache.statistics() if self._image_metadata_cache is not None else None,
+                'negative_lookups': self._negative_lookup_repository.statistics() if self._negative_lookup_repository is not None else None,
+                'derived_image_index': self._derived_image_index.statistics() if self._derived_image_index is not None else None,
+                'derived_image_collector': self._derived_image_collector.statistics() if self._derived_image_collector is not None else None,
+                'derived_image_tiers': self._derived_image_tiers.statistics() if self._derived_image_tiers is not None else None,
+                'packed_images': self._image_store_compactor.statistics() if self._image_store_compactor is not None else None,
+                'content_store': self._content_store.statistics() if self._content_store is not None else None,
+                'public_tree': self._public_tree.statistics() if self._public_tree is not None else None,
+                'etag_cache': self._etag_cache.statistics() if self._etag_cache is not None else None}
+    
     def create_image_server(self):
         configure_logging()
+        if self._config.public_directory is not None and (self._config.derived_image_quota_bytes or self._config.hot_directory is not None):
+            # the derived images sent by the front-end server are never accessed through pymager
+            raise ValueError('public_directory can not be combined with derived_image_quota_bytes nor hot_directory: '
+                             'the accesses served from the public directory are not tracked')
         # 1. make sure to initialize the persistence module
         self._engine = create_engine(self._config.dburi, encoding='utf-8', echo=False, echo_pool=False) # strategy='threadlocal'
         self._sessionmaker = scoped_session(sessionmaker(bind=self._engine, autoflush=True, autocommit=False))
@@ -85,16 +256,116 @@ class ImageServerFactory(object):
         from pymager.persistence.impl.sqlalchemyimagemetadatarepository import SqlAlchemyImageMetadataRepository
         
         self._image_format_mapper = resources.ImageFormatMapper(PilImageFormatMapper())
-        self._path_generator = resources.PathGenerator(NestedPathGenerator(self._image_format_mapper, self._config.data_directory))
+        self._path_generator = resources.PathGenerator(self._create_path_generator())
         self._session_template = persistence.SessionTemplate(self._sessionmaker)
         self._schema_migrator = persistence.SchemaMigrator(SqlAlchemySchemaMigrator(self._engine, self._session_template))
         self._image_metadata_repository = domain.ImageMetadataRepository(SqlAlchemyImageMetadataRepository(self._session_template))
-        self._image_processor = imgengine.ImageRequestProcessor(DefaultImageRequestProcessor(self._image_metadata_repository, self._path_generator, self._image_format_mapper, self._schema_migrator, self._config.data_directory, self._session_template, self._config.dev_mode))
+        self._lock_manager = imgengine.LockManager(self._create_lock_manager())
+        self._derivation_executor = imgengine.DerivationExecutor(self._create_derivation_executor())
+        if self._config.async_derivation_mode not in (ASYNC_DERIVATION_OFF, ASYNC_DERIVATION_ACCEPTED, ASYNC_DERIVATION_PLACEHOLDER):
+            raise ValueError('Unknown asynchronous derivation mode: %s' % (self._config.async_derivation_mode,))
+        if self._config.async_derivation_mode != ASYNC_DERIVATION_OFF and not self._config.background_derivation_workers:
+            raise ValueError('Asynchronous derivation mode %s requires background_derivation_workers > 0' % (self._config.async_derivation_mode,))
+        if self._config.sendfile_mode not in (SENDFILE_OFF, SENDFILE_X_SENDFILE, SENDFILE_X_ACCEL_REDIRECT):
+            raise ValueError('Unknown sendfile mode: %s' % (self._config.sendfile_mode,))
+        if self._config.background_derivation_workers:
+            self._derivation_queue = DerivationQueue(self._config.background_derivation_workers, self._config.background_derivation_queue_size)
+        if self._config.derived_image_index:
+            self._derived_image_index = DerivedImageIndex(self._image_metadata_repository, self._path_generator, self._config.derived_image_index_rebuild_seconds)
+        if self._config.derived_image_quota_bytes:
+            self._access_tracker = AccessTracker(self._image_metadata_repository)
+        if self._config.deduplicate_originals:
+            self._content_store = ContentStore(os.path.join(self._config.data_directory, defaultimagerequestprocessor.BLOB_DIRECTORY))
+        if self._config.public_directory is not None:
+            if self._config.dev_mode and os.path.exists(self._config.public_directory):
+                shutil.rmtree(self._config.public_directory)
+            self._public_tree = PublicTree(self._config.public_directory, self._image_format_mapper)
+        if self._config.packfile_directory is not None:
+            if self._config.dev_mode and os.path.exists(self._config.packfile_directory):
+                shutil.rmtree(self._config.packfile_directory)
+            self._packed_image_store = resources.ImageStore(PackfileImageStore(self._config.packfile_directory, self._config.packfile_segment_bytes, self._config.packfile_compaction_ratio))
+        self._image_processor = imgengine.ImageRequestProcessor(DefaultImageRequestProcessor(self._image_metadata_repository, self._path_generator, self._image_format_mapper, self._schema_migrator, self._config.data_directory, self._session_template, self._config.dev_mode, self._lock_manager, self._derivation_executor, self._config.derivative_source_ratio, self._config.mezzanine_max_size, self._create_readonly_image_metadata_repository(), self._derived_image_index, self._access_tracker, self._derived_image_tiers, self._packed_image_store, self._config.packfile_max_image_bytes, self._content_store, self._public_tree))
+        if self._image_metadata_cache is not None:
+            self._image_processor.add_listener(InvalidatingImageMetadataListener(self._image_metadata_cache))
+        if self._negative_lookup_repository is not None:
+            self._image_processor.add_listener(self._negative_lookup_repository)
+            self._negative_lookup_repository.rebuild_known_ids()
+        if self._derived_image_index is not None:
+            self._derived_image_index.rebuild()
+        if self._config.derived_image_cache_max_bytes:
+            self._derived_image_cache = caching.Cache(LruCache(self._config.derived_image_cache_max_bytes))
+            self._image_processor.add_listener(InvalidatingImageMetadataListener(self._derived_image_cache))
+        if self._config.etag_cache_ttl_seconds:
+            self._etag_cache = caching.Cache(LruCache(self._config.etag_cache_max_entries, lambda entry: 1))
+            self._image_processor.add_listener(InvalidatingImageMetadataListener(self._etag_cache))
         self._image_processor.prepare_transformation = image_transformation_security_decorator.image_transformation_security_decorator(self._config.allowed_sizes)(self._image_processor.prepare_transformation)
+        self._image_processor.prepare_encoded_transformation = image_transformation_security_decorator.image_transformation_security_decorator(self._config.allowed_sizes)(self._image_processor.prepare_encoded_transformation)
+        self._image_processor.find_transformation = image_transformation_security_decorator.image_transformation_security_decorator(self._config.allowed_sizes)(self._image_processor.find_transformation)
+        self._image_processor.prepare_placeholder = image_transformation_security_decorator.image_transformation_security_decorator(self._config.allowed_sizes)(self._image_processor.prepare_placeholder)
+        if self._config.data_directories:
+            link_disks(self._config.data_directory, self._config.data_directories)
+        if self._derived_image_tiers is not None:
+            self._derived_image_tiers.start(self._config.dev_mode)
+        if self._access_tracker is not None:
+            self._derived_image_collector = DerivedImageCollector(self._image_processor, self._access_tracker, self._config.derived_image_quota_bytes, self._config.derived_image_collection_seconds)
+        if self._packed_image_store is not None:
+            self._image_store_compactor = ImageStoreCompactor(self._packed_image_store, self._config.packfile_compaction_seconds)
         
         
         return self._image_processor
     
+    def _create_path_generator(self):
+        """ hot_directory = None means that the derived images are stored in the data directory only, 
+        data_directories = None means that the images are not spread across several data directories """
+        if self._config.data_directories:
+            if self._config.dev_mode:
+                for data_directory in self._config.data_directories:
+                    if os.path.exists(data_directory):
+                        shutil.rmtree(data_directory)
+            path_generator = StripedPathGenerator(self._image_format_mapper, self._config.data_directory, len(self._config.data_directories))
+        else:
+            path_generator = NestedPathGenerator(self._image_format_mapper, self._config.data_directory)
+        if self._config.hot_directory is None:
+            return path_generator
+        tiered_path_generator = TieredPathGenerator(path_generator)
+        self._derived_image_tiers = DerivedImageTiers(tiered_path_generator, self._config.data_directory, self._config.hot_directory, 
+                                                      self._config.hot_tier_max_bytes, self._config.hot_tier_promotion_accesses, self._config.hot_tier_rebalance_seconds)
+        return tiered_path_generator
+    
+    def _create_lock_manager(self):
+        if self._config.lock_manager == LOCK_MANAGER_DATABASE:
+            return DatabaseLeaseLockManager(self._engine, self._config.lock_lease_seconds, self._config.lock_timeout_seconds)
+        elif self._config.lock_manager == LOCK_MANAGER_FILE:
+            return FileLockManager(os.path.join(self._config.data_directory, defaultimagerequestprocessor.LOCK_DIRECTORY), self._config.lock_timeout_seconds)
+        else:
+            raise ValueError('Unknown lock manager: %s' % (self._config.lock_manager,))
+    
+    def _create_readonly_image_metadata_repository(self):
+        """ image_metadata_cache_ttl_seconds = 0 means that the lookups always query the database, 
+        negative_lookup_cache_ttl_seconds = 0 and known_image_ids_rebuild_seconds = 0 mean that the lookups 
+        of unknown ids always query the database """
+        repository = self._image_metadata_repository
+        if self._config.negative_lookup_cache_ttl_seconds or self._config.known_image_ids_rebuild_seconds:
+            self._negative_lookup_repository = NegativeLookupImageMetadataRepository(repository, 
+                                                                                     LruCache(self._config.negative_lookup_cache_max_entries, lambda entry: 1), 
+                                                                                     self._config.negative_lookup_cache_ttl_seconds, 
+                                                                                     self._config.known_image_ids_rebuild_seconds, 
+                                                                                     os.path.join(self._config.data_directory, negativelookupimagemetadatarepository.JOURNAL_FILENAME))
+            repository = domain.ImageMetadataRepository(self._negative_lookup_repository)
+        if self._config.image_metadata_cache_ttl_seconds:
+            self._image_metadata_cache = caching.Cache(LruCache(self._config.image_metadata_cache_max_entries, lambda entry: 1))
+            repository = domain.ImageMetadataRepository(CachingImageMetadataRepository(repository, self._image_metadata_cache, self._config.image_metadata_cache_ttl_seconds))
+        return repository
+    
+    def _create_derivation_executor(self):
+        """ derivation_processes = 0 means that derivations are executed by the request threads, 
+        that can share the decoded images """
+        if self._config.derivation_processes:
+            return ProcessPoolDerivationExecutor(self._config.derivation_processes, self._config.derivation_queue_size)
+        if self._config.decoded_image_cache_max_bytes:
+            self._decoded_image_cache = caching.Cache(LruCache(self._config.decoded_image_cache_max_bytes))
+        return InlineDerivationExecutor(self._decoded_image_cache)
+    
     schema_migrator = property(get_schema_migrator, None, None, "PersistenceProvider's Docstring")
     image_metadata_repository = property(get_image_metadata_repository, None, None, "domain.ImageMetadataRepository's Docstring")
     image_processor = property(get_image_processor, None, None, "ImageProcessor's Docstring")
@@ -103,6 +374,22 @@ class ImageServerFactory(object):
     session_template = property(get_session_template, None, None, "ImageProcessor's Docstring")
     image_format_mapper = property(get_image_format_mapper, None, None, "Image Format Mapper")
     path_generator = property(get_path_generator, None, None, "Path Generator")
+    lock_manager = property(get_lock_manager, None, None, "Lock Manager")
+    derivation_executor = property(get_derivation_executor, None, None, "Derivation Executor")
+    derivation_queue = property(get_derivation_queue, None, None, "Background Derivation Queue (None when disabled)")
+    derived_image_cache = property(get_derived_image_cache, None, None, "Cache of the derived image files (None when disabled)")
+    decoded_image_cache = property(get_decoded_image_cache, None, None, "Cache of the decoded source images (None when disabled)")
+    image_metadata_cache = property(get_image_metadata_cache, None, None, "Cache of the original image metadatas (None when disabled)")
+    negative_lookup_repository = property(get_negative_lookup_repository, None, None, "Filter of the unknown image ids (None when disabled)")
+    derived_image_index = property(get_derived_image_index, None, None, "Index of the complete derived images (None when disabled)")
+    access_tracker = property(get_access_tracker, None, None, "Recorder of the accesses to the derived images (None when disabled)")
+    derived_image_collector = property(get_derived_image_collector, None, None, "Garbage collector of the derived images (None when disabled)")
+    derived_image_tiers = property(get_derived_image_tiers, None, None, "Mover of the derived images between the storage tiers (None when disabled)")
+    packed_image_store = property(get_packed_image_store, None, None, "Store of the small derived images (None when disabled)")
+    image_store_compactor = property(get_image_store_compactor, None, None, "Compactor of the packed image store (None when disabled)")
+    content_store = property(get_content_store, None, None, "Store of the files that have the same content (None when disabled)")
+    public_tree = property(get_public_tree, None, None, "Links of the derived images under their public URL (None when disabled)")
+    etag_cache = property(get_etag_cache, None, None, "Cache of the entity tags of the derived images (None when disabled)")
 
 def configure_logging():
     logging.basicConfig()
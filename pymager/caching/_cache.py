@@ -0,0 +1,32 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from zope.interface import Interface, implements
+
+class Cache(Interface):
+    """ A bounded, in-process cache """
+    
+    def get(self, key):
+        """ @return: the value stored for key, or None if it is not in the cache """
+    
+    def put(self, key, value):
+        """ stores value for key, possibly evicting other values """
+    
+    def invalidate(self, key):
+        """ removes the value stored for key, if any """
+    
+    def statistics(self):
+        """ @return: a dictionary describing the content and efficiency of the cache """
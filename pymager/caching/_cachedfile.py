@@ -0,0 +1,26 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+class CachedFile(object):
+    """ The content of a file, as stored in a Cache. Its length is the length of the content, 
+    so that LruCache budgets are expressed in bytes """
+    def __init__(self, body, modification_time, content_type):
+        self.body = body
+        self.modification_time = modification_time
+        self.content_type = content_type
+    
+    def __len__(self):
+        return len(self.body)
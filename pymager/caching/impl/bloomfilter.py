@@ -0,0 +1,52 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import math
+import struct
+import hashlib
+
+class BloomFilter(object):
+    """ A set of keys that can answer 'definitely absent' without storing the keys : 
+    a key that was added is always found, and a key that was not added is found 
+    with a probability of about error_rate, as long as no more than capacity keys are added.
+    Keys cannot be removed """
+    
+    def __init__(self, capacity, error_rate=0.01):
+        self.__bits = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.__hashes = max(1, int(round(self.__bits * math.log(2) / capacity)))
+        self.__array = bytearray((self.__bits + 7) // 8)
+        self.__count = 0
+    
+    def __positions(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        h1, h2 = struct.unpack('<QQ', hashlib.md5(key).digest())
+        return [(h1 + i * h2) % self.__bits for i in xrange(self.__hashes)]
+    
+    def add(self, key):
+        for position in self.__positions(key):
+            self.__array[position // 8] |= 1 << (position % 8)
+        self.__count += 1
+    
+    def __contains__(self, key):
+        for position in self.__positions(key):
+            if not self.__array[position // 8] & (1 << (position % 8)):
+                return False
+        return True
+    
+    def __len__(self):
+        """ the number of keys that were added """
+        return self.__count
@@ -0,0 +1,88 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import time
+from zope.interface import implements
+from pymager import domain
+from pymager import caching
+
+class CachingImageMetadataRepository(object):
+    """ A read-through domain.ImageMetadataRepository, that keeps the original image metadatas 
+    whose status is OK in a caching.Cache, keyed by id. Their id, size and format never change, 
+    so they are returned as detached copies, that must only be read : 
+    the callers that modify image metadatas must use the underlying repository.
+    The entries expire after ttl_seconds, so that deletions made by other processes are eventually seen.
+    """
+    implements(domain.ImageMetadataRepository)
+    
+    def __init__(self, image_metadata_repository, cache, ttl_seconds):
+        self.__image_metadata_repository = domain.ImageMetadataRepository(image_metadata_repository)
+        self.__cache = caching.Cache(cache)
+        self.__ttl_seconds = ttl_seconds
+    
+    def find_original_image_metadata_by_id(self, image_id):
+        entry = self.__cache.get(image_id)
+        if entry is not None and entry[0] > time.time():
+            return self.__copy(entry[1])
+        
+        original_image_metadata = self.__image_metadata_repository.find_original_image_metadata_by_id(image_id)
+        if original_image_metadata is None or original_image_metadata.status != domain.STATUS_OK:
+            self.__cache.invalidate(image_id)
+            return original_image_metadata
+        
+        copy = self.__copy(original_image_metadata)
+        self.__cache.put(image_id, (time.time() + self.__ttl_seconds, copy))
+        return self.__copy(copy)
+    
+    def __copy(self, original_image_metadata):
+        copy = domain.OriginalImageMetadata(original_image_metadata.id, original_image_metadata.status, original_image_metadata.size, original_image_metadata.format)
+        copy.content_hash = original_image_metadata.content_hash
+        return copy
+    
+    def find_original_image_metadata_ids(self):
+        return self.__image_metadata_repository.find_original_image_metadata_ids()
+    
+    def find_inconsistent_original_image_metadatas(self, maxResults=100):
+        return self.__image_metadata_repository.find_inconsistent_original_image_metadatas(maxResults)
+    
+    def find_inconsistent_derived_image_metadatas(self, maxResults=100):
+        return self.__image_metadata_repository.find_inconsistent_derived_image_metadatas(maxResults)
+    
+    def find_derived_image_metadata_ids_by_status(self, status):
+        return self.__image_metadata_repository.find_derived_image_metadata_ids_by_status(status)
+    
+    def find_least_recently_accessed_derived_image_metadatas(self, maxResults=100):
+        return self.__image_metadata_repository.find_least_recently_accessed_derived_image_metadatas(maxResults)
+    
+    def find_unmeasured_derived_image_metadatas(self, maxResults=100):
+        return self.__image_metadata_repository.find_unmeasured_derived_image_metadatas(maxResults)
+    
+    def sum_derived_image_metadata_file_sizes(self):
+        return self.__image_metadata_repository.sum_derived_image_metadata_file_sizes()
+    
+    def update_derived_image_metadata_last_access_dates(self, derived_image_ids, last_access_date):
+        self.__image_metadata_repository.update_derived_image_metadata_last_access_dates(derived_image_ids, last_access_date)
+    
+    def find_derived_image_metadata_by_original_image_metadata_id_size_and_format(self, image_id, size, format):
+        return self.__image_metadata_repository.find_derived_image_metadata_by_original_image_metadata_id_size_and_format(image_id, size, format)
+    
+    def add(self, item):
+        self.__cache.invalidate(item.id)
+        self.__image_metadata_repository.add(item)
+    
+    def delete(self, item):
+        self.__cache.invalidate(item.id)
+        self.__image_metadata_repository.delete(item)
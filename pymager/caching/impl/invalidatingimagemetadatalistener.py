@@ -0,0 +1,32 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from zope.interface import implements
+from pymager import imgengine
+from pymager import caching
+
+class InvalidatingImageMetadataListener(object):
+    """ Removes the saved and deleted images from a caching.Cache whose keys are image metadata ids """
+    implements(imgengine.ImageMetadataListener)
+    
+    def __init__(self, cache):
+        self.__cache = caching.Cache(cache)
+    
+    def image_metadata_saved(self, image_metadata_id):
+        self.__cache.invalidate(image_metadata_id)
+    
+    def image_metadata_deleted(self, image_metadata_id):
+        self.__cache.invalidate(image_metadata_id)
@@ -0,0 +1,78 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import with_statement
+import threading
+from collections import OrderedDict
+from zope.interface import implements
+from pymager import caching
+
+class LruCache(object):
+    """ A caching.Cache that evicts the least recently used values once the total size 
+    of the values exceeds a budget. Values larger than the budget are not cached """
+    implements(caching.Cache)
+    
+    def __init__(self, max_size, sizeof=len):
+        """ @param max_size: the budget, in the unit of sizeof (e.g. bytes)
+            @param sizeof: a function that returns the size of a value """
+        self.__max_size = max_size
+        self.__sizeof = sizeof
+        self.__entries = OrderedDict()
+        self.__size = 0
+        self.__lock = threading.Lock()
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+    
+    def get(self, key):
+        with self.__lock:
+            if key not in self.__entries:
+                self.__misses += 1
+                return None
+            self.__hits += 1
+            value, size = self.__entries.pop(key)
+            self.__entries[key] = (value, size)
+            return value
+    
+    def put(self, key, value):
+        size = self.__sizeof(value)
+        with self.__lock:
+            self.__remove(key)
+            if size > self.__max_size:
+                return
+            self.__entries[key] = (value, size)
+            self.__size += size
+            while self.__size > self.__max_size:
+                self.__remove(self.__entries.iterkeys().next())
+                self.__evictions += 1
+    
+    def invalidate(self, key):
+        with self.__lock:
+            self.__remove(key)
+    
+    def __remove(self, key):
+        if key in self.__entries:
+            value, size = self.__entries.pop(key)
+            self.__size -= size
+    
+    def statistics(self):
+        with self.__lock:
+            return {'entries': len(self.__entries),
+                    'size': self.__size,
+                    'max_size': self.__max_size,
+                    'hits': self.__hits,
+                    'misses': self.__misses,
+                    'evictions': self.__evictions}
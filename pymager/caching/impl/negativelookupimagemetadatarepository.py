@@ -0,0 +1,290 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import with_statement
+import os
+import time
+import errno
+import tempfile
+import logging
+import threading
+from collections import OrderedDict
+from zope.interface import implements
+from pymager import domain
+from pymager import imgengine
+from pymager import caching
+from pymager.caching.impl.bloomfilter import BloomFilter
+
+logger = logging.getLogger("caching.negativelookupimagemetadatarepository")
+
+# the name of the journal of the saved ids, in the data directory
+JOURNAL_FILENAME = "known-ids.journal"
+
+# the journal is replaced by an empty one when a filter is rebuilt, once it is larger than this
+JOURNAL_MAX_BYTES = 1024 * 1024
+
+# how many of the ids appended to the journal by this process are remembered, so that an image that is 
+# saved several times (claimed, then published) is only appended once
+JOURNALED_IDS = 1024
+
+# how long to wait before trying to rebuild the filter again, when the database is not available
+RETRY_SECONDS = 10
+
+class NegativeLookupImageMetadataRepository(object):
+    """ A domain.ImageMetadataRepository that answers the lookups of unknown original image ids
+    without querying the database :
+     - a BloomFilter of the known ids, loaded from the database and rebuilt every known_ids_rebuild_seconds 
+       in a background thread, rejects most unknown ids
+     - the ids that were not found are kept in a caching.Cache for miss_ttl_seconds
+    Both are told about the images saved by this process, through the ImageMetadataListener interface. 
+    
+    The processes that share the database append the ids they save to a journal, that is read before an id is rejected : 
+    an image saved by another process is found as soon as it is saved. When a process replaces the journal 
+    (so that it does not grow forever), the other processes query the database for the ids they would reject, 
+    until they have rebuilt their filter. Without a journal, the images saved by other processes are seen 
+    once the filter is rebuilt and the misses expire. 
+    As the journal is only replaced when the filter is rebuilt, there is no journal when the filter is disabled """
+    implements(domain.ImageMetadataRepository, imgengine.ImageMetadataListener)
+    
+    def __init__(self, image_metadata_repository, miss_cache, miss_ttl_seconds, known_ids_rebuild_seconds=0, journal_filename=None):
+        """ @param known_ids_rebuild_seconds: 0 disables the filter of the known ids 
+            @param journal_filename: the journal of the ids saved by all the processes, None to only see 
+            the images saved by this process. Ignored when the filter is disabled """
+        self.__image_metadata_repository = domain.ImageMetadataRepository(image_metadata_repository)
+        self.__miss_cache = caching.Cache(miss_cache)
+        self.__miss_ttl_seconds = miss_ttl_seconds
+        self.__known_ids_rebuild_seconds = known_ids_rebuild_seconds
+        self.__journal_filename = journal_filename if known_ids_rebuild_seconds else None
+        self.__journaled_ids = OrderedDict()
+        # the inode of the journal, and the offset up to which it has been read
+        self.__journal_position = (None, 0)
+        self.__known_ids = None
+        self.__known_ids_expiry = 0
+        self.__saved_ids_while_rebuilding = None
+        self.__rebuilding_in_background = False
+        self.__lock = threading.Lock()
+        self.__rebuild_lock = threading.Lock()
+        self.__rejected_by_known_ids = 0
+        self.__rejected_by_misses = 0
+    
+    def rebuild_known_ids(self):
+        """ Loads the ids of all the original images. Concurrent lookups keep using the previous filter """
+        if not self.__known_ids_rebuild_seconds or not self.__rebuild_lock.acquire(False):
+            return
+        try:
+            with self.__lock:
+                self.__saved_ids_while_rebuilding = []
+            try:
+                # the ids that are appended to the journal from now on are read into the new filter
+                journal_inode = self.__replace_journal_if_too_large()
+                ids = self.__image_metadata_repository.find_original_image_metadata_ids()
+                known_ids = BloomFilter(max(2 * len(ids), 10000))
+                for image_id in ids:
+                    known_ids.add(image_id)
+            finally:
+                with self.__lock:
+                    saved_ids, self.__saved_ids_while_rebuilding = self.__saved_ids_while_rebuilding, None
+            with self.__lock:
+                for image_id in saved_ids:
+                    known_ids.add(image_id)
+                self.__known_ids = known_ids
+                self.__journal_position = (journal_inode, 0)
+                self.__known_ids_expiry = time.time() + self.__known_ids_rebuild_seconds
+            self.__read_journal()
+            logger.info("Loaded %s known image ids" % (len(ids),))
+        finally:
+            self.__rebuild_lock.release()
+    
+    def __rebuild_in_background(self):
+        with self.__lock:
+            if self.__rebuilding_in_background:
+                return
+            self.__rebuilding_in_background = True
+        thread = threading.Thread(target=self.__rebuild_quietly, name="known-ids-rebuild")
+        thread.setDaemon(True)
+        thread.start()
+    
+    def __rebuild_quietly(self):
+        try:
+            try:
+                self.rebuild_known_ids()
+            except Exception, ex:
+                logger.warning("Impossible to load the known image ids: %s" % (ex,))
+                with self.__lock:
+                    self.__known_ids_expiry = time.time() + RETRY_SECONDS
+        finally:
+            with self.__lock:
+                self.__rebuilding_in_background = False
+    
+    def __replace_journal_if_too_large(self):
+        """ the ids of the replaced journal have been saved to the database before they were appended : 
+        they are all loaded into the filter that is being rebuilt 
+        @return: the inode of the journal, None if there is none """
+        if self.__journal_filename is None:
+            return None
+        try:
+            stat = os.stat(self.__journal_filename)
+        except OSError, ex:
+            if ex.errno != errno.ENOENT:
+                raise
+            return None
+        if stat.st_size <= JOURNAL_MAX_BYTES:
+            return stat.st_ino
+        fd, temporary_filename = tempfile.mkstemp(prefix='.', suffix='.tmp', dir=os.path.dirname(self.__journal_filename))
+        os.close(fd)
+        os.rename(temporary_filename, self.__journal_filename)
+        return os.stat(self.__journal_filename).st_ino
+    
+    def __append_to_journal(self, image_id):
+        with self.__lock:
+            if image_id in self.__journaled_ids:
+                return
+            self.__journaled_ids[image_id] = True
+            if len(self.__journaled_ids) > JOURNALED_IDS:
+                self.__journaled_ids.popitem(last=False)
+        try:
+            with open(self.__journal_filename, 'a') as journal:
+                journal.write('%s\n' % (image_id,))
+        except IOError, ex:
+            logger.warning("Impossible to append %s to the journal of the known image ids: %s" % (image_id, ex))
+    
+    def __read_journal(self):
+        """ adds the ids that the processes appended to the journal to the filter, and forgets their misses 
+        @return: False if the journal has been replaced since it was read : the ids may be missing from the filter """
+        if self.__journal_filename is None:
+            return True
+        try:
+            stat = os.stat(self.__journal_filename)
+        except OSError, ex:
+            if ex.errno != errno.ENOENT:
+                raise
+            stat = None
+        with self.__lock:
+            journal_inode, offset = self.__journal_position
+            if stat is None or (journal_inode is not None and journal_inode != stat.st_ino) or stat.st_size < offset:
+                replaced = stat is not None or journal_inode is not None
+                if replaced:
+                    self.__known_ids_expiry = 0
+                return not replaced
+            if stat.st_size == offset:
+                return True
+            with open(self.__journal_filename, 'rb') as journal:
+                journal.seek(offset)
+                data = journal.read(stat.st_size - offset)
+            # the last line may still be being written
+            data = data[:data.rfind('\n') + 1]
+            image_ids = data.splitlines()
+            for image_id in image_ids:
+                if self.__known_ids is not None:
+                    self.__known_ids.add(image_id)
+            self.__journal_position = (stat.st_ino, offset + len(data))
+        for image_id in image_ids:
+            self.__miss_cache.invalidate(image_id)
+        return True
+    
+    def __rejection(self, image_id):
+        """ @return: what rejects the id, None if it has to be looked up """
+        with self.__lock:
+            if self.__known_ids is not None and image_id not in self.__known_ids:
+                return 'known_ids'
+        expiry = self.__miss_cache.get(image_id)
+        if expiry is not None and expiry > time.time():
+            return 'misses'
+        return None
+    
+    def __is_unknown(self, image_id):
+        if self.__known_ids_rebuild_seconds:
+            if self.__known_ids is None:
+                self.rebuild_known_ids()
+            elif self.__known_ids_expiry <= time.time():
+                self.__rebuild_in_background()
+        if self.__rejection(image_id) is None:
+            return False
+        # the id may have been saved by another process
+        if not self.__read_journal():
+            return False
+        rejection = self.__rejection(image_id)
+        with self.__lock:
+            if rejection == 'known_ids':
+                self.__rejected_by_known_ids += 1
+            elif rejection == 'misses':
+                self.__rejected_by_misses += 1
+        return rejection is not None
+    
+    def find_original_image_metadata_by_id(self, image_id):
+        if self.__is_unknown(image_id):
+            return None
+        original_image_metadata = self.__image_metadata_repository.find_original_image_metadata_by_id(image_id)
+        if original_image_metadata is None and self.__miss_ttl_seconds:
+            self.__miss_cache.put(image_id, time.time() + self.__miss_ttl_seconds)
+        return original_image_metadata
+    
+    def image_metadata_saved(self, image_metadata_id):
+        if self.__journal_filename is not None:
+            self.__append_to_journal(image_metadata_id)
+        with self.__lock:
+            if self.__known_ids is not None:
+                self.__known_ids.add(image_metadata_id)
+            if self.__saved_ids_while_rebuilding is not None:
+                self.__saved_ids_while_rebuilding.append(image_metadata_id)
+        self.__miss_cache.invalidate(image_metadata_id)
+    
+    def image_metadata_deleted(self, image_metadata_id):
+        """ the filter cannot forget the id : its lookups go to the database until the filter is rebuilt. 
+        An image that is saved again is appended to the journal again, for the processes that rebuilt their filter since """
+        with self.__lock:
+            self.__journaled_ids.pop(image_metadata_id, None)
+    
+    def statistics(self):
+        with self.__lock:
+            return {'known_ids': len(self.__known_ids) if self.__known_ids is not None else None,
+                    'rejected_by_known_ids': self.__rejected_by_known_ids,
+                    'rejected_by_misses': self.__rejected_by_misses,
+                    'misses': self.__miss_cache.statistics()}
+    
+    def find_original_image_metadata_ids(self):
+        return self.__image_metadata_repository.find_original_image_metadata_ids()
+    
+    def find_inconsistent_original_image_metadatas(self, maxResults=100):
+        return self.__image_metadata_repository.find_inconsistent_original_image_metadatas(maxResults)
+    
+    def find_inconsistent_derived_image_metadatas(self, maxResults=100):
+        return self.__image_metadata_repository.find_inconsistent_derived_image_metadatas(maxResults)
+    
+    def find_derived_image_metadata_ids_by_status(self, status):
+        return self.__image_metadata_repository.find_derived_image_metadata_ids_by_status(status)
+    
+    def find_least_recently_accessed_derived_image_metadatas(self, maxResults=100):
+        return self.__image_metadata_repository.find_least_recently_accessed_derived_image_metadatas(maxResults)
+    
+    def find_unmeasured_derived_image_metadatas(self, maxResults=100):
+        return self.__image_metadata_repository.find_unmeasured_derived_image_metadatas(maxResults)
+    
+    def sum_derived_image_metadata_file_sizes(self):
+        return self.__image_metadata_repository.sum_derived_image_metadata_file_sizes()
+    
+    def update_derived_image_metadata_last_access_dates(self, derived_image_ids, last_access_date):
+        self.__image_metadata_repository.update_derived_image_metadata_last_access_dates(derived_image_ids, last_access_date)
+    
+    def find_derived_image_metadata_by_original_image_metadata_id_size_and_format(self, image_id, size, format):
+        return self.__image_metadata_repository.find_derived_image_metadata_by_original_image_metadata_id_size_and_format(image_id, size, format)
+    
+    def add(self, item):
+        self.__image_metadata_repository.add(item)
+        self.image_metadata_saved(item.id)
+    
+    def delete(self, item):
+        self.__image_metadata_repository.delete(item)
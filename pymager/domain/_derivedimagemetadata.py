@@ -14,6 +14,7 @@
    limitations under the License.
 """
 
+from datetime import datetime
 from pymager.domain._abstractimagemetadata import AbstractImageMetadata 
 
 class DerivedImageMetadata(AbstractImageMetadata):
@@ -22,11 +23,25 @@ class DerivedImageMetadata(AbstractImageMetadata):
         self._original_image_metadata = original_image_metadata
         
         super(DerivedImageMetadata, self).__init__("%s-%sx%s-%s" % (original_image_metadata.id, size[0], size[1], format), status, size, format)
+        # approximate : the accesses are recorded in batches
+        self._last_access_date = datetime.utcnow()
+        # the size of the file, in bytes, once it has been created
+        self._file_size = None
 
     def get_original_image_metadata(self):
         return self._original_image_metadata
     
+    def get_last_access_date(self):
+        return self._last_access_date
+    
+    def get_file_size(self):
+        return self._file_size
+    def set_file_size(self, value):
+        self._file_size = value
+    
     def associated_image_path(self, path_generator):
         return path_generator.derived_path(self)
     
     original_image_metadata = property(get_original_image_metadata, None, None, None)
+    last_access_date = property(get_last_access_date, None, None, None)
+    file_size = property(get_file_size, set_file_size, None, None)
@@ -37,12 +37,30 @@ class ImageMetadataRepository(Interface):
     def find_original_image_metadata_by_id(self, image_id):
         """ Find an OriginalImageMetadata by its ID """
     
+    def find_original_image_metadata_ids(self):
+        """ Find the IDs of all the Original Items """
+    
     def find_inconsistent_original_image_metadatas(self, maxResults=100):
         """ Find Original Items that are in an inconsistent state """
     
     def find_inconsistent_derived_image_metadatas(self, maxResults=100):
         """ Find Derived Items that are in an inconsistent state """
     
+    def find_derived_image_metadata_ids_by_status(self, status):
+        """ Find the IDs of the Derived Items that have the given status """
+    
+    def find_least_recently_accessed_derived_image_metadatas(self, maxResults=100):
+        """ Find the OK Derived Items that have been accessed the least recently """
+    
+    def find_unmeasured_derived_image_metadatas(self, maxResults=100):
+        """ Find the OK Derived Items whose file size is unknown """
+    
+    def sum_derived_image_metadata_file_sizes(self):
+        """ @return: the total size, in bytes, of the files of the Derived Items """
+    
+    def update_derived_image_metadata_last_access_dates(self, derived_image_ids, last_access_date):
+        """ Sets the last access date of the given Derived Items, without loading them """
+    
     def find_derived_image_metadata_by_original_image_metadata_id_size_and_format(self, image_id, size, format):
         """ Find Derived Items By :
             - the Original Item ID
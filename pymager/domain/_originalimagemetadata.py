@@ -20,6 +20,15 @@ class OriginalImageMetadata(AbstractImageMetadata):
     def __init__(self, itemId, status, size, format):
         assert itemId is not None
         super(OriginalImageMetadata, self).__init__(itemId, status, size, format)
+        # the SHA-1 hash of the file, when it is shared with the images that have the same content
+        self._content_hash = None
+    
+    def get_content_hash(self):
+        return self._content_hash
+    def set_content_hash(self, value):
+        self._content_hash = value
     
     def associated_image_path(self, path_generator):
         return path_generator.original_path(self)
+    
+    content_hash = property(get_content_hash, set_content_hash, None, None)
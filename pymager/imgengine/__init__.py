@@ -19,7 +19,12 @@ from pymager.imgengine._imageformatnotsupportedexception import ImageFormatNotSu
 from pymager.imgengine._imagestreamnotrecognizedexception import ImageStreamNotRecognizedException
 from pymager.imgengine._imageidalreadyexistsexception import ImageIDAlreadyExistsException
 from pymager.imgengine._imagemetadatanotfoundexception import ImageMetadataNotFoundException
+from pymager.imgengine._locktimeoutexception import LockTimeoutException
+from pymager.imgengine._derivationqueuefullexception import DerivationQueueFullException
 from pymager.imgengine.image_transformation_security_decorator import SecurityCheckException
 from pymager.imgengine._imagerequestprocessor import ImageRequestProcessor
 from pymager.imgengine._transformationrequest import TransformationRequest
+from pymager.imgengine._lockmanager import LockManager
+from pymager.imgengine._derivationexecutor import DerivationExecutor
+from pymager.imgengine._imagemetadatalistener import ImageMetadataListener
         
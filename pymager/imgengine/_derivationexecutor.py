@@ -0,0 +1,52 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from zope.interface import Interface, implements
+
+class DerivationExecutor(Interface):
+    """ Executes the CPU-bound part of a transformation : decoding, resizing and encoding images """
+    
+    def derive(self, source_filename, target_filename, size, target_format):
+        """ Creates target_filename, a derivative of source_filename that has the given size and format
+        @return: target_filename
+        @raise imgengine.DerivationQueueFullException: if too many derivations are already pending
+        @raise imgengine.ImageProcessingException: if the derivation fails
+        """
+    
+    def derive_mezzanine(self, source_filename, target_filename, size, target_format):
+        """ Same as derive(), but target_filename is encoded with as few losses as its format allows, 
+        as it is the source of other derived images
+        @return: target_filename
+        """
+    
+    def derive_all(self, source_filename, derivations):
+        """ Same as derive(), for a list of (target_filename, size, target_format) derivations 
+        of the same source image, that is decoded only once
+        @return: the list of target filenames
+        """
+    
+    def encode_all(self, source_filename, derivations):
+        """ Same as derive_all(), but also returns the encoded images, that have been written 
+        to their target file in one pass : they can be sent without reading the files again
+        @return: the list of encoded images (str), in the order of the derivations
+        """
+    
+    def forget(self, source_filename):
+        """ Releases what the executor keeps about the given source image (e.g. its decoded pixels), 
+        that has been deleted """
+    
+    def shutdown(self):
+        """ Releases the resources (e.g. worker processes) of the executor """
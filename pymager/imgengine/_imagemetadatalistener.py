@@ -0,0 +1,26 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from zope.interface import Interface, implements
+
+class ImageMetadataListener(Interface):
+    """ Gets notified of the changes made by an ImageRequestProcessor, e.g. to invalidate caches """
+    
+    def image_metadata_saved(self, image_metadata_id):
+        """ called when the given original image is created, and again when it is published """
+    
+    def image_metadata_deleted(self, image_metadata_id):
+        """ called when the given original or derived image is deleted """
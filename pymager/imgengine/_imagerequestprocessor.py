@@ -34,6 +34,12 @@ class ImageRequestProcessor(Interface):
         @raise imgengine.ImageProcessingException if unknown exceptions happen during the save process
         """
     
+    def save_stream_to_repository(self, chunks, image_id):
+        """ Same as save_file_to_repository(), for an image that is received in chunks, 
+        e.g. while the request body is parsed : it is written once, without being spooled first
+        @param chunks: an iterable of the content of the image (str)
+        """
+    
     def prepare_transformation(self, transformationRequest):
         """ Takes an ImageRequest and prepare the output for it. 
         Updates the database so that it is in sync with the filesystem
@@ -42,11 +48,64 @@ class ImageRequestProcessor(Interface):
         @raise imgengine.ImageProcessingException in case of any non-recoverable error 
         """
     
+    def prepare_encoded_transformation(self, transformationRequest):
+        """ Same as prepare_transformation(), but also returns the derived image if it has just been encoded : 
+        it can be sent while it is written to the cache, without reading its file again
+        @return: the path to the generated file (relative to the data directory), and the resources.StoredImage 
+        of the derived image, or None if it already existed
+        """
+    
+    def find_transformation(self, transformationRequest):
+        """ Same as prepare_transformation(), without preparing the output when it does not exist yet
+        @return: the path to the generated file (relative to the data directory), or None if it has not been prepared
+        @raise imgengine.ImageMetadataNotFoundException: if image_id does not exist
+        """
+    
+    def forget_transformation(self, transformationRequest):
+        """ Called when the file returned by prepare_transformation() or find_transformation() is missing 
+        (e.g. deleted or moved by another process) : it is looked up again by the next calls
+        """
+    
+    def get_derived_image_etag(self, transformationRequest, relative_path=None, stored_image=None):
+        """ Computed from the prepared derived image, without asking the database
+        @param relative_path: the path returned by prepare_transformation(), so that the derived image is not looked up again 
+        @param stored_image: the content of the derived image, if it is already in memory (any object that has 
+        a length and a modification_time, e.g. a resources.StoredImage), so that its file is not looked at 
+        @return: a strong entity tag of the derived image, that changes when its file is created again 
+        (e.g. when the image id is reused), or None if the derived image has not been prepared
+        """
+    
+    def prepare_placeholder(self, transformationRequest):
+        """ Prepares a cheap image that has the size and format of the requested image, 
+        to be served while the requested image is being prepared
+        @return: the path to the placeholder file (relative to the data directory)
+        @raise imgengine.ImageProcessingException in case of any non-recoverable error 
+        """
+    
+    def pregenerate(self, image_id, sizes, target_formats):
+        """ Prepares the derived images of the given image, for all the given sizes and formats, 
+        so that the first requests for them do not have to wait for their creation
+        @param sizes: a list of (width, height) tuples
+        @param target_formats: a list of formats, as accepted by TransformationRequest
+        @return: the paths to the generated files (relative to the data directory)
+        @raise imgengine.ImageMetadataNotFoundException: if image_id does not exist
+        @raise imgengine.ImageProcessingException in case of any non-recoverable error 
+        """
+    
     def delete(self, image_id):
         """ Deletes the given item, and its associated item (in the case of an original 
         item that has derived items based on it)
         @raise imgengine.ImageMetadataNotFoundException: if image_id does not exist
         """
     
+    def collect_derived_images(self, max_bytes):
+        """ Deletes the least recently accessed derived images, until their files use no more than max_bytes. 
+        They are prepared again the next time they are requested
+        @return: the number of deleted derived images
+        """
+    
+    def add_listener(self, listener):
+        """ @param listener: an imgengine.ImageMetadataListener that will be notified of the changes """
+    
     def cleanup_inconsistent_items(self):
         """ deletes the files and items whose status is not OK (startup cleanup)"""
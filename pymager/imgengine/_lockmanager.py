@@ -0,0 +1,27 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from zope.interface import Interface, implements
+
+class LockManager(Interface):
+    """ Grants exclusive access to the creation of an item (original or derived image), 
+    across threads and, depending on the implementation, across processes """
+    
+    def acquire(self, key):
+        """ Blocks until the exclusive lock for the given key is granted
+        @return: a lock object, whose release() method must be called once the work is done
+        @raise imgengine.LockTimeoutException: if the lock could not be acquired in time
+        """
@@ -0,0 +1,22 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from pymager.imgengine._imageprocessingexception import ImageProcessingException
+
+class LockTimeoutException(ImageProcessingException):
+    def __init__(self, key):
+        super(LockTimeoutException, self).__init__('Item seems to be locked forever: %s' % key)
+        self.key = key
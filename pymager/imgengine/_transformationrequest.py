@@ -32,5 +32,11 @@ class TransformationRequest(object):
         self.size = size
         self.target_format = target_format
 
+    def get_derived_image_id(self):
+        """ @return: the id of the derived image metadata that this request is about """
+        return "%s-%sx%s-%s" % (self.image_id, self.size[0], self.size[1], self.target_format)
+    
+    derived_image_id = property(get_derived_image_id, None, None, None)
+    
     def __str__(self):
         return "TransformationRequest: %s %s %s" % (self.image_id, self.size, self.target_format)
\ No newline at end of file
@@ -0,0 +1,57 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import with_statement
+import logging
+import threading
+from datetime import datetime
+from pymager import domain
+
+logger = logging.getLogger("imgengine.accesstracker")
+
+# the maximum number of ids updated by a single statement
+FLUSH_BATCH_SIZE = 500
+
+class AccessTracker(object):
+    """ Records the accesses to the derived images in memory, and writes them to the database 
+    in batches, when flush() is called : the last access dates are approximate, 
+    but serving an image never writes to the database """
+    
+    def __init__(self, image_metadata_repository):
+        self.__image_metadata_repository = domain.ImageMetadataRepository(image_metadata_repository)
+        self.__accessed_ids = set()
+        self.__lock = threading.Lock()
+        self.__flushed = 0
+    
+    def record(self, derived_image_id):
+        with self.__lock:
+            self.__accessed_ids.add(derived_image_id)
+    
+    def flush(self):
+        """ Sets the last access date of the derived images accessed since the previous flush to now. 
+        The accesses that cannot be written are lost """
+        with self.__lock:
+            accessed_ids, self.__accessed_ids = list(self.__accessed_ids), set()
+        now = datetime.utcnow()
+        for i in range(0, len(accessed_ids), FLUSH_BATCH_SIZE):
+            self.__image_metadata_repository.update_derived_image_metadata_last_access_dates(accessed_ids[i:i + FLUSH_BATCH_SIZE], now)
+        with self.__lock:
+            self.__flushed += len(accessed_ids)
+    
+    def statistics(self):
+        with self.__lock:
+            return {'pending_accesses': len(self.__accessed_ids),
+                    'flushed_accesses': self.__flushed}
@@ -0,0 +1,122 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import with_statement
+import os
+import errno
+import logging
+import threading
+from pymager.imgengine._deleteimagescommand import remove_file
+
+logger = logging.getLogger("imgengine.contentstore")
+
+class ContentStore(object):
+    """ Stores the files that have the same content once : every file is a hard link to a blob, named after 
+    its content, e.g. the SHA-1 hash of an original image, or the SHA-1 hash and size of a derived image. 
+    The number of links of a blob counts its references : a blob is removed once it is only linked from 
+    the blob directory. 
+    
+    Files can only be linked to blobs of the same filesystem : the files of the other filesystems 
+    (e.g. a hot tier or another disk) are stored as plain copies. Concurrent saves and releases 
+    never lose data : at worst, a content is stored twice """
+    
+    def __init__(self, blob_directory):
+        self.__blob_directory = blob_directory
+        self.__lock = threading.Lock()
+        self.__counts = {'linked_files': 0, 'stored_blobs': 0, 'released_blobs': 0}
+    
+    def blob_path(self, key):
+        return os.path.join(self.__blob_directory, key[:2], key[2:4], key)
+    
+    def __same_filesystem(self, filename):
+        if not os.path.exists(self.__blob_directory):
+            os.makedirs(self.__blob_directory)
+        return os.stat(self.__blob_directory).st_dev == os.stat(os.path.dirname(filename)).st_dev
+    
+    def __count(self, counter):
+        with self.__lock:
+            self.__counts[counter] += 1
+    
+    def __link(self, blob, filename):
+        """ @return: False if the blob does not exist (anymore) """
+        remove_file(filename)
+        try:
+            os.link(blob, filename)
+        except OSError, ex:
+            if ex.errno != errno.ENOENT:
+                raise
+            return False
+        self.__count('linked_files')
+        return True
+    
+    def move(self, key, temporary_filename, filename):
+        """ Stores temporary_filename, a file of the directory of filename whose content key is known (e.g. its SHA-1 hash), 
+        as filename : filename is linked to the existing blob of key, or temporary_filename is renamed to filename, 
+        that becomes the blob
+        @return: key, or None if filename is stored as a plain copy """
+        if not self.__same_filesystem(filename):
+            os.rename(temporary_filename, filename)
+            return None
+        if self.__link(self.blob_path(key), filename):
+            remove_file(temporary_filename)
+            return key
+        os.rename(temporary_filename, filename)
+        self.__store(filename, self.blob_path(key))
+        return key
+    
+    def __store(self, filename, blob):
+        if not os.path.exists(os.path.dirname(blob)):
+            try:
+                os.makedirs(os.path.dirname(blob))
+            except OSError, ex:
+                if ex.errno != errno.EEXIST:
+                    raise
+        try:
+            os.link(filename, blob)
+        except OSError, ex:
+            # stored meanwhile
+            if ex.errno != errno.EEXIST:
+                raise
+            return
+        self.__count('stored_blobs')
+    
+    def link(self, key, filename):
+        """ links filename to the blob of key, if it exists on the same filesystem. The parent directory 
+        of filename must exist 
+        @return: True if filename has been linked """
+        return self.__same_filesystem(filename) and self.__link(self.blob_path(key), filename)
+    
+    def add(self, key, filename):
+        """ makes filename the blob of key, if there is none, and if it is on the same filesystem """
+        if self.__same_filesystem(filename):
+            self.__store(filename, self.blob_path(key))
+    
+    def release(self, key):
+        """ removes the blob of key if no file is linked to it anymore """
+        blob = self.blob_path(key)
+        try:
+            if os.stat(blob).st_nlink > 1:
+                return
+        except OSError, ex:
+            if ex.errno != errno.ENOENT:
+                raise
+            return
+        remove_file(blob)
+        self.__count('released_blobs')
+    
+    def statistics(self):
+        with self.__lock:
+            return dict(self.__counts)
@@ -0,0 +1,120 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import os
+import time
+import uuid
+import socket
+import logging
+import threading
+from datetime import datetime, timedelta
+import sqlalchemy
+from sqlalchemy.sql import table, column, and_
+from zope.interface import implements
+from pymager import imgengine
+
+logger = logging.getLogger("imgengine.databaseleaselockmanager")
+
+DEFAULT_LEASE_SECONDS = 30
+DEFAULT_TIMEOUT_SECONDS = 10
+POLLING_INTERVAL_SECONDS = 0.1
+
+# the item_lease table is created by the schema migrator
+_item_lease = table('item_lease',
+                    column('id'),
+                    column('owner'),
+                    column('last_heartbeat_date'))
+
+class DatabaseLeaseLockManager(object):
+    """ an imgengine.LockManager implementation that stores time-bound leases in the database,
+    so that it works across processes and hosts.
+    
+    The owner of a lease renews it (heartbeat) from a background thread while the work 
+    is in progress. A lease that has not been renewed for lease_seconds belonged to a dead 
+    worker, and is stolen by the next process that asks for it.
+    
+    Lease statements are executed on their own connection, and committed immediately, 
+    so that they are visible to other processes while the caller's transaction is still pending. 
+    Prefer the file lock manager on SQLite, where this would commit the caller's work too. 
+    """
+    implements(imgengine.LockManager)
+    
+    def __init__(self, engine, lease_seconds=DEFAULT_LEASE_SECONDS, timeout_seconds=DEFAULT_TIMEOUT_SECONDS):
+        self.__engine = engine
+        self.__lease_seconds = lease_seconds
+        self.__timeout_seconds = timeout_seconds
+        self.__owner_prefix = '%s:%s' % (socket.gethostname(), os.getpid())
+    
+    def acquire(self, key):
+        owner = '%s:%s' % (self.__owner_prefix, uuid.uuid4().hex)
+        deadline = time.time() + self.__timeout_seconds
+        while not self.__try_acquire(key, owner):
+            if time.time() > deadline:
+                raise imgengine.LockTimeoutException(key)
+            time.sleep(POLLING_INTERVAL_SECONDS)
+        return _Lease(self, key, owner, self.__lease_seconds / 3.0)
+    
+    def __try_acquire(self, key, owner):
+        now = datetime.utcnow()
+        try:
+            self.__engine.execute(_item_lease.insert().values(id=key, owner=owner, last_heartbeat_date=now))
+            return True
+        except sqlalchemy.exc.IntegrityError:
+            expiration_date = now - timedelta(seconds=self.__lease_seconds)
+            result = self.__engine.execute(_item_lease.update()\
+                .where(and_(_item_lease.c.id == key, _item_lease.c.last_heartbeat_date < expiration_date))\
+                .values(owner=owner, last_heartbeat_date=now))
+            if result.rowcount == 1:
+                logger.warning("Stole expired lease on %s" % (key,))
+                return True
+            return False
+    
+    def renew(self, key, owner):
+        """ @return: False if the lease has been lost (stolen after its expiration) """
+        result = self.__engine.execute(_item_lease.update()\
+            .where(and_(_item_lease.c.id == key, _item_lease.c.owner == owner))\
+            .values(last_heartbeat_date=datetime.utcnow()))
+        return result.rowcount == 1
+    
+    def release(self, key, owner):
+        self.__engine.execute(_item_lease.delete()\
+            .where(and_(_item_lease.c.id == key, _item_lease.c.owner == owner)))
+
+class _Lease(object):
+    def __init__(self, lock_manager, key, owner, heartbeat_interval_seconds):
+        self.__lock_manager = lock_manager
+        self.__key = key
+        self.__owner = owner
+        self.__heartbeat_interval_seconds = heartbeat_interval_seconds
+        self.__released = threading.Event()
+        heartbeat = threading.Thread(target=self.__heartbeat, name='lease-heartbeat-%s' % (key,))
+        heartbeat.daemon = True
+        heartbeat.start()
+    
+    def __heartbeat(self):
+        while not self.__released.wait(self.__heartbeat_interval_seconds):
+            try:
+                if not self.__lock_manager.renew(self.__key, self.__owner):
+                    logger.warning("Lease on %s has been lost" % (self.__key,))
+                    return
+            except Exception, ex:
+                logger.warning("Impossible to renew lease on %s: %s" % (self.__key, ex))
+    
+    def release(self):
+        if self.__released.is_set():
+            return
+        self.__released.set()
+        self.__lock_manager.release(self.__key, self.__owner)
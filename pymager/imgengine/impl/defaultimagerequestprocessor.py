@@ -18,8 +18,7 @@ from __future__ import with_statement
 import os
 import os.path
 import shutil
-import time
-import Image, ImageOps
+import hashlib
 import logging
 from zope.interface import Interface, implements
 from pymager import tx
@@ -28,27 +27,71 @@ from pymager import persistence
 from pymager import resources
 from pymager import imgengine
 from pymager.imgengine._deleteimagescommand import DeleteImagesCommand
+from pymager.imgengine._deleteimagescommand import remove_file
 from pymager.imgengine._imagerequestprocessor import ImageRequestProcessor
+from pymager.imgengine.impl.singleflight import SingleFlight
+from pymager.imgengine.impl.filelockmanager import FileLockManager
+from pymager.imgengine.impl.inlinederivationexecutor import InlineDerivationExecutor
+from pymager.imgengine.impl import derivation
+from pymager.imgengine.impl import originalimageupload
 from pymager.resources.impl import flatpathgenerator
 
 logger = logging.getLogger("imgengine.imagerequestprocessor")
 
-LOCK_MAX_RETRIES = 10
-LOCK_WAIT_SECONDS = 1
+LOCK_DIRECTORY = "locks"
+BLOB_DIRECTORY = "blobs"
 
 class DefaultImageRequestProcessor(object):
     implements(ImageRequestProcessor)
     
-    def __init__(self, image_metadata_repository, path_generator, image_format_mapper, schema_migrator, data_directory, session_template, dev_mode=False):
+    def __init__(self, image_metadata_repository, path_generator, image_format_mapper, schema_migrator, data_directory, session_template, dev_mode=False, lock_manager=None, derivation_executor=None, derivative_source_ratio=0, mezzanine_max_size=0, readonly_image_metadata_repository=None, derived_image_index=None, access_tracker=None, derived_image_tiers=None, packed_image_store=None, packed_image_max_bytes=0, content_store=None, public_tree=None):
         """ @param data_directory: the directory that this 
-            ImageRequestProcessor will use for its work files """
+            ImageRequestProcessor will use for its work files 
+            @param lock_manager: the imgengine.LockManager that serializes the creation of items. 
+            Defaults to file locks in the data directory 
+            @param derivation_executor: the imgengine.DerivationExecutor that resizes the images. 
+            Defaults to the calling thread 
+            @param derivative_source_ratio: when > 0, derived images are created from the smallest
+            existing derived image that has at least derivative_source_ratio times the required 
+            pixels, instead of the original image 
+            @param mezzanine_max_size: when > 0, a copy of the original image whose longest side is 
+            mezzanine_max_size is stored at upload time, and used to create the derived images 
+            it is large enough for 
+            @param readonly_image_metadata_repository: the domain.ImageMetadataRepository used by the lookups 
+            that do not modify the image metadatas, that may return detached copies (e.g. from a cache). 
+            Defaults to image_metadata_repository 
+            @param derived_image_index: the DerivedImageIndex that tells which derived images can be served 
+            without checking the filesystem. Defaults to checking the filesystem 
+            @param access_tracker: the AccessTracker that records the accesses to the derived images, 
+            for collect_derived_images(). Defaults to not recording them 
+            @param derived_image_tiers: the DerivedImageTiers that moves the derived images between 
+            the tiers of the path_generator, depending on their accesses. Defaults to a single tier 
+            @param packed_image_store: the resources.ImageStore that the derived images of at most 
+            packed_image_max_bytes are moved to once they are created, instead of keeping one file per image 
+            @param content_store: the ContentStore that stores the original images that have the same content once, 
+            and shares their mezzanines and derived images 
+            @param public_tree: the PublicTree that exposes the complete derived images under their public URL """
         self._data_directory = data_directory 
         self._image_metadata_repository = domain.ImageMetadataRepository(image_metadata_repository)
+        self._readonly_image_metadata_repository = domain.ImageMetadataRepository(readonly_image_metadata_repository) if readonly_image_metadata_repository is not None else self._image_metadata_repository
         self._image_format_mapper = resources.ImageFormatMapper(image_format_mapper)
         self._schema_migrator = persistence.SchemaMigrator(schema_migrator)
         self._path_generator = resources.PathGenerator(path_generator)
         self._session_template = session_template
         self._dev_mode = dev_mode
+        self._derivations_in_flight = SingleFlight()
+        self._lock_manager = imgengine.LockManager(lock_manager if lock_manager is not None else FileLockManager(os.path.join(data_directory, LOCK_DIRECTORY)))
+        self._derivation_executor = imgengine.DerivationExecutor(derivation_executor if derivation_executor is not None else InlineDerivationExecutor())
+        self._derivative_source_ratio = derivative_source_ratio
+        self._mezzanine_max_size = mezzanine_max_size
+        self._derived_image_index = derived_image_index
+        self._access_tracker = access_tracker
+        self._derived_image_tiers = derived_image_tiers
+        self._packed_image_store = resources.ImageStore(packed_image_store) if packed_image_store is not None else None
+        self._packed_image_max_bytes = packed_image_max_bytes
+        self._content_store = content_store
+        self._public_tree = public_tree
+        self._listeners = []
         
         if self._dev_mode:
             self._drop_data()
@@ -56,23 +99,15 @@ class DefaultImageRequestProcessor(object):
         self._init_data()
         self.cleanup_inconsistent_items()
     
-    @tx.transactional
-    def _wait_for_item_status_ok(self, pollingCallback):
-        """ Wait for the status property of the object returned by pollingCallback() to be STATUS_OK
-        It honors LOCK_MAX_RETRIES and LOCK_WAIT_SECONDS
-        """
-        item = pollingCallback()
-        i = 0
-        while i < LOCK_MAX_RETRIES and item is not None and item.status != domain.STATUS_OK:
-            time.sleep(LOCK_WAIT_SECONDS)
-            item = pollingCallback()
-            i = i + 1
-        if i == LOCK_MAX_RETRIES:
-            raise imgengine.ImageProcessingException('Item seems to be locked forever')
-    
-    def _wait_for_original_image_metadata(self, image_id):
-        """ Wait for the given original item to have a status of STATUS_OK """
-        self._wait_for_item_status_ok(lambda: self._image_metadata_repository.find_original_image_metadata_by_id(image_id))
+    def _wait_for_original_image_metadata(self, original_image_metadata):
+        """ Wait for the given original item to have a status of STATUS_OK. 
+        An original item that is not OK is being uploaded by somebody else, who holds its lock """
+        if original_image_metadata.status == domain.STATUS_OK:
+            return
+        self._lock_manager.acquire(original_image_metadata.id).release()
+        self._session_template.do_with_session(lambda session: session.refresh(original_image_metadata))
+        if original_image_metadata.status != domain.STATUS_OK:
+            raise imgengine.ImageProcessingException('Original image is not available: %s' % original_image_metadata.id)
     
     def _required_original_image_metadata(self, image_id, original_image_metadata):
         if original_image_metadata is None:
@@ -81,122 +116,544 @@ class DefaultImageRequestProcessor(object):
     @tx.transactional                
     def get_original_image_path(self, image_id):
         logger.debug("get_original_image_path")
-        original_image_metadata = self._image_metadata_repository.find_original_image_metadata_by_id(image_id)
+        original_image_metadata = self._readonly_image_metadata_repository.find_original_image_metadata_by_id(image_id)
         self._required_original_image_metadata(image_id, original_image_metadata)
-        self._wait_for_original_image_metadata(image_id)
+        self._wait_for_original_image_metadata(original_image_metadata)
         return self._path_generator.original_path(original_image_metadata).relative()
     
-    @tx.transactional                           
     def save_file_to_repository(self, file, image_id):
-        def filename_save_strategy(file, item):
-            shutil.copyfile(file, self._path_generator.original_path(item).absolute())
-        
-        def file_like_save_strategy(file, item):
-            file.seek(0)
-            with open(self._path_generator.original_path(item).absolute(), "w+b") as out:
-                shutil.copyfileobj(file, out)
-                out.flush()
-
-        if type(file) == str:
-            save = filename_save_strategy
-        else:
-            save = file_like_save_strategy
-        
-        # Check that the image is not broken
+        return self.save_stream_to_repository(originalimageupload.file_chunks(file), image_id)
+    
+    def save_stream_to_repository(self, chunks, image_id):
+        """ The image is received before its lock is acquired, and written once, next to its final path. 
+        The original image metadata is claimed and published in two short transactions : 
+        no connection is held while the image is renamed and the mezzanine is created """
+        upload = self._receive_original_image(chunks, image_id)
         try:
-            img = Image.open(file)
-            img.verify()
-        except IOError, ex:
-            raise imgengine.ImageStreamNotRecognizedException(ex)
-        
-        item = domain.OriginalImageMetadata(image_id, domain.STATUS_INCONSISTENT, img.size, img.format)
-
+            lock = self._lock_manager.acquire(image_id)
+        except:
+            upload.discard()
+            raise
+        try:
+            try:
+                self._claim_original_image_metadata(image_id, upload.size, upload.format)
+            except:
+                upload.discard()
+                raise
+            self._on_item_saved(image_id)
+            # transient copy, only used to compute the paths of the files
+            item = domain.OriginalImageMetadata(image_id, domain.STATUS_INCONSISTENT, upload.size, upload.format)
+            try:
+                content_hash = self._session_template.do_outside_session(lambda: self._save_original_image(upload, item))
+            except Exception:
+                upload.discard()
+                self._delete_original_image_metadata(image_id)
+                raise
+            self._publish_original_image_metadata(image_id, content_hash)
+            # the lookups that missed while the claim was being committed may have been cached since
+            self._on_item_saved(image_id)
+        finally:
+            lock.release()
+    
+    def _receive_original_image(self, chunks, image_id):
+        """ @return: the imgengine.impl.originalimageupload.OriginalImageUpload of the image """
+        def directory_for(size, format):
+            item = domain.OriginalImageMetadata(image_id, domain.STATUS_INCONSISTENT, size, format)
+            return self._path_generator.original_path(item).parent_directory().absolute()
+        try:
+            return self._session_template.do_outside_session(lambda: originalimageupload.receive(chunks, directory_for))
+        except (IOError, OSError), ex:
+            raise imgengine.ImageProcessingException(ex)
+    
+    @tx.transactional
+    def _claim_original_image_metadata(self, image_id, size, format):
+        item = domain.OriginalImageMetadata(image_id, domain.STATUS_INCONSISTENT, size, format)
         try:
             # atomic creation
             self._image_metadata_repository.add(item)
         except domain.DuplicateEntryException, ex:
             raise imgengine.ImageIDAlreadyExistsException(item.id)
-        else:
-            try:
-                image_directory = self._path_generator.original_path(item).parent_directory().absolute()
-                if not os.path.exists(image_directory):
-                    os.makedirs(image_directory)
-                save(file, item)
-            except IOError, ex:
-                raise imgengine.ImageProcessingException(ex)
-        
+    
+    @tx.transactional
+    def _publish_original_image_metadata(self, image_id, content_hash):
+        item = self._image_metadata_repository.find_original_image_metadata_by_id(image_id)
+        if item is None:
+            raise imgengine.ImageProcessingException('Original image was deleted while being saved: %s' % image_id)
         item.status = domain.STATUS_OK
+        item.content_hash = content_hash
     
-    @tx.transactional        
-    def prepare_transformation(self, transformationRequest):
-        logging.debug("prepare transformation: %s" % (transformationRequest,))
-        original_image_metadata = self._image_metadata_repository.find_original_image_metadata_by_id(transformationRequest.image_id)
-        self._required_original_image_metadata(transformationRequest.image_id, original_image_metadata)
+    def _delete_original_image_metadata(self, image_id):
+        def image_metadatas_to_delete():
+            original_image_metadata = self._image_metadata_repository.find_original_image_metadata_by_id(image_id)
+            return [original_image_metadata] if original_image_metadata is not None else []
         
-        self._wait_for_original_image_metadata(transformationRequest.image_id)
-        derived_image_metadata = domain.DerivedImageMetadata(domain.STATUS_INCONSISTENT, transformationRequest.size, transformationRequest.target_format, original_image_metadata)
+        DeleteImagesCommand(self._image_metadata_repository,
+                            self._session_template,
+                            self._path_generator,
+                            image_metadatas_to_delete,
+                            self._on_item_deleted).execute()
+    
+    def _save_original_image(self, upload, item):
+        """ @return: the content hash of the saved image, if it is shared with the images that have the same content """
+        original_filename = self._path_generator.original_path(item).absolute()
+        try:
+            if self._content_store is not None:
+                item.content_hash = self._content_store.move(upload.content_hash, upload.temporary_filename, original_filename)
+            else:
+                upload.publish(original_filename)
+        except (IOError, OSError), ex:
+            raise imgengine.ImageProcessingException(ex)
+        self._save_mezzanine(item)
+        return item.content_hash
+    
+    def _has_mezzanine(self, original_image_metadata):
+        return self._mezzanine_max_size > 0 and max(original_image_metadata.size) > self._mezzanine_max_size
+    
+    def _save_mezzanine(self, original_image_metadata):
+        """ the mezzanine is an optimization : failing to create it does not make the upload fail """
+        if not self._has_mezzanine(original_image_metadata):
+            return
+        mezzanine_filename = self._path_generator.mezzanine_path(original_image_metadata).absolute()
+        content_key = self._mezzanine_content_key(original_image_metadata.content_hash)
+        if content_key is not None and self._content_store.link(content_key, mezzanine_filename):
+            return
+        try:
+            self._derivation_executor.derive_mezzanine(self._path_generator.original_path(original_image_metadata).absolute(),
+                                                       mezzanine_filename,
+                                                       derivation.mezzanine_size(original_image_metadata.size, self._mezzanine_max_size),
+                                                       original_image_metadata.format)
+            if content_key is not None:
+                self._content_store.add(content_key, mezzanine_filename)
+        except (imgengine.ImageProcessingException, ValueError), ex:
+            logger.warning("Impossible to create the mezzanine of %s: %s" % (original_image_metadata.id, ex))
+    
+    def prepare_transformation(self, transformationRequest):
+        """ Derived images that are already in the cache are served without asking the database.
+        Concurrent requests for the same derived image, in the same process, 
+        are coalesced : only one thread does the work, the others wait for it, without polling the DB """
+        return self.prepare_encoded_transformation(transformationRequest)[0]
+    
+    def prepare_encoded_transformation(self, transformationRequest):
+        """ The encoded derived image is sent to the waiting threads too """
+        relative_cached_filename = self._find_published_transformation(transformationRequest)
+        if relative_cached_filename is not None:
+            return relative_cached_filename, None
+        derived_image_id = transformationRequest.derived_image_id
+        return self._derivations_in_flight.do(derived_image_id, lambda: self._prepare_encoded_transformation(transformationRequest, derived_image_id))
+    
+    def pregenerate(self, image_id, sizes, target_formats):
+        """ The derived images that do not exist yet are created one at a time, each under its own lock : 
+        a request for one of them only waits for its own derivation, not for the whole batch. 
+        The largest ones are created first, so that the smaller ones can be derived from them (derivative_source_ratio), 
+        and the decoded source is reused when the decoded images are cached """
+        transformationRequests = []
+        for target_format in target_formats:
+            for size in sizes:
+                transformationRequest = imgengine.TransformationRequest(self._image_format_mapper, image_id, size, target_format)
+                if self._find_prepared_transformation(transformationRequest) is None:
+                    transformationRequests.append(transformationRequest)
+        if not transformationRequests:
+            return []
         
-        cached_filename = self._path_generator.derived_path(derived_image_metadata).absolute()
-        relative_cached_filename = self._path_generator.derived_path(derived_image_metadata).relative()
-
-        logger.debug("Checks cache for existing image")
-        if os.path.exists(cached_filename):
-            logger.debug("Already exists in cache: %s " %(relative_cached_filename,))
-            def expunge_callback(session):
-                session.expunge_all()
-            self._session_template.do_with_session(expunge_callback)
+        relative_cached_filenames = {}
+        for transformationRequest in sorted(transformationRequests, key=lambda r: r.size[0] * r.size[1], reverse=True):
+            relative_cached_filenames[transformationRequest.derived_image_id], encoded_image = \
+                self._prepare_encoded_transformation(transformationRequest, transformationRequest.derived_image_id)
+        return [relative_cached_filenames[r.derived_image_id] for r in transformationRequests]
+    
+    def _prepare_encoded_transformation(self, transformationRequest, derived_image_id):
+        relative_cached_filename = self._find_prepared_transformation(transformationRequest)
+        if relative_cached_filename is not None:
+            return relative_cached_filename, None
+        lock = self._lock_manager.acquire(derived_image_id)
+        try:
+            return self._create_encoded_transformations([transformationRequest])[0]
+        finally:
+            lock.release()
+    
+    def _find_original_image_metadata_for(self, transformationRequest, image_metadata_repository):
+        original_image_metadata = image_metadata_repository.find_original_image_metadata_by_id(transformationRequest.image_id)
+        self._required_original_image_metadata(transformationRequest.image_id, original_image_metadata)
+        self._wait_for_original_image_metadata(original_image_metadata)
+        return original_image_metadata
+    
+    def find_transformation(self, transformationRequest):
+        relative_cached_filename = self._find_published_transformation(transformationRequest)
+        if relative_cached_filename is not None:
+            return relative_cached_filename
+        return self._find_prepared_transformation(transformationRequest)
+    
+    def _find_published_transformation(self, transformationRequest):
+        """ Derived images are renamed into the cache once they are complete, and deleted with their original image : 
+        a derived image that exists in the cache can be served without asking the database (that might even be down)
+        @return: the relative path of the derived image if it is already in the cache, None otherwise """
+        derived_image_metadata = self._transient_derived_image_metadata(transformationRequest)
+        relative_cached_filename = self._find_indexed_transformation(transformationRequest, derived_image_metadata)
+        if relative_cached_filename is not None:
             return relative_cached_filename
         
-        logger.debug("Add repo metadata for derived image")
-        try:
-            self._image_metadata_repository.add(derived_image_metadata)
-        except domain.DuplicateEntryException :
-            def find():
-                return self._image_metadata_repository.find_derived_image_metadata_by_original_image_metadata_id_size_and_format(transformationRequest.image_id, transformationRequest.size, transformationRequest.target_format)
-            self._wait_for_item_status_ok(find)
-            derived_image_metadata = find()
-
-        logger.debug("Checks that image format is supported")        
+        derived_path = self._path_generator.derived_path(derived_image_metadata)
+        if self._is_packed(derived_image_metadata.id):
+            if self._derived_image_index is not None:
+                self._derived_image_index.add(derived_image_metadata.id, derived_path.relative())
+            self._record_access(derived_image_metadata)
+            return derived_path.relative()
+        if os.path.exists(derived_path.absolute()):
+            logger.debug("Already exists in cache: %s " %(derived_path.relative(),))
+            if self._derived_image_index is not None:
+                self._derived_image_index.add(derived_image_metadata.id, derived_path.relative())
+            self._record_access(derived_image_metadata)
+            self._publish_to_public_tree(transformationRequest, derived_path.absolute())
+            return derived_path.relative()
+        return None
+    
+    def _find_indexed_transformation(self, transformationRequest, derived_image_metadata):
+        """ indexed derived images are trusted without looking for their file : the index of this process is not told 
+        about the derived images that other processes delete or move, they are forgotten when they are found missing 
+        while they are served (see forget_transformation()), or when the index is reloaded 
+        @return: the relative path of the derived image if it is in the index, None otherwise """
+        if self._derived_image_index is None:
+            return None
+        relative_cached_filename = self._derived_image_index.get(derived_image_metadata.id)
+        if relative_cached_filename is None:
+            return None
+        self._record_access(derived_image_metadata)
+        self._publish_to_public_tree(transformationRequest, os.path.join(self._data_directory, relative_cached_filename))
+        return relative_cached_filename
+    
+    def forget_transformation(self, transformationRequest):
+        if self._derived_image_index is not None:
+            logger.debug("Derived image is missing: %s" % (transformationRequest.derived_image_id,))
+            self._derived_image_index.discard(transformationRequest.derived_image_id)
+    
+    def _transient_derived_image_metadata(self, transformationRequest):
+        """ transient items, the derived path only depends on the id of the original image """
+        return domain.DerivedImageMetadata(domain.STATUS_OK, transformationRequest.size, transformationRequest.target_format, 
+                                           domain.OriginalImageMetadata(transformationRequest.image_id, domain.STATUS_OK, transformationRequest.size, transformationRequest.target_format))
+    
+    def _publish_to_public_tree(self, transformationRequest, cached_filename):
+        """ the derived images that are requested from the image server are missing from the public tree, 
+        e.g. because they were created before it was enabled, or moved since they were published """
+        if self._public_tree is not None:
+            self._public_tree.publish(transformationRequest.image_id, transformationRequest.size, transformationRequest.target_format, cached_filename)
+    
+    def _record_access(self, derived_image_metadata):
+        if self._access_tracker is not None:
+            self._access_tracker.record(derived_image_metadata.id)
+        # packed images have no file to move between the tiers
+        if self._derived_image_tiers is not None and not self._is_packed(derived_image_metadata.id):
+            self._derived_image_tiers.record_access(derived_image_metadata)
+    
+    def _is_packed(self, derived_image_id):
+        return self._packed_image_store is not None and self._packed_image_store.contains(derived_image_id)
+    
+    def _pack_derived_images(self, pending_transformations, encoded_images):
+        """ moves the small derived images to the packed image store, before they are published : 
+        they are never served as files that could disappear while being read 
+        @param encoded_images: the resources.StoredImage of the derived images that have just been encoded, 
+        keyed by derived image id, that do not have to be read again """
+        if self._packed_image_store is None:
+            return
+        for transformationRequest, cached_filename in pending_transformations:
+            if os.path.getsize(cached_filename) > self._packed_image_max_bytes:
+                continue
+            encoded_image = encoded_images.get(transformationRequest.derived_image_id)
+            if encoded_image is None:
+                with open(cached_filename, 'rb') as f:
+                    encoded_image = resources.StoredImage(f.read(), os.path.getmtime(cached_filename))
+            self._packed_image_store.put(transformationRequest.derived_image_id, encoded_image.body, encoded_image.modification_time)
+            remove_file(cached_filename)
+    
+    def _mezzanine_content_key(self, content_hash):
+        """ @return: the key of the mezzanines of the original images whose content hash is content_hash, 
+        None if they are not shared """
+        return '%s-mezzanine' % (content_hash,) if self._content_store is not None and content_hash is not None else None
+    
+    def _derived_content_key(self, content_hash, size, format):
+        """ @return: the key of the derived images of the original images whose content hash is content_hash, 
+        None if they are not shared """
+        return '%s-%sx%s-%s' % (content_hash, size[0], size[1], format) if self._content_store is not None and content_hash is not None else None
+    
+    def _link_shared_derived_images(self, content_hash, pending_transformations):
+        """ links the derived images that have already been created for another original image with the same content 
+        @return: the pending transformations that still have to be derived """
+        not_shared = []
+        for transformationRequest, cached_filename in pending_transformations:
+            content_key = self._derived_content_key(content_hash, transformationRequest.size, transformationRequest.target_format)
+            derived_directory = os.path.dirname(cached_filename)
+            if content_key is not None:
+                if not os.path.exists(derived_directory):
+                    os.makedirs(derived_directory)
+                if self._content_store.link(content_key, cached_filename):
+                    logger.debug("Shares the derived image %s" % (content_key,))
+                    continue
+            not_shared.append((transformationRequest, cached_filename))
+        return not_shared
+    
+    def _share_derived_images(self, content_hash, pending_transformations):
+        for transformationRequest, cached_filename in pending_transformations:
+            content_key = self._derived_content_key(content_hash, transformationRequest.size, transformationRequest.target_format)
+            if content_key is not None:
+                self._content_store.add(content_key, cached_filename)
+    
+    def _derived_image_file_size(self, derived_image_id, cached_filename):
+        if os.path.exists(cached_filename):
+            return os.path.getsize(cached_filename)
+        packed_image = self._packed_image_store.get(derived_image_id) if self._packed_image_store is not None else None
+        return len(packed_image) if packed_image is not None else 0
+    
+    @tx.transactional
+    def _find_prepared_transformation(self, transformationRequest):
+        """ Same as _find_published_transformation(), but checks the original image first
+        @raise imgengine.ImageMetadataNotFoundException: if the original image does not exist """
+        logging.debug("prepare transformation: %s" % (transformationRequest,))
+        self._find_original_image_metadata_for(transformationRequest, self._readonly_image_metadata_repository)
+        logger.debug("Checks cache for existing image")
+        return self._find_published_transformation(transformationRequest)
+    
+    def _create_transformations(self, transformationRequests):
+        """ @return: the relative paths of the derived images """
+        return [relative_cached_filename for (relative_cached_filename, encoded_image) in self._create_encoded_transformations(transformationRequests)]
+    
+    def _create_encoded_transformations(self, transformationRequests):
+        """ Must be called while holding the locks on the derived images, that all belong to the same original image.
+        The derived image metadatas are claimed and published in two short transactions : 
+        no connection is held while the images are resized 
+        @return: the (relative path, resources.StoredImage) of the derived images. The encoded image is None 
+        unless the derived image has been encoded by this call """
+        relative_cached_filenames, source_filenames, pending_transformations, content_hash = self._claim_transformations(transformationRequests)
+        encoded_images = {}
+        if pending_transformations:
+            derived_transformations = self._link_shared_derived_images(content_hash, pending_transformations)
+            derivations = [(cached_filename, r.size, r.target_format) for (r, cached_filename) in derived_transformations]
+            logger.debug("Add derived images to filesystem")
+            if derivations:
+                encoded_bodies = self._session_template.do_outside_session(lambda: self._derive_all(source_filenames, derivations))
+                for (r, cached_filename), body in zip(derived_transformations, encoded_bodies):
+                    encoded_images[r.derived_image_id] = resources.StoredImage(body, os.path.getmtime(cached_filename))
+            self._share_derived_images(content_hash, derived_transformations)
+            self._pack_derived_images(pending_transformations, encoded_images)
+            self._publish_transformations(pending_transformations)
+            for r, cached_filename in pending_transformations:
+                self._publish_to_public_tree(r, cached_filename)
+            if self._derived_image_index is not None:
+                for r, relative_cached_filename in zip(transformationRequests, relative_cached_filenames):
+                    self._derived_image_index.add(r.derived_image_id, relative_cached_filename)
+        return [(relative_cached_filename, encoded_images.get(r.derived_image_id)) for (r, relative_cached_filename) in zip(transformationRequests, relative_cached_filenames)]
+    
+    def _derive_all(self, source_filenames, derivations):
+        """ A derivative or a mezzanine source can be deleted or moved to another tier while it is read : 
+        the derived images are then created from the next source, the original image
+        @return: the encoded derived images """
         try:
-            img = Image.open(self._path_generator.original_path(original_image_metadata).absolute())
-        except IOError, ex: 
-            raise imgengine.ImageProcessingException(ex)
+            for source_filename in source_filenames[:-1]:
+                try:
+                    return self._derivation_executor.encode_all(source_filename, derivations)
+                except imgengine.ImageProcessingException, ex:
+                    logger.info("Impossible to derive %s from %s, tries the next source: %s" % ([size for (cached_filename, size, target_format) in derivations], source_filename, ex))
+                    self._derivation_executor.forget(source_filename)
+            return self._derivation_executor.encode_all(source_filenames[-1], derivations)
+        except Exception:
+            for (cached_filename, size, target_format) in derivations:
+                remove_file(cached_filename)
+            raise
+    
+    @tx.transactional
+    def _claim_transformations(self, transformationRequests):
+        """ if a derived image metadata already exists and is not OK, its creator died while working on it 
+        @return: the relative paths of the derived images, the absolute paths of the images to derive them from, 
+        and the (transformationRequest, absolute path) of the derived images that have to be created, 
+        and the content hash of the original image """
+        original_image_metadata = self._find_original_image_metadata_for(transformationRequests[0], self._image_metadata_repository)
+        relative_cached_filenames = []
+        pending_transformations = []
+        for transformationRequest in transformationRequests:
+            derived_image_metadata = self._image_metadata_repository.find_derived_image_metadata_by_original_image_metadata_id_size_and_format(transformationRequest.image_id, transformationRequest.size, transformationRequest.target_format)
+            existing = derived_image_metadata is not None
+            if not existing:
+                logger.debug("Add repo metadata for derived image")
+                derived_image_metadata = domain.DerivedImageMetadata(domain.STATUS_INCONSISTENT, transformationRequest.size, transformationRequest.target_format, original_image_metadata)
+                try:
+                    self._image_metadata_repository.add(derived_image_metadata)
+                except domain.DuplicateEntryException, ex:
+                    raise imgengine.ImageProcessingException('Derived image is being created by a process that does not share our locks: %s' % derived_image_metadata.id)
+            
+            derived_path = self._path_generator.derived_path(derived_image_metadata)
+            cached_filename = derived_path.absolute()
+            relative_cached_filename = derived_path.relative()
+            relative_cached_filenames.append(relative_cached_filename)
+            
+            if derived_image_metadata.status == domain.STATUS_OK and (os.path.exists(cached_filename) or self._is_packed(derived_image_metadata.id)):
+                logger.debug("Created while waiting for the lock: %s " %(relative_cached_filename,))
+                continue
+            elif existing and derived_image_metadata.status != domain.STATUS_OK:
+                logger.info("Repairing derived image left inconsistent by a dead worker: %s" % (derived_image_metadata.id,))
+            pending_transformations.append((transformationRequest, cached_filename))
         
-        logger.debug("Add derived image to filesystem")
-        if transformationRequest.size == img.size and transformationRequest.target_format.upper() == img.format.upper():
+        source_filenames = None
+        if pending_transformations:
+            source_filenames = self._derivation_sources(original_image_metadata, [(r.size, r.target_format) for (r, cached_filename) in pending_transformations])
+        return relative_cached_filenames, source_filenames, pending_transformations, original_image_metadata.content_hash
+    
+    @tx.transactional
+    def _publish_transformations(self, pending_transformations):
+        for transformationRequest, cached_filename in pending_transformations:
+            derived_image_metadata = self._image_metadata_repository.find_derived_image_metadata_by_original_image_metadata_id_size_and_format(transformationRequest.image_id, transformationRequest.size, transformationRequest.target_format)
+            if derived_image_metadata is None:
+                for r, f in pending_transformations:
+                    remove_file(f)
+                    if self._packed_image_store is not None:
+                        self._packed_image_store.delete(r.derived_image_id)
+                raise imgengine.ImageProcessingException('Derived image was deleted while being created: %s' % transformationRequest.derived_image_id)
+            derived_image_metadata.status = domain.STATUS_OK
+            derived_image_metadata.file_size = self._derived_image_file_size(derived_image_metadata.id, cached_filename)
+    
+    def get_derived_image_etag(self, transformationRequest, relative_path=None, stored_image=None):
+        """ the size and modification time of the derived image are kept when it is moved between the tiers, 
+        packed, or shared : they only change when it is created again """
+        if stored_image is None and self._packed_image_store is not None:
+            stored_image = self._packed_image_store.get(transformationRequest.derived_image_id)
+        if stored_image is not None:
+            file_size, modification_time = len(stored_image), stored_image.modification_time
+        else:
             try:
-                shutil.copyfile(self._path_generator.original_path(original_image_metadata).absolute(), cached_filename)
-            except IOError, ex:
-                raise imgengine.ImageProcessingException(ex)
-        else:   
-            target_image = ImageOps.fit(image=img,
-                                        size=transformationRequest.size,
-                                        method=Image.ANTIALIAS,
-                                        centering=(0.5, 0.5)) 
+                if relative_path is None:
+                    relative_path = self._path_generator.derived_path(self._transient_derived_image_metadata(transformationRequest)).relative()
+                stat = os.stat(os.path.join(self._data_directory, relative_path))
+            except OSError:
+                return None
+            file_size, modification_time = stat.st_size, stat.st_mtime
+        return '"%s"' % (hashlib.sha1('%s-%s-%r' % (transformationRequest.derived_image_id, file_size, modification_time)).hexdigest(),)
+    
+    def prepare_placeholder(self, transformationRequest):
+        """ placeholders only depend on the size and format, so they are shared by all the images """
+        placeholder_path = self._path_generator.placeholder_path(transformationRequest.size, transformationRequest.target_format)
+        if not os.path.exists(placeholder_path.absolute()):
             try:
-                cached_filename_directory = self._path_generator.derived_path(derived_image_metadata).parent_directory().absolute()
-                if not os.path.exists(cached_filename_directory):
-                    os.makedirs(cached_filename_directory)
-                target_image.save(cached_filename)
+                derivation.placeholder(placeholder_path.absolute(), transformationRequest.size, transformationRequest.target_format)
             except IOError, ex:
                 raise imgengine.ImageProcessingException(ex)
+        return placeholder_path.relative()
+    
+    def _derivation_sources(self, original_image_metadata, targets):
+        """ @param targets: the (size, target_format) of the derived images to create
+        @return: the absolute filenames of the images to create all the derived images from : the smallest one, 
+        then the original image if it is not the smallest one """
+        def can_derive_all_from(source_size, min_ratio):
+            return not [size for (size, target_format) in targets if not derivation.can_derive_from(original_image_metadata.size, source_size, size, min_ratio)]
         
-        derived_image_metadata.status = domain.STATUS_OK
+        original_filename = self._path_generator.original_path(original_image_metadata).absolute()
+        if self._derivative_source_ratio > 0:
+            candidates = [d for d in original_image_metadata.derived_image_metadatas \
+                            if d.status == domain.STATUS_OK \
+                            and d.size not in [size for (size, target_format) in targets] \
+                            and not [target_format for (size, target_format) in targets if d.format not in (target_format, original_image_metadata.format)] \
+                            and can_derive_all_from(d.size, self._derivative_source_ratio)]
+            for candidate in sorted(candidates, key=lambda d: d.width * d.height):
+                for candidate_path in self._path_generator.derived_paths(candidate):
+                    if os.path.exists(candidate_path.absolute()):
+                        logger.debug("Derives %s from %s" % (targets, candidate.id))
+                        return [candidate_path.absolute(), original_filename]
+        if self._has_mezzanine(original_image_metadata):
+            mezzanine_size = derivation.mezzanine_size(original_image_metadata.size, self._mezzanine_max_size)
+            mezzanine_filename = self._path_generator.mezzanine_path(original_image_metadata).absolute()
+            if can_derive_all_from(mezzanine_size, 1) and os.path.exists(mezzanine_filename):
+                logger.debug("Derives %s from the mezzanine" % (targets,))
+                return [mezzanine_filename, original_filename]
+        return [original_filename]
+    
+    def collect_derived_images(self, max_bytes):
+        """ The derived images are deleted while holding their lock, so that none is deleted while being created """
+        while self._measure_derived_images():
+            pass
+        total_size = self._image_metadata_repository.sum_derived_image_metadata_file_sizes()
+        collected = 0
+        while total_size > max_bytes:
+            collected_in_batch = 0
+            for derived_image_id, image_id, size, format in self._least_recently_accessed_derived_images():
+                file_size = self._collect_derived_image(derived_image_id, image_id, size, format)
+                if file_size is not None:
+                    total_size -= file_size
+                    collected_in_batch += 1
+                if total_size <= max_bytes:
+                    break
+            if not collected_in_batch:
+                break
+            collected += collected_in_batch
+        return collected
+    
+    @tx.transactional
+    def _measure_derived_images(self):
+        """ the file size of the derived images created before it was recorded (0 if their file is missing) 
+        @return: the number of derived images that have been measured """
+        derived_image_metadatas = self._image_metadata_repository.find_unmeasured_derived_image_metadatas()
+        for derived_image_metadata in derived_image_metadatas:
+            cached_filename = self._path_generator.derived_path(derived_image_metadata).absolute()
+            derived_image_metadata.file_size = self._derived_image_file_size(derived_image_metadata.id, cached_filename)
+        return len(derived_image_metadatas)
+    
+    @tx.transactional
+    def _least_recently_accessed_derived_images(self):
+        return [(d.id, d.original_image_metadata.id, d.size, d.format) for d in self._image_metadata_repository.find_least_recently_accessed_derived_image_metadatas()]
+    
+    def _collect_derived_image(self, derived_image_id, image_id, size, format):
+        """ @return: the file size of the deleted derived image, or None if it has not been deleted """
+        try:
+            lock = self._lock_manager.acquire(derived_image_id)
+        except imgengine.LockTimeoutException:
+            logger.info("Derived image is being created, not collecting it: %s" % (derived_image_id,))
+            return None
+        try:
+            return self._delete_derived_image_metadata(image_id, size, format)
+        finally:
+            lock.release()
+    
+    @tx.transactional
+    def _delete_derived_image_metadata(self, image_id, size, format):
+        file_sizes = []
+        def image_metadatas_to_delete():
+            derived_image_metadata = self._image_metadata_repository.find_derived_image_metadata_by_original_image_metadata_id_size_and_format(image_id, size, format)
+            if derived_image_metadata is None or derived_image_metadata.status != domain.STATUS_OK:
+                return []
+            file_sizes.append(derived_image_metadata.file_size or 0)
+            return [derived_image_metadata]
         
-        return relative_cached_filename
+        DeleteImagesCommand(self._image_metadata_repository,
+                            self._session_template,
+                            self._path_generator,
+                            image_metadatas_to_delete,
+                            self._on_item_deleted).execute()
+        return file_sizes[0] if file_sizes else None
     
     @tx.transactional
     def cleanup_inconsistent_items(self):
         for command in [DeleteImagesCommand(self._image_metadata_repository,
                                        self._session_template,
                                        self._path_generator,
-                                       lambda: self._image_metadata_repository.find_inconsistent_derived_image_metadatas()),
+                                       lambda: self._abandoned(self._image_metadata_repository.find_inconsistent_derived_image_metadatas()),
+                                       self._on_item_deleted),
                         DeleteImagesCommand(self._image_metadata_repository,
                                        self._session_template,
                                        self._path_generator,
-                                       lambda: self._image_metadata_repository.find_inconsistent_original_image_metadatas())]:
+                                       lambda: self._abandoned(self._image_metadata_repository.find_inconsistent_original_image_metadatas()),
+                                       self._on_item_deleted)]:
             command.execute()
     
+    def _abandoned(self, image_metadatas):
+        """ Items that are not OK are committed before their files are created, so they may be in progress 
+        in another process : only the items whose lock is free have been abandoned by a dead worker """
+        abandoned = []
+        for item in image_metadatas:
+            try:
+                self._lock_manager.acquire(item.id).release()
+            except imgengine.LockTimeoutException:
+                logger.info("Item is being created, not cleaning it up: %s" % (item.id,))
+                continue
+            self._session_template.do_with_session(lambda session: session.refresh(item))
+            if item.status != domain.STATUS_OK:
+                abandoned.append(item)
+        return abandoned
+    
     @tx.transactional
     def delete(self, image_id):
         def image_metadatas_to_delete():
@@ -207,8 +664,42 @@ class DefaultImageRequestProcessor(object):
         DeleteImagesCommand(self._image_metadata_repository,
                             self._session_template,
                             self._path_generator,
-                            lambda: image_metadatas_to_delete()).execute()
+                            lambda: image_metadatas_to_delete(),
+                            self._on_item_deleted).execute()
+    
+    def add_listener(self, listener):
+        self._listeners.append(imgengine.ImageMetadataListener(listener))
+    
+    def _on_item_saved(self, image_id):
+        for listener in self._listeners:
+            listener.image_metadata_saved(image_id)
+    
+    def _on_item_deleted(self, item):
+        """ removes the files that are associated to the item, in addition to its image """
+        self._derivation_executor.forget(item.associated_image_path(self._path_generator).absolute())
+        if isinstance(item, domain.DerivedImageMetadata):
+            for derived_path in self._path_generator.derived_paths(item):
+                remove_file(derived_path.absolute())
+            if self._packed_image_store is not None:
+                self._packed_image_store.delete(item.id)
+            if self._derived_image_index is not None:
+                self._derived_image_index.discard(item.id)
+            if self._public_tree is not None:
+                self._public_tree.unpublish(item.original_image_metadata.id, item.size, item.format)
+            self._release_content(self._derived_content_key(item.original_image_metadata.content_hash, item.size, item.format))
+        if isinstance(item, domain.OriginalImageMetadata):
+            remove_file(self._path_generator.mezzanine_path(item).absolute())
+            self._derivation_executor.forget(self._path_generator.mezzanine_path(item).absolute())
+            self._release_content(self._mezzanine_content_key(item.content_hash))
+            self._release_content(item.content_hash if self._content_store is not None else None)
+        for listener in self._listeners:
+            listener.image_metadata_deleted(item.id)
             
+    def _release_content(self, content_key):
+        """ the files of the item have been removed : the blob is removed too if no other item uses it """
+        if content_key is not None:
+            self._content_store.release(content_key)
+    
     def _drop_data(self):
         self._schema_migrator.drop_all_tables()
         if os.path.exists(self._data_directory):
@@ -0,0 +1,244 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import with_statement
+import os
+import math
+import errno
+import shutil
+import tempfile
+from cStringIO import StringIO
+import Image, ImageOps
+
+# JPEG images are decoded at a reduced scale (1/2, 1/4 or 1/8) when the target is much smaller 
+# than the source, but always to at least DRAFT_OVERSAMPLING times the pixels the resize needs, 
+# so that the antialiasing filter still has enough data to work with
+DRAFT_OVERSAMPLING = 2
+
+PLACEHOLDER_COLOR = (204, 204, 204)
+
+# the derived images are created from the mezzanine : it is encoded with as few losses as its format allows, 
+# so that they do not carry the artifacts of two lossy encodings
+MEZZANINE_ENCODER_OPTIONS = {'JPEG': {'quality': 95, 'subsampling': 0}}
+
+def derive(source_filename, target_filename, size, target_format):
+    """ Resizes the source image so that it fits the given size, and saves it in the given format.
+    This function only deals with files, so that it can be executed in a worker process.
+    @return: target_filename
+    @raise IOError: if the source image cannot be read, or the target image cannot be written 
+    """
+    return derive_all(source_filename, [(target_filename, size, target_format)])[0]
+
+def derive_mezzanine(source_filename, target_filename, size, target_format):
+    """ Same as derive(), with the MEZZANINE_ENCODER_OPTIONS of the target format
+    @return: target_filename
+    """
+    encode_all(source_filename, [(target_filename, size, target_format)], 
+               encoder_options=MEZZANINE_ENCODER_OPTIONS.get(target_format.upper()))
+    return target_filename
+
+def derive_all(source_filename, derivations, decoded_images=None):
+    """ Same as derive(), for several (target_filename, size, target_format) derivations 
+    of the same source image, that is decoded only once
+    @param decoded_images: an optional caching.Cache of DecodedImage objects, keyed by source filename, 
+    so that the next derivations of the same source (in the same process) do not decode it again
+    @return: the list of target filenames
+    """
+    encode_all(source_filename, derivations, decoded_images)
+    return [target_filename for (target_filename, size, target_format) in derivations]
+
+def encode_all(source_filename, derivations, decoded_images=None, encoder_options=None):
+    """ Same as derive_all(), but the images are encoded in memory, then written to their target file in one pass : 
+    the caller can send the encoded images without reading the files again
+    @param encoder_options: the options given to the encoder of the resized images (e.g. the JPEG quality)
+    @return: the list of encoded images (str), in the order of the derivations
+    """
+    img = Image.open(source_filename)
+    encoded_images = {}
+    resized_derivations = []
+    for target_filename, size, target_format in derivations:
+        if size == img.size and target_format.upper() == img.format.upper():
+            with open(source_filename, 'rb') as f:
+                encoded_images[target_filename] = f.read()
+            _write_atomically(target_filename, encoded_images[target_filename])
+        else:
+            resized_derivations.append((target_filename, size, target_format))
+    
+    if resized_derivations:
+        img = _decode(source_filename, img, [size for (target_filename, size, target_format) in resized_derivations], decoded_images)
+        for target_filename, size, target_format in resized_derivations:
+            target_image = ImageOps.fit(image=img,
+                                        size=size,
+                                        method=Image.ANTIALIAS,
+                                        centering=(0.5, 0.5))
+            encoded_image = StringIO()
+            target_image.save(encoded_image, target_format, **(encoder_options or {}))
+            encoded_images[target_filename] = encoded_image.getvalue()
+            _write_atomically(target_filename, encoded_images[target_filename])
+    return [encoded_images[target_filename] for (target_filename, size, target_format) in derivations]
+
+def fit_crop_size(source_size, target_size):
+    """ @return: the size of the centered region of the source image that ImageOps.fit() keeps 
+    when it resizes the source image to target_size """
+    source_ratio = float(source_size[0]) / source_size[1]
+    target_ratio = float(target_size[0]) / target_size[1]
+    if source_ratio > target_ratio:
+        return (source_size[1] * target_ratio, float(source_size[1]))
+    return (float(source_size[0]), source_size[0] / target_ratio)
+
+def can_derive_from(original_size, derivative_size, target_size, min_ratio):
+    """ @return: True if the given derivative of the original image (that was created by ImageOps.fit()) 
+    contains the whole region of the original image that target_size needs, with at least min_ratio times 
+    the pixels of target_size in each dimension """
+    target_crop_size = fit_crop_size(original_size, target_size)
+    derivative_crop_size = fit_crop_size(original_size, derivative_size)
+    # one pixel of tolerance, for the rounding done by ImageOps.fit()
+    if target_crop_size[0] > derivative_crop_size[0] + 1 or target_crop_size[1] > derivative_crop_size[1] + 1:
+        return False
+    scale = derivative_size[0] / derivative_crop_size[0]
+    return target_crop_size[0] * scale >= min_ratio * target_size[0] and target_crop_size[1] * scale >= min_ratio * target_size[1]
+
+def mezzanine_size(original_size, max_size):
+    """ @return: the size of the original image, scaled down so that its longest side is max_size """
+    scale = float(max_size) / max(original_size)
+    return (max(1, int(round(original_size[0] * scale))), max(1, int(round(original_size[1] * scale))))
+
+def draft_size(source_size, target_size):
+    """ @return: the minimal size the source image has to be decoded to, so that it can 
+    be cropped and resized to target_size without losing quality """
+    scale = max(float(target_size[0]) / source_size[0], float(target_size[1]) / source_size[1]) * DRAFT_OVERSAMPLING
+    return (int(math.ceil(source_size[0] * scale)), int(math.ceil(source_size[1] * scale)))
+
+class DecodedImage(object):
+    """ A decoded source image, as stored in a caching.Cache. Its length is the memory its pixels use, 
+    so that LruCache budgets are expressed in bytes """
+    def __init__(self, image, modification_time):
+        self.image = image
+        self.modification_time = modification_time
+    
+    def __len__(self):
+        return self.image.size[0] * self.image.size[1] * len(self.image.getbands())
+
+def _decode(source_filename, img, sizes, decoded_images):
+    """ @return: the decoded source image, that has enough pixels for all the given sizes """
+    draft_sizes = [draft_size(img.size, size) for size in sizes]
+    minimal_size = (min(img.size[0], max([s[0] for s in draft_sizes])), min(img.size[1], max([s[1] for s in draft_sizes])))
+    modification_time = os.stat(source_filename).st_mtime
+    if decoded_images is not None:
+        decoded_image = decoded_images.get(source_filename)
+        if decoded_image is not None \
+            and decoded_image.modification_time == modification_time \
+            and decoded_image.image.size[0] >= minimal_size[0] and decoded_image.image.size[1] >= minimal_size[1]:
+            return decoded_image.image
+    if img.format == 'JPEG':
+        img = _draft(source_filename, img, minimal_size)
+    img.load()
+    if decoded_images is not None:
+        decoded_images.put(source_filename, DecodedImage(img, modification_time))
+    return img
+
+def _draft(source_filename, img, minimal_size):
+    """ configures the JPEG decoder to scale the image down while decoding it (DCT scaling), 
+    as much as minimal_size allows """
+    if minimal_size[0] >= img.size[0] or minimal_size[1] >= img.size[1]:
+        return img
+    img.draft(img.mode, minimal_size)
+    if img.size[0] < minimal_size[0] or img.size[1] < minimal_size[1]:
+        # the decoder scaled down more than requested, decode the image at full scale instead
+        return Image.open(source_filename)
+    return img
+
+def placeholder(target_filename, size, target_format):
+    """ Saves a plain image of the given size and format
+    @return: target_filename
+    """
+    _save_atomically(target_filename, lambda temporary_filename: Image.new('RGB', size, PLACEHOLDER_COLOR).save(temporary_filename, target_format))
+    return target_filename
+
+def copy_atomically(source_filename, target_filename):
+    """ copies the file, and its modification time, so that it is seen as the same file by the caches """
+    _save_atomically(target_filename, lambda temporary_filename: shutil.copy2(source_filename, temporary_filename))
+
+def link_atomically(source_filename, target_filename):
+    """ makes the file available under target_filename too, while it is served and possibly deleted : it is hard linked 
+    when both names are on the same filesystem, and copied otherwise. If the source disappears while it is being copied, 
+    it has been deleted, and so is the copy 
+    @return: True if the file has been linked or copied, False if the source or the target already exists """
+    if os.path.exists(target_filename):
+        return False
+    try:
+        _make_parent_directory(target_filename)
+        try:
+            os.link(source_filename, target_filename)
+            return True
+        except OSError, ex:
+            if ex.errno not in (errno.EXDEV, errno.EPERM):
+                raise
+        copy_atomically(source_filename, target_filename)
+    except (IOError, OSError), ex:
+        if ex.errno not in (errno.ENOENT, errno.EEXIST):
+            raise
+        return False
+    if not os.path.exists(source_filename):
+        _remove_file(target_filename)
+        return False
+    return True
+
+def move_atomically(source_filename, target_filename):
+    """ moves the file, possibly to another filesystem, while it is served and possibly deleted : 
+    it is available under target_filename before it is removed from source_filename (see link_atomically()) 
+    @return: True if the file has been moved """
+    if os.path.exists(target_filename):
+        _remove_file(source_filename)
+        return False
+    if not link_atomically(source_filename, target_filename):
+        return False
+    _remove_file(source_filename)
+    return True
+
+def _remove_file(filename):
+    try:
+        os.remove(filename)
+    except OSError, ex:
+        if ex.errno != errno.ENOENT:
+            raise
+
+def _save_atomically(target_filename, save):
+    """ save(temporary_filename) writes the file under a temporary name, in the target directory, that is then 
+    renamed to target_filename : concurrent readers never see a partially written file """
+    _make_parent_directory(target_filename)
+    fd, temporary_filename = tempfile.mkstemp(prefix='.', suffix='.tmp', dir=os.path.dirname(target_filename))
+    os.close(fd)
+    try:
+        save(temporary_filename)
+        os.chmod(temporary_filename, 0644)
+        os.rename(temporary_filename, target_filename)
+    except:
+        os.remove(temporary_filename)
+        raise
+
+def _write_atomically(target_filename, data):
+    def write(temporary_filename):
+        with open(temporary_filename, 'wb') as f:
+            f.write(data)
+    _save_atomically(target_filename, write)
+
+def _make_parent_directory(filename):
+    try:
+        os.makedirs(os.path.dirname(filename))
+    except OSError, ex:
+        if ex.errno != errno.EEXIST:
+            raise
@@ -0,0 +1,107 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import with_statement
+import threading
+import Queue
+import logging
+
+logger = logging.getLogger("imgengine.derivationqueue")
+
+class DerivationQueue(object):
+    """ Executes derivation tasks in a bounded pool of background threads, 
+    so that the work does not delay the requests that trigger it 
+    (e.g. pre-generating the derived images of an image that has just been uploaded) """
+    
+    def __init__(self, workers, max_pending_tasks):
+        """ @param workers: the number of background threads 
+            @param max_pending_tasks: tasks submitted beyond this limit are rejected """
+        self.__tasks = Queue.Queue(max_pending_tasks)
+        self.__workers = workers
+        self.__max_pending_tasks = max_pending_tasks
+        self.__pending_keys = set()
+        self.__lock = threading.Lock()
+        self.__submitted = 0
+        self.__rejected = 0
+        self.__completed = 0
+        self.__failed = 0
+        self.__running = 0
+        self.__threads = [threading.Thread(target=self.__work, name="derivation-queue-%s" % i) for i in range(workers)]
+        for thread in self.__threads:
+            thread.setDaemon(True)
+            thread.start()
+        logger.info("Started derivation queue (workers: %s, max pending tasks: %s)" % (workers, max_pending_tasks))
+    
+    def submit(self, key, task):
+        """ Schedules the execution of task(), unless a task with the same key is already pending 
+        @return: False if the queue is full, True otherwise """
+        with self.__lock:
+            if key in self.__pending_keys:
+                return True
+            try:
+                self.__tasks.put_nowait((key, task))
+            except Queue.Full:
+                self.__rejected += 1
+                logger.warning("Derivation queue is full, task rejected: %s" % (key,))
+                return False
+            self.__pending_keys.add(key)
+            self.__submitted += 1
+            return True
+    
+    def __work(self):
+        while True:
+            key, task = self.__tasks.get()
+            if task is None:
+                return
+            with self.__lock:
+                self.__pending_keys.discard(key)
+                self.__running += 1
+            try:
+                task()
+            except Exception:
+                logger.exception("Background derivation failed: %s" % (key,))
+                with self.__lock:
+                    self.__failed += 1
+            else:
+                with self.__lock:
+                    self.__completed += 1
+            finally:
+                with self.__lock:
+                    self.__running -= 1
+                self.__tasks.task_done()
+    
+    def join(self):
+        """ Blocks until all the submitted tasks have been executed """
+        self.__tasks.join()
+    
+    def statistics(self):
+        """ @return: a dictionary describing the activity of the queue """
+        with self.__lock:
+            return {'workers': self.__workers,
+                    'max_pending_tasks': self.__max_pending_tasks,
+                    'pending_tasks': self.__tasks.qsize(),
+                    'running_tasks': self.__running,
+                    'submitted_tasks': self.__submitted,
+                    'rejected_tasks': self.__rejected,
+                    'completed_tasks': self.__completed,
+                    'failed_tasks': self.__failed}
+    
+    def shutdown(self):
+        """ Stops the workers once the pending tasks have been executed """
+        for thread in self.__threads:
+            self.__tasks.put((None, None))
+        for thread in self.__threads:
+            thread.join()
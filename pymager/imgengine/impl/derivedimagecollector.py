@@ -0,0 +1,86 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import with_statement
+import threading
+import logging
+from pymager import imgengine
+
+logger = logging.getLogger("imgengine.derivedimagecollector")
+
+class DerivedImageCollector(object):
+    """ Keeps the files of the derived images under a disk quota : a background thread periodically 
+    writes the recorded accesses to the database, and then deletes the least recently accessed 
+    derived images, that will be created again if they are requested """
+    
+    def __init__(self, image_processor, access_tracker, max_bytes, interval_seconds):
+        """ @param image_processor: the imgengine.ImageRequestProcessor that deletes the derived images 
+            @param access_tracker: the AccessTracker that is flushed before each collection 
+            @param max_bytes: the quota of the derived images 
+            @param interval_seconds: the time between two collections """
+        self.__image_processor = imgengine.ImageRequestProcessor(image_processor)
+        self.__access_tracker = access_tracker
+        self.__max_bytes = max_bytes
+        self.__interval_seconds = interval_seconds
+        self.__lock = threading.Lock()
+        self.__runs = 0
+        self.__collected = 0
+        self.__failed = 0
+        self.__stopped = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, name="derived-image-collector")
+        self.__thread.setDaemon(True)
+        self.__thread.start()
+        logger.info("Started derived image collector (quota: %s bytes, interval: %s seconds)" % (max_bytes, interval_seconds))
+    
+    def __run(self):
+        while True:
+            self.__stopped.wait(self.__interval_seconds)
+            if self.__stopped.isSet():
+                return
+            self.collect()
+    
+    def collect(self):
+        """ @return: the number of derived images that have been deleted """
+        try:
+            self.__access_tracker.flush()
+            collected = self.__image_processor.collect_derived_images(self.__max_bytes)
+        except Exception:
+            logger.exception("Derived image collection failed")
+            with self.__lock:
+                self.__runs += 1
+                self.__failed += 1
+            return 0
+        if collected:
+            logger.info("Deleted %s derived images to stay under %s bytes" % (collected, self.__max_bytes))
+        with self.__lock:
+            self.__runs += 1
+            self.__collected += collected
+        return collected
+    
+    def statistics(self):
+        """ @return: a dictionary describing the activity of the collector """
+        with self.__lock:
+            statistics = {'max_bytes': self.__max_bytes,
+                          'runs': self.__runs,
+                          'failed_runs': self.__failed,
+                          'collected_images': self.__collected}
+        statistics.update(self.__access_tracker.statistics())
+        return statistics
+    
+    def shutdown(self):
+        """ Stops the background thread, after the collection in progress """
+        self.__stopped.set()
+        self.__thread.join()
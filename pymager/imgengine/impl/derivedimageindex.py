@@ -0,0 +1,143 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import with_statement
+import time
+import logging
+import threading
+from pymager import domain
+from pymager import resources
+
+logger = logging.getLogger("imgengine.derivedimageindex")
+
+# how long to wait before trying to load the index again, when the database is not available
+RETRY_SECONDS = 10
+
+def derived_image_metadata(derived_image_id):
+    """ @return: a transient domain.DerivedImageMetadata of the given id, that is enough to compute the path of its file """
+    image_id, size, format = derived_image_id.rsplit('-', 2)
+    width, height = size.split('x')
+    return domain.DerivedImageMetadata(domain.STATUS_OK, (int(width), int(height)), format, 
+                                       domain.OriginalImageMetadata(image_id, domain.STATUS_OK, (int(width), int(height)), format))
+
+class DerivedImageIndex(object):
+    """ The ids of the derived images whose file is known to be complete, with the relative path of their file, 
+    so that they can be served without looking for their file.
+    It is loaded from the database, and maintained by the ImageRequestProcessor of this process. 
+    The images that other processes delete or move are forgotten when the index is reloaded (in a background thread), 
+    every rebuild_seconds (0 : never reloaded), or when their file is found missing while it is served """
+    
+    def __init__(self, image_metadata_repository, path_generator, rebuild_seconds=3600):
+        self.__image_metadata_repository = domain.ImageMetadataRepository(image_metadata_repository)
+        self.__path_generator = resources.PathGenerator(path_generator)
+        self.__rebuild_seconds = rebuild_seconds
+        self.__ids = None
+        # when to reload the index, None means never
+        self.__expiry = 0
+        # the changes made while the index is being reloaded, that are replayed on the new index
+        self.__changes_while_rebuilding = None
+        self.__rebuilding_in_background = False
+        self.__lock = threading.Lock()
+        self.__rebuild_lock = threading.Lock()
+        self.__hits = 0
+        self.__misses = 0
+    
+    def rebuild(self):
+        """ Loads the ids of the OK derived images, and the paths of their file. Concurrent lookups keep using the previous index """
+        if not self.__rebuild_lock.acquire(False):
+            return
+        try:
+            with self.__lock:
+                self.__changes_while_rebuilding = []
+            try:
+                ids = {}
+                for derived_image_id in self.__image_metadata_repository.find_derived_image_metadata_ids_by_status(domain.STATUS_OK):
+                    ids[derived_image_id] = self.__path_generator.derived_path(derived_image_metadata(derived_image_id)).relative()
+            finally:
+                with self.__lock:
+                    changes, self.__changes_while_rebuilding = self.__changes_while_rebuilding, None
+            with self.__lock:
+                for change, derived_image_id in changes:
+                    change(ids, derived_image_id)
+                self.__ids = ids
+                self.__expiry = time.time() + self.__rebuild_seconds if self.__rebuild_seconds else None
+            logger.info("Loaded %s derived image ids" % (len(ids),))
+        finally:
+            self.__rebuild_lock.release()
+    
+    def __rebuild_quietly(self):
+        try:
+            self.rebuild()
+        except Exception, ex:
+            # the derived images must still be served when the database is down
+            logger.warning("Impossible to load the derived image ids: %s" % (ex,))
+            with self.__lock:
+                self.__expiry = time.time() + RETRY_SECONDS
+    
+    def __rebuild_in_background(self):
+        with self.__lock:
+            if self.__rebuilding_in_background:
+                return
+            self.__rebuilding_in_background = True
+        def rebuild():
+            try:
+                self.__rebuild_quietly()
+            finally:
+                with self.__lock:
+                    self.__rebuilding_in_background = False
+        thread = threading.Thread(target=rebuild, name="derived-image-index-rebuild")
+        thread.setDaemon(True)
+        thread.start()
+    
+    def __contains__(self, derived_image_id):
+        return self.get(derived_image_id) is not None
+    
+    def get(self, derived_image_id):
+        """ @return: the relative path of the file of the derived image, or None if the derived image is not in the index """
+        if self.__expiry is not None and self.__expiry <= time.time():
+            if self.__ids is None:
+                self.__rebuild_quietly()
+            else:
+                self.__rebuild_in_background()
+        with self.__lock:
+            if self.__ids is not None and derived_image_id in self.__ids:
+                self.__hits += 1
+                return self.__ids[derived_image_id]
+            self.__misses += 1
+            return None
+    
+    def add(self, derived_image_id, relative_path):
+        def add(ids, derived_image_id):
+            ids[derived_image_id] = relative_path
+        self.__change(add, derived_image_id)
+    
+    def discard(self, derived_image_id):
+        def discard(ids, derived_image_id):
+            ids.pop(derived_image_id, None)
+        self.__change(discard, derived_image_id)
+    
+    def __change(self, change, derived_image_id):
+        with self.__lock:
+            if self.__ids is not None:
+                change(self.__ids, derived_image_id)
+            if self.__changes_while_rebuilding is not None:
+                self.__changes_while_rebuilding.append((change, derived_image_id))
+    
+    def statistics(self):
+        with self.__lock:
+            return {'entries': len(self.__ids) if self.__ids is not None else None,
+                    'hits': self.__hits,
+                    'misses': self.__misses}
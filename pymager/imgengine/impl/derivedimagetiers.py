@@ -0,0 +1,200 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import with_statement
+import os
+import shutil
+import logging
+import threading
+from pymager.imgengine.impl import derivation
+from pymager.resources.impl.tieredpathgenerator import HOT_DIRECTORY
+
+logger = logging.getLogger("imgengine.derivedimagetiers")
+
+class DerivedImageTiers(object):
+    """ Moves the derived images between the tiers of a TieredPathGenerator : a background thread periodically 
+    promotes the derived images of the main tier that have been accessed at least promotion_accesses times, 
+    and demotes the least accessed derived images of the hot tier, so that it does not exceed hot_max_bytes. 
+    The access counts are halved at each rebalancing, so that they reflect the recent accesses.
+    
+    A moved derived image is linked into its new tier first, and its previous file is only removed at the next 
+    rebalancing : the requests that have looked it up in its previous tier meanwhile can still read it. 
+    The derived images are identified by their path relative to their tier, that is the same in both tiers """
+    
+    def __init__(self, tiered_path_generator, data_directory, hot_directory, hot_max_bytes, promotion_accesses, rebalance_seconds):
+        """ @param hot_directory: the directory of the hot tier, e.g. on a SSD or a tmpfs """
+        self.__tiered_path_generator = tiered_path_generator
+        self.__data_directory = data_directory
+        self.__hot_directory = hot_directory
+        self.__hot_max_bytes = hot_max_bytes
+        self.__promotion_accesses = promotion_accesses
+        self.__rebalance_seconds = rebalance_seconds
+        self.__access_counts = {}
+        self.__lock = threading.Lock()
+        self.__hot_bytes = 0
+        self.__promoted = 0
+        self.__demoted = 0
+        # the (filename, inode) of the previous files of the moved derived images
+        self.__moved_files = []
+        self.__stopped = threading.Event()
+        self.__thread = None
+    
+    def start(self, drop_hot_tier=False):
+        """ Links the hot tier into the data directory, and starts the background thread. 
+        Must be called once the data directory has been initialized """
+        if drop_hot_tier and os.path.exists(self.__hot_directory):
+            shutil.rmtree(self.__hot_directory)
+        if not os.path.exists(self.__hot_directory):
+            os.makedirs(self.__hot_directory)
+        link = os.path.join(self.__data_directory, HOT_DIRECTORY)
+        if os.path.realpath(link) != os.path.realpath(self.__hot_directory):
+            if not os.path.exists(self.__data_directory):
+                os.makedirs(self.__data_directory)
+            if os.path.islink(link):
+                os.remove(link)
+            os.symlink(self.__hot_directory, link)
+        self.__thread = threading.Thread(target=self.__run, name="derived-image-tiers")
+        self.__thread.setDaemon(True)
+        self.__thread.start()
+        logger.info("Started derived image tiers (hot tier: %s, %s bytes)" % (self.__hot_directory, self.__hot_max_bytes))
+    
+    def __run(self):
+        while True:
+            self.__stopped.wait(self.__rebalance_seconds)
+            if self.__stopped.isSet():
+                return
+            try:
+                self.rebalance()
+            except Exception:
+                logger.exception("Derived image rebalancing failed")
+    
+    def record_access(self, derived_image_metadata):
+        relative_path = self.__tiered_path_generator.main_derived_path(derived_image_metadata).relative()
+        with self.__lock:
+            self.__access_counts[relative_path] = self.__access_counts.get(relative_path, 0) + 1
+    
+    def __hot_path(self, relative_path):
+        return os.path.join(self.__hot_directory, relative_path)
+    
+    def __main_path(self, relative_path):
+        return os.path.join(self.__data_directory, relative_path)
+    
+    def __hot_files(self):
+        """ @return: a dictionary of the relative paths of the derived images of the hot tier to their size """
+        hot_files = {}
+        for directory, subdirectories, filenames in os.walk(self.__hot_directory):
+            for filename in filenames:
+                # temporary files
+                if filename.startswith('.'):
+                    continue
+                path = os.path.join(directory, filename)
+                try:
+                    hot_files[os.path.relpath(path, self.__hot_directory)] = os.path.getsize(path)
+                except OSError:
+                    pass
+        return hot_files
+    
+    def __move(self, source_filename, target_filename):
+        """ @return: True if the derived image has been linked into its new tier """
+        try:
+            inode = os.stat(source_filename).st_ino
+        except OSError:
+            return False
+        if os.path.exists(target_filename):
+            # moved before the previous shutdown
+            self.__moved_files.append((source_filename, inode))
+            return False
+        if not derivation.link_atomically(source_filename, target_filename):
+            return False
+        self.__moved_files.append((source_filename, inode))
+        return True
+    
+    def __remove_moved_files(self):
+        """ the previous file of a moved derived image is not removed if it has been created again since """
+        moved_files, self.__moved_files = self.__moved_files, []
+        for filename, inode in moved_files:
+            try:
+                if os.stat(filename).st_ino == inode:
+                    os.remove(filename)
+            except OSError:
+                pass
+    
+    def rebalance(self):
+        """ @return: the number of promoted and demoted derived images """
+        self.__remove_moved_files()
+        with self.__lock:
+            access_counts = self.__access_counts
+            self.__access_counts = dict([(relative_path, count // 2) for (relative_path, count) in access_counts.iteritems() if count > 1])
+        
+        hot_files = self.__hot_files()
+        hot_bytes = sum(hot_files.values())
+        # the coldest are popped first
+        demotion_candidates = sorted(hot_files.keys(), key=lambda relative_path: access_counts.get(relative_path, 0), reverse=True)
+        promotion_candidates = sorted([relative_path for (relative_path, count) in access_counts.iteritems() 
+                                       if count >= self.__promotion_accesses and relative_path not in hot_files], 
+                                      key=lambda relative_path: access_counts[relative_path])
+        promoted = 0
+        demoted = 0
+        
+        while hot_bytes > self.__hot_max_bytes and demotion_candidates:
+            relative_path = demotion_candidates.pop()
+            if self.__move(self.__hot_path(relative_path), self.__main_path(relative_path)):
+                demoted += 1
+            hot_bytes -= hot_files[relative_path]
+        
+        while promotion_candidates:
+            relative_path = promotion_candidates.pop()
+            try:
+                size = os.path.getsize(self.__main_path(relative_path))
+            except OSError:
+                continue
+            # colder derived images make room for hotter ones
+            while hot_bytes + size > self.__hot_max_bytes and demotion_candidates \
+                    and access_counts.get(demotion_candidates[-1], 0) < access_counts[relative_path]:
+                coldest = demotion_candidates.pop()
+                if self.__move(self.__hot_path(coldest), self.__main_path(coldest)):
+                    demoted += 1
+                hot_bytes -= hot_files[coldest]
+            if hot_bytes + size > self.__hot_max_bytes:
+                continue
+            if self.__move(self.__main_path(relative_path), self.__hot_path(relative_path)):
+                promoted += 1
+                hot_bytes += size
+        
+        with self.__lock:
+            self.__hot_bytes = hot_bytes
+            self.__promoted += promoted
+            self.__demoted += demoted
+        if promoted or demoted:
+            logger.info("Promoted %s and demoted %s derived images" % (promoted, demoted))
+        return promoted, demoted
+    
+    def statistics(self):
+        """ @return: a dictionary describing the activity of the tiers """
+        with self.__lock:
+            return {'hot_bytes': self.__hot_bytes,
+                    'hot_max_bytes': self.__hot_max_bytes,
+                    'tracked_images': len(self.__access_counts),
+                    'promoted_images': self.__promoted,
+                    'demoted_images': self.__demoted}
+    
+    def shutdown(self):
+        """ Stops the background thread, after the rebalancing in progress, and removes the previous files 
+        of the derived images it has moved """
+        self.__stopped.set()
+        if self.__thread is not None:
+            self.__thread.join()
+        self.__remove_moved_files()
@@ -0,0 +1,57 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import os
+import re
+import logging
+from pymager.imgengine.impl import derivation
+from pymager.resources.impl.stripedpathgenerator import DISKS_DIRECTORY
+
+logger = logging.getLogger("imgengine.diskrebalancer")
+
+# the filenames of the original, mezzanine and derived images start with the hash that assigns them to a disk
+_IMAGE_HASH_PATTERN = re.compile(r'^([0-9a-f]{40})[-.]')
+
+class DiskRebalancer(object):
+    """ Moves the images of the disks of a StripedPathGenerator to the disk they are assigned to, 
+    e.g. after a disk has been added. It can run while the server is serving and deleting the images """
+    
+    def __init__(self, striped_path_generator, data_directory, disk_count):
+        self.__striped_path_generator = striped_path_generator
+        self.__data_directory = data_directory
+        self.__disk_count = disk_count
+    
+    def __disk_directory(self, disk):
+        return os.path.join(self.__data_directory, DISKS_DIRECTORY, str(disk))
+    
+    def rebalance(self):
+        """ @return: the number of moved images """
+        moved = 0
+        for disk in range(self.__disk_count):
+            disk_directory = self.__disk_directory(disk)
+            for directory, subdirectories, filenames in os.walk(disk_directory):
+                for filename in filenames:
+                    match = _IMAGE_HASH_PATTERN.match(filename)
+                    if match is None:
+                        continue
+                    assigned_disk = self.__striped_path_generator.disk(match.group(1))
+                    if assigned_disk == disk:
+                        continue
+                    path = os.path.join(directory, filename)
+                    if derivation.move_atomically(path, os.path.join(self.__disk_directory(assigned_disk), os.path.relpath(path, disk_directory))):
+                        moved += 1
+            logger.info("Rebalanced disk %s (%s images moved so far)" % (disk, moved))
+        return moved
@@ -0,0 +1,104 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import os
+import errno
+import fcntl
+import time
+import hashlib
+import logging
+from zope.interface import implements
+from pymager import imgengine
+
+logger = logging.getLogger("imgengine.filelockmanager")
+
+DEFAULT_TIMEOUT_SECONDS = 10
+POLLING_INTERVAL_SECONDS = 0.05
+
+class FileLockManager(object):
+    """ an imgengine.LockManager implementation based on flock(), that works across 
+    the processes of a single host. 
+    
+    The kernel releases the locks of a process that dies, so a crashed worker can 
+    never leave a stale lock behind. Lock files are removed when the lock is released """
+    implements(imgengine.LockManager)
+    
+    def __init__(self, lock_directory, timeout_seconds=DEFAULT_TIMEOUT_SECONDS):
+        self.__lock_directory = lock_directory
+        self.__timeout_seconds = timeout_seconds
+    
+    def acquire(self, key):
+        filename = self.__lock_filename(key)
+        deadline = time.time() + self.__timeout_seconds
+        while True:
+            fd = self.__open(filename)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError, ex:
+                os.close(fd)
+                if ex.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                if time.time() > deadline:
+                    raise imgengine.LockTimeoutException(key)
+                time.sleep(POLLING_INTERVAL_SECONDS)
+            else:
+                # the previous owner may have unlinked the file between our open() and flock()
+                if self.__is_current_lock_file(fd, filename):
+                    return _FileLock(fd, filename)
+                os.close(fd)
+    
+    def __lock_filename(self, key):
+        h = hashlib.sha1()
+        h.update(key)
+        return os.path.join(self.__lock_directory, '%s.lock' % h.hexdigest())
+    
+    def __open(self, filename):
+        try:
+            return os.open(filename, os.O_RDWR | os.O_CREAT, 0644)
+        except OSError, ex:
+            if ex.errno != errno.ENOENT:
+                raise
+            try:
+                os.makedirs(self.__lock_directory)
+            except OSError, ex:
+                if ex.errno != errno.EEXIST:
+                    raise
+            return os.open(filename, os.O_RDWR | os.O_CREAT, 0644)
+    
+    def __is_current_lock_file(self, fd, filename):
+        try:
+            return os.fstat(fd).st_ino == os.stat(filename).st_ino
+        except OSError, ex:
+            if ex.errno != errno.ENOENT:
+                raise
+            return False
+
+class _FileLock(object):
+    def __init__(self, fd, filename):
+        self.__fd = fd
+        self.__filename = filename
+    
+    def release(self):
+        if self.__fd is None:
+            return
+        try:
+            # unlink while we still hold the lock, so that nobody can acquire a lock on a file that is going away
+            os.unlink(self.__filename)
+        except OSError, ex:
+            logger.warning("Impossible to remove lock file %s: %s" % (self.__filename, ex))
+        finally:
+            os.close(self.__fd)
+            self.__fd = None
@@ -0,0 +1,57 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from zope.interface import implements
+from pymager import imgengine
+from pymager import caching
+from pymager.imgengine.impl import derivation
+
+class InlineDerivationExecutor(object):
+    """ an imgengine.DerivationExecutor that does the work in the calling thread """
+    implements(imgengine.DerivationExecutor)
+    
+    def __init__(self, decoded_images=None):
+        """ @param decoded_images: an optional caching.Cache, that keeps the decoded source images in memory, 
+        for bursts of derivations of the same image """
+        self.__decoded_images = caching.Cache(decoded_images) if decoded_images is not None else None
+    
+    def derive(self, source_filename, target_filename, size, target_format):
+        return self.derive_all(source_filename, [(target_filename, size, target_format)])[0]
+    
+    def derive_mezzanine(self, source_filename, target_filename, size, target_format):
+        try:
+            return derivation.derive_mezzanine(source_filename, target_filename, size, target_format)
+        except IOError, ex:
+            raise imgengine.ImageProcessingException(ex)
+    
+    def derive_all(self, source_filename, derivations):
+        try:
+            return derivation.derive_all(source_filename, derivations, self.__decoded_images)
+        except IOError, ex:
+            raise imgengine.ImageProcessingException(ex)
+    
+    def encode_all(self, source_filename, derivations):
+        try:
+            return derivation.encode_all(source_filename, derivations, self.__decoded_images)
+        except IOError, ex:
+            raise imgengine.ImageProcessingException(ex)
+    
+    def forget(self, source_filename):
+        if self.__decoded_images is not None:
+            self.__decoded_images.invalidate(source_filename)
+    
+    def shutdown(self):
+        pass
@@ -0,0 +1,123 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import with_statement
+import os
+import errno
+import struct
+import hashlib
+import tempfile
+import Image
+from cStringIO import StringIO
+from pymager import imgengine
+from pymager.imgengine._deleteimagescommand import remove_file
+
+CHUNK_SIZE = 64 * 1024
+
+# the image is rejected if its header cannot be parsed from its first HEADER_MAX_BYTES
+HEADER_MAX_BYTES = 1024 * 1024
+
+class OriginalImageUpload(object):
+    """ An original image that has been received, and written to a temporary file in the directory of its final path """
+    def __init__(self, temporary_filename, size, format, content_hash):
+        self.temporary_filename = temporary_filename
+        self.size = size
+        self.format = format
+        self.content_hash = content_hash
+    
+    def publish(self, filename):
+        """ renames the temporary file to filename, that must be in the same directory """
+        os.rename(self.temporary_filename, filename)
+    
+    def discard(self):
+        remove_file(self.temporary_filename)
+
+def receive(chunks, directory_for):
+    """ Writes the image in a single pass, while its header is parsed and its SHA-1 hash is computed, then verifies it. 
+    The first chunks are kept in memory until the header tells where the image is written to
+    @param chunks: an iterable of the content of the image (str)
+    @param directory_for: function(size, format), that returns the directory of the final path of the image
+    @return: the OriginalImageUpload 
+    @raise imgengine.ImageStreamNotRecognizedException: if the header of the image cannot be parsed, 
+    or the written image is broken
+    @raise IOError: if the image cannot be read or written
+    """
+    chunks = iter(chunks)
+    content_hash = hashlib.sha1()
+    head = []
+    head_size = 0
+    img = None
+    for chunk in chunks:
+        content_hash.update(chunk)
+        head.append(chunk)
+        head_size += len(chunk)
+        img = _parse_header(''.join(head))
+        if img is not None or head_size >= HEADER_MAX_BYTES:
+            break
+    if img is None:
+        raise imgengine.ImageStreamNotRecognizedException('Image header not found in the first %s bytes' % (head_size,))
+    
+    directory = directory_for(img.size, img.format)
+    _make_directory(directory)
+    fd, temporary_filename = tempfile.mkstemp(prefix='.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for chunk in head:
+                out.write(chunk)
+            for chunk in chunks:
+                content_hash.update(chunk)
+                out.write(chunk)
+        os.chmod(temporary_filename, 0644)
+        _verify(temporary_filename)
+    except:
+        remove_file(temporary_filename)
+        raise
+    return OriginalImageUpload(temporary_filename, img.size, img.format, content_hash.hexdigest())
+
+def file_chunks(file):
+    """ @param file: a filename, or a file-like object, that is read from its start if it can seek 
+    @return: an iterator over the content of file """
+    if type(file) == str:
+        with open(file, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), ''):
+                yield chunk
+    else:
+        if hasattr(file, 'seek'):
+            file.seek(0)
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), ''):
+            yield chunk
+
+def _parse_header(head):
+    """ @return: the image, whose pixels are not loaded, or None if head does not contain its whole header """
+    try:
+        return Image.open(StringIO(head))
+    except IOError:
+        return None
+
+def _verify(filename):
+    """ the temporary file is read back from the page cache : PIL only verifies images that it reads from the start 
+    @raise imgengine.ImageStreamNotRecognizedException: if the image is broken (e.g. truncated) """
+    try:
+        Image.open(filename).verify()
+    except (IOError, SyntaxError, IndexError, TypeError, struct.error), ex:
+        raise imgengine.ImageStreamNotRecognizedException(ex)
+
+def _make_directory(directory):
+    try:
+        os.makedirs(directory)
+    except OSError, ex:
+        if ex.errno != errno.EEXIST:
+            raise
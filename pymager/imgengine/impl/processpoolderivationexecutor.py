@@ -0,0 +1,76 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import logging
+import threading
+import multiprocessing
+from zope.interface import implements
+from pymager import imgengine
+from pymager.imgengine.impl import derivation
+
+logger = logging.getLogger("imgengine.processpoolderivationexecutor")
+
+DERIVATION_TIMEOUT_SECONDS = 300
+
+class ProcessPoolDerivationExecutor(object):
+    """ an imgengine.DerivationExecutor that sends the work to a pool of worker processes, 
+    so that CPU-heavy derivations do not compete for the GIL with the request threads.
+    
+    Only file names, sizes and formats are sent to the workers, that return the file names or the encoded images. 
+    The pool must be created before the server starts its threads, as it forks the current process.
+    """
+    implements(imgengine.DerivationExecutor)
+    
+    def __init__(self, processes, max_pending_derivations):
+        """ @param processes: the number of worker processes, None to use one per CPU
+            @param max_pending_derivations: the maximum number of derivations that are either 
+            executing or waiting for a worker. Additional derivations are rejected 
+        """
+        self.__max_pending_derivations = max_pending_derivations
+        self.__pending_derivations = threading.BoundedSemaphore(max_pending_derivations)
+        self.__pool = multiprocessing.Pool(processes)
+        logger.info("Started derivation pool (processes: %s, max pending derivations: %s)" % (processes, max_pending_derivations))
+    
+    def derive(self, source_filename, target_filename, size, target_format):
+        return self.__execute(derivation.derive, (source_filename, target_filename, size, target_format))
+    
+    def derive_mezzanine(self, source_filename, target_filename, size, target_format):
+        return self.__execute(derivation.derive_mezzanine, (source_filename, target_filename, size, target_format))
+    
+    def derive_all(self, source_filename, derivations):
+        return self.__execute(derivation.derive_all, (source_filename, derivations))
+    
+    def encode_all(self, source_filename, derivations):
+        return self.__execute(derivation.encode_all, (source_filename, derivations))
+    
+    def forget(self, source_filename):
+        """ the workers do not keep anything about the source images """
+        pass
+    
+    def __execute(self, f, args):
+        if not self.__pending_derivations.acquire(False):
+            raise imgengine.DerivationQueueFullException(self.__max_pending_derivations)
+        try:
+            result = self.__pool.apply_async(f, args)
+            return result.get(DERIVATION_TIMEOUT_SECONDS)
+        except (IOError, multiprocessing.TimeoutError), ex:
+            raise imgengine.ImageProcessingException(ex)
+        finally:
+            self.__pending_derivations.release()
+    
+    def shutdown(self):
+        self.__pool.terminate()
+        self.__pool.join()
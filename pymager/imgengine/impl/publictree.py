@@ -0,0 +1,85 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import with_statement
+import os
+import errno
+import logging
+import threading
+from pymager import resources
+from pymager.imgengine._deleteimagescommand import remove_file
+
+logger = logging.getLogger("imgengine.publictree")
+
+class PublicTree(object):
+    """ Exposes the derived images under their public URL : /derived/<id>-<width>x<height>.<extension> 
+    is linked as <public_directory>/<shard>/<id>-<width>x<height>.<extension>, where <shard> is the 
+    first 2 characters of the filename, so that the front-end server can send the existing derived images 
+    without calling the image server (see README). 
+    
+    The links are hard links, or symbolic links when the derived image is on another filesystem : 
+    the front-end server must ignore the dangling symbolic links of the derived images that have been moved 
+    (e.g. between tiers), and let the image server publish them again """
+    
+    def __init__(self, public_directory, image_format_mapper):
+        self.__public_directory = public_directory
+        self.__image_format_mapper = resources.ImageFormatMapper(image_format_mapper)
+        self.__lock = threading.Lock()
+        self.__published = 0
+        self.__unpublished = 0
+    
+    def public_path(self, image_id, size, format):
+        filename = '%s-%sx%s.%s' % (image_id, size[0], size[1], self.__image_format_mapper.format_to_extension(format))
+        return os.path.join(self.__public_directory, filename[:2], filename)
+    
+    def __link(self, filename, public_path):
+        try:
+            os.link(filename, public_path)
+        except OSError, ex:
+            if ex.errno != errno.EXDEV:
+                raise
+            os.symlink(os.path.abspath(filename), public_path)
+    
+    def publish(self, image_id, size, format, filename):
+        """ links the derived image file filename to its public path, if it is not linked yet 
+        @return: True if it has been linked """
+        public_path = self.public_path(image_id, size, format)
+        if os.path.exists(public_path):
+            return False
+        try:
+            if not os.path.exists(os.path.dirname(public_path)):
+                os.makedirs(os.path.dirname(public_path))
+            # a dangling symbolic link
+            remove_file(public_path)
+            self.__link(filename, public_path)
+        except OSError, ex:
+            # deleted or published meanwhile
+            if ex.errno not in (errno.ENOENT, errno.EEXIST):
+                raise
+            return False
+        with self.__lock:
+            self.__published += 1
+        return True
+    
+    def unpublish(self, image_id, size, format):
+        remove_file(self.public_path(image_id, size, format))
+        with self.__lock:
+            self.__unpublished += 1
+    
+    def statistics(self):
+        with self.__lock:
+            return {'published_images': self.__published,
+                    'unpublished_images': self.__unpublished}
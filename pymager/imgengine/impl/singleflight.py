@@ -0,0 +1,77 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import with_statement
+import sys
+import threading
+
+class _Call(object):
+    """ A call that is currently being executed by a leader thread """
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+class SingleFlight(object):
+    """ Coalesces concurrent calls that share the same key : the first thread 
+    (the leader) executes the call, while the other threads (the followers) 
+    block until the leader is done, and then share its result (or its exception).
+    
+    Nothing is cached : once the leader is done, the next call for the same key 
+    will be executed again
+    """
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__calls = {}
+    
+    def do(self, key, f):
+        """ Executes f() unless another thread is already executing a call for the given key, 
+        in which case it waits for that call to complete, and returns its result
+        @raise: the exception raised by f(), in the leader as well as in the followers """
+        with self.__lock:
+            call = self.__calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self.__calls[key] = call
+        
+        if leader:
+            return self.__lead(key, call, f)
+        else:
+            return self.__follow(call)
+    
+    def pending_calls(self):
+        """ @return: the number of keys that are currently being executed """
+        with self.__lock:
+            return len(self.__calls)
+    
+    def __lead(self, key, call, f):
+        try:
+            call.result = f()
+            return call.result
+        except:
+            call.exc_info = sys.exc_info()
+            raise
+        finally:
+            with self.__lock:
+                del self.__calls[key]
+            call.done.set()
+    
+    def __follow(self, call):
+        call.done.wait()
+        if call.exc_info is not None:
+            raise call.exc_info[0], call.exc_info[1], call.exc_info[2]
+        return call.result
@@ -17,6 +17,7 @@
 
 from pymager.persistence._schemamigrator import SchemaMigrator
 from pymager.persistence._transactional import SessionTemplate
+from pymager.persistence._transactional import OutsideSessionException
 from pymager.persistence._transactional import transactional
 from pymager.persistence._transactional import begin_scope
 from pymager.persistence._transactional import end_scope
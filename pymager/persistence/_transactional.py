@@ -49,8 +49,8 @@ class SessionTemplate(object):
         self._sessionmaker = sessionmaker
         
     def do_with_session(self, session_callback):        
+        session = begin_scope(self._sessionmaker)
         try:
-            session = begin_scope(self._sessionmaker)
             result = session_callback(session)
         except Exception as e1:
             _mark_for_rollback(self._sessionmaker)
@@ -58,6 +58,29 @@ class SessionTemplate(object):
         finally:
             end_scope(self._sessionmaker)
         return result
+    
+    def do_outside_session(self, callback):
+        """ Executes callback(), that does not use the database (e.g. long running work between two short 
+        do_with_session() calls), with no session bound to the thread : the sessions that callback() 
+        tries to begin raise an OutsideSessionException. When no do_with_session() call is pending, no session 
+        nor connection is held while callback() runs. Otherwise, the enclosing session is unbound until callback() 
+        returns, but keeps its connection until it ends """
+        bound_session = _threadlocal.current_session if _session_exists() else None
+        if bound_session is not None:
+            logger.debug("Work executed outside of the session, while an enclosing session is still open")
+            del _threadlocal.current_session
+        nested = _outside_session()
+        _threadlocal.outside_session = True
+        try:
+            return callback()
+        finally:
+            if not nested:
+                del _threadlocal.outside_session
+            if bound_session is not None:
+                _threadlocal.current_session = bound_session
+
+class OutsideSessionException(Exception):
+    """ raised when a session is begun by work executed with SessionTemplate.do_outside_session() """
 
 class BoundSession(object):
     def __init__(self, session, count=0):
@@ -80,6 +103,8 @@ class BoundSession(object):
         self.should_renew = True
 
 def begin_scope(session_maker):
+    if _outside_session():
+        raise OutsideSessionException()
     bound_session = _threadlocal.current_session if _session_exists() else BoundSession(session_maker())
     bound_session.increment()
     _threadlocal.current_session = bound_session
@@ -145,5 +170,8 @@ def _should_commit():
 def _session_exists():
     return hasattr(_threadlocal, 'current_session')
 
+def _outside_session():
+    return hasattr(_threadlocal, 'outside_session')
+
 def _mark_for_rollback(session_maker):
     _threadlocal.current_session.mark_for_rollback()
@@ -18,7 +18,7 @@
 from zope.interface import Interface, implements
 import sqlalchemy
 from sqlalchemy import create_engine, Table, Column, Integer, String, MetaData, ForeignKey, DateTime #, UniqueConstraint
-from sqlalchemy.orm import mapper, relation, sessionmaker, scoped_session, backref #, eagerload
+from sqlalchemy.orm import mapper, relation, sessionmaker, scoped_session, backref, class_mapper #, eagerload
 from sqlalchemy.orm import exc
 import logging
 import threading
@@ -39,6 +39,11 @@ class SqlAlchemyImageMetadataRepository(object):
                 .filter(domain.OriginalImageMetadata._id == image_id)\
                 .first()
         return self.__template.do_with_session(callback)
+    
+    def find_original_image_metadata_ids(self):
+        def callback(session):
+            return [row[0] for row in session.query(domain.OriginalImageMetadata._id)]
+        return self.__template.do_with_session(callback)
 
     def find_inconsistent_original_image_metadatas(self, maxResults=100):
         def callback(session):
@@ -54,6 +59,43 @@ class SqlAlchemyImageMetadataRepository(object):
                 .limit(maxResults).all()
         return self.__template.do_with_session(callback)
     
+    def find_derived_image_metadata_ids_by_status(self, status):
+        def callback(session):
+            return [row[0] for row in session.query(domain.DerivedImageMetadata._id)\
+                        .filter(domain.AbstractImageMetadata._status == status)\
+                        .yield_per(1000)]
+        return self.__template.do_with_session(callback)
+    
+    def find_least_recently_accessed_derived_image_metadatas(self, maxResults=100):
+        def callback(session):
+            return session.query(domain.DerivedImageMetadata)\
+                .filter(domain.AbstractImageMetadata._status == domain.STATUS_OK)\
+                .order_by(sqlalchemy.func.coalesce(domain.DerivedImageMetadata._last_access_date, domain.AbstractImageMetadata._last_status_change_date))\
+                .limit(maxResults).all()
+        return self.__template.do_with_session(callback)
+    
+    def find_unmeasured_derived_image_metadatas(self, maxResults=100):
+        def callback(session):
+            return session.query(domain.DerivedImageMetadata)\
+                .filter(domain.AbstractImageMetadata._status == domain.STATUS_OK)\
+                .filter(domain.DerivedImageMetadata._file_size == None)\
+                .limit(maxResults).all()
+        return self.__template.do_with_session(callback)
+    
+    def sum_derived_image_metadata_file_sizes(self):
+        def callback(session):
+            return session.query(sqlalchemy.func.sum(domain.DerivedImageMetadata._file_size)).scalar() or 0
+        return self.__template.do_with_session(callback)
+    
+    def update_derived_image_metadata_last_access_dates(self, derived_image_ids, last_access_date):
+        def callback(session):
+            derived_image_metadata = class_mapper(domain.DerivedImageMetadata).local_table
+            session.execute(derived_image_metadata.update()\
+                            .where(derived_image_metadata.c.id.in_(derived_image_ids))\
+                            .values(last_access_date=last_access_date))
+        if derived_image_ids:
+            self.__template.do_with_session(callback)
+    
     def find_derived_image_metadata_by_original_image_metadata_id_size_and_format(self, image_id, size, format):
         def callback(session):
             o = session.query(domain.DerivedImageMetadata)\
@@ -42,12 +42,23 @@ class SqlAlchemySchemaMigrator(object):
         )
         
         original_image_metadata = Table('original_image_metadata', self.__metadata,
-            Column('id', String(255), ForeignKey('abstract_item.id'), primary_key=True)
+            Column('id', String(255), ForeignKey('abstract_item.id'), primary_key=True),
+            Column('content_hash', String(40), index=True, nullable=True)
         )
         
         derived_image_metadata = Table('derived_image_metadata', self.__metadata,
             Column('id', String(255), ForeignKey('abstract_item.id'), primary_key=True),
-            Column('original_image_metadata_id', String(255), ForeignKey('original_image_metadata.id', ondelete="CASCADE"))
+            Column('original_image_metadata_id', String(255), ForeignKey('original_image_metadata.id', ondelete="CASCADE")),
+            # used by the garbage collection of the derived images
+            Column('last_access_date', DateTime, index=True, nullable=True),
+            Column('file_size', Integer, nullable=True)
+        )
+        
+        # used by imgengine.impl.databaseleaselockmanager
+        item_lease = Table('item_lease', self.__metadata,
+            Column('id', String(255), primary_key=True),
+            Column('owner', String(255), nullable=False),
+            Column('last_heartbeat_date', DateTime, index=True, nullable=False)
         )
 
         mapper(domain.AbstractImageMetadata, abstract_item, \
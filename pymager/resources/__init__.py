@@ -17,3 +17,5 @@
 from pymager.resources._imageformatmapper import ImageFormatMapper
 from pymager.resources._path import Path
 from pymager.resources._pathgenerator import PathGenerator
+from pymager.resources._imagestore import ImageStore
+from pymager.resources._storedimage import StoredImage
@@ -0,0 +1,41 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from zope.interface import Interface, implements
+
+class ImageStore(Interface):
+    """ Stores small images by key, outside of the files of a PathGenerator, 
+    e.g. to save the inodes and directory entries of millions of thumbnails """
+    
+    def put(self, key, data, modification_time):
+        """ stores data for key, replacing the previous data, if any 
+        @param modification_time: the modification time that is served with data, in seconds since the epoch """
+    
+    def get(self, key):
+        """ @return: the resources.StoredImage stored for key, or None if there is none """
+    
+    def contains(self, key):
+        """ @return: True if data is stored for key """
+    
+    def delete(self, key):
+        """ removes the data stored for key, if any """
+    
+    def compact(self):
+        """ reclaims the space used by the deleted and replaced data 
+        @return: the number of reclaimed bytes """
+    
+    def statistics(self):
+        """ @return: a dictionary describing the content of the store """
@@ -30,6 +30,9 @@ class Path(object):
     def relative(self):
         return os.path.join(*self.__path_elements)
 
+    def prepend(self, path_element):
+        return Path(self.__reference_directory, [path_element] + self.__path_elements)
+
     def append(self, path_element):
         return Path(self.__reference_directory, self.__path_elements + [path_element])
     
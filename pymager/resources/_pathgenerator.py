@@ -22,3 +22,13 @@ class PathGenerator(Interface):
     
     def derived_path(self, derived_image_metadata):
         """ returns a Path object for the given derived item"""
+    
+    def derived_paths(self, derived_image_metadata):
+        """ returns the Path objects of all the places where the given derived item may be stored, 
+        (several when the derived items are moved between tiers or disks), including derived_path()"""
+    
+    def mezzanine_path(self, original_image_metadata):
+        """ returns a Path object for the reduced resolution copy of the given original item"""
+    
+    def placeholder_path(self, size, format):
+        """ returns a Path object for the placeholder image of the given size and format"""
@@ -0,0 +1,25 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+class StoredImage(object):
+    """ An image read from an ImageStore. Its body is a read-only buffer, that may share 
+    the memory of the store : it must not be kept once the image has been served """
+    def __init__(self, body, modification_time):
+        self.body = body
+        self.modification_time = modification_time
+    
+    def __len__(self):
+        return len(self.body)
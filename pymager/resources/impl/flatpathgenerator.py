@@ -21,6 +21,7 @@ from pymager import resources
 
 CACHE_DIRECTORY = "cache"
 ORIGINAL_DIRECTORY = "pictures"
+PLACEHOLDER_DIRECTORY = "placeholders"
 
 class FlatPathGenerator(object):
     implements(resources.PathGenerator)
@@ -34,8 +35,17 @@ class FlatPathGenerator(object):
     def original_path(self, original_image_metadata):
         return resources.Path(self.__data_directory).append(ORIGINAL_DIRECTORY).append('%s.%s' % (self._hash(original_image_metadata.id), self.__extension_for_format(original_image_metadata.format)))
     
+    def mezzanine_path(self, original_image_metadata):
+        return resources.Path(self.__data_directory).append(ORIGINAL_DIRECTORY).append('%s-mezzanine.%s' % (self._hash(original_image_metadata.id), self.__extension_for_format(original_image_metadata.format)))
+    
+    def placeholder_path(self, size, format):
+        return resources.Path(self.__data_directory).append(PLACEHOLDER_DIRECTORY).append('%sx%s.%s' % (size[0], size[1], self.__extension_for_format(format)))
+    
     def derived_path(self, derived_image_metadata):
         return resources.Path(self.__data_directory).append(CACHE_DIRECTORY).append('%s-%sx%s.%s' % (self._hash(derived_image_metadata.original_image_metadata.id), derived_image_metadata.size[0], derived_image_metadata.size[1], self.__extension_for_format(derived_image_metadata.format)))
+    
+    def derived_paths(self, derived_image_metadata):
+        return [self.derived_path(derived_image_metadata)]
    
     def _hash(self, image_id):
         h = hashlib.sha1()
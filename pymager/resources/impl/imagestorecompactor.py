@@ -0,0 +1,72 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import with_statement
+import threading
+import logging
+from pymager import resources
+
+logger = logging.getLogger("resources.imagestorecompactor")
+
+class ImageStoreCompactor(object):
+    """ A background thread that periodically reclaims the space of the images deleted from a resources.ImageStore """
+    
+    def __init__(self, image_store, interval_seconds):
+        self.__image_store = resources.ImageStore(image_store)
+        self.__interval_seconds = interval_seconds
+        self.__lock = threading.Lock()
+        self.__runs = 0
+        self.__failed = 0
+        self.__reclaimed = 0
+        self.__stopped = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, name="image-store-compactor")
+        self.__thread.setDaemon(True)
+        self.__thread.start()
+    
+    def __run(self):
+        while True:
+            self.__stopped.wait(self.__interval_seconds)
+            if self.__stopped.isSet():
+                return
+            self.compact()
+    
+    def compact(self):
+        """ @return: the number of reclaimed bytes """
+        try:
+            reclaimed = self.__image_store.compact()
+        except Exception:
+            logger.exception("Image store compaction failed")
+            with self.__lock:
+                self.__runs += 1
+                self.__failed += 1
+            return 0
+        with self.__lock:
+            self.__runs += 1
+            self.__reclaimed += reclaimed
+        return reclaimed
+    
+    def statistics(self):
+        with self.__lock:
+            statistics = {'compactions': self.__runs,
+                          'failed_compactions': self.__failed,
+                          'reclaimed_bytes': self.__reclaimed}
+        statistics.update(self.__image_store.statistics())
+        return statistics
+    
+    def shutdown(self):
+        """ Stops the background thread, after the compaction in progress """
+        self.__stopped.set()
+        self.__thread.join()
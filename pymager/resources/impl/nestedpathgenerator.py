@@ -20,6 +20,7 @@ from pymager import resources
 
 _CACHE_DIRECTORY = "cache"
 _ORIGINAL_DIRECTORY = "pictures"
+_PLACEHOLDER_DIRECTORY = "placeholders"
 
 class NestedPathGenerator(object):
     """ a resources.PathGenerator implementation that uses nested directories to reduce the number of files in the same directory """
@@ -41,6 +42,26 @@ class NestedPathGenerator(object):
             .append('%s.%s' % (self._hash(original_image_metadata.id),
                                self.__extension_for_format(original_image_metadata.format)))
     
+    def mezzanine_path(self, original_image_metadata):
+        """ 
+            stored next to the original image
+            @returns /original/72/bc/45/..../2d/72bc4503be82feec7382057970e78092fb12ddd2-mezzanine.jpg """
+        return self.original_path(original_image_metadata) \
+            .parent_directory() \
+            .append(self._mezzanine_filename(original_image_metadata))
+    
+    def _mezzanine_filename(self, original_image_metadata):
+        return '%s-mezzanine.%s' % (self._hash(original_image_metadata.id),
+                                    self.__extension_for_format(original_image_metadata.format))
+    
+    def placeholder_path(self, size, format):
+        """ 
+            placeholders are shared by all the images, so there are only a few of them
+            @returns /placeholders/100x100.jpg """
+        return resources.Path(self.__data_directory) \
+            .append(_PLACEHOLDER_DIRECTORY) \
+            .append('%sx%s.%s' % (size[0], size[1], self.__extension_for_format(format)))
+    
     def derived_path(self, derived_image_metadata):
         """ 
             The hash is computed on the complete derived filename
@@ -50,6 +71,9 @@ class NestedPathGenerator(object):
             .appendall(self._split(self._hash(self._derived_image_filename_without_extension(derived_image_metadata)))) \
             .append(self._derived_image_filename(derived_image_metadata))
     
+    def derived_paths(self, derived_image_metadata):
+        return [self.derived_path(derived_image_metadata)]
+    
     def _derived_image_filename(self, derived_image_metadata):
         """ computes a hash on top of the full derived filename, and still add the size and extension to the final name"""
         return '%s-%sx%s.%s' % (self._hash(self._derived_image_filename_without_extension(derived_image_metadata)),
@@ -0,0 +1,229 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import with_statement
+import os
+import re
+import mmap
+import fcntl
+import errno
+import urllib
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from zope.interface import implements
+from pymager import resources
+
+logger = logging.getLogger("resources.packfileimagestore")
+
+JOURNAL_FILENAME = "index"
+LOCK_FILENAME = "lock"
+SEGMENT_FILENAME = "segment-%08d.pack"
+_SEGMENT_PATTERN = re.compile(r'^segment-(\d{8})\.pack$')
+
+class PackfileImageStore(object):
+    """ a resources.ImageStore that appends the images to large segment files, 
+    and reads them as slices of the memory mapped segments, without copying them.
+    
+    The index (key -> segment, offset, length, modification time) is kept in memory, and persisted 
+    in an append-only journal, that every process of the server replays before reading the index : 
+    the store can be shared by several processes. The writers serialize themselves with flock().
+    
+    Deleted and replaced images leave garbage in their segment, that is reclaimed by compact() : 
+    the live images of the segments that contain too much garbage are copied to the last segment, 
+    the journal is rewritten, and the old segments are deleted """
+    implements(resources.ImageStore)
+    
+    def __init__(self, directory, max_segment_bytes, compaction_ratio=0.5):
+        """ @param max_segment_bytes: images are appended to a new segment once the last one reaches this size 
+            @param compaction_ratio: the segments whose garbage exceeds this ratio of their size are compacted """
+        self.__directory = directory
+        self.__max_segment_bytes = max_segment_bytes
+        self.__compaction_ratio = compaction_ratio
+        self.__lock = threading.RLock()
+        self.__index = {}
+        self.__journal_inode = None
+        self.__journal_offset = 0
+        self.__mmaps = {}
+    
+    def __path(self, filename):
+        return os.path.join(self.__directory, filename)
+    
+    @contextmanager
+    def __exclusive(self):
+        """ excludes the other writers, of this process and of the other processes """
+        with self.__lock:
+            if not os.path.exists(self.__directory):
+                os.makedirs(self.__directory)
+            with open(self.__path(LOCK_FILENAME), 'a') as lock_file:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                try:
+                    self.__refresh()
+                    yield
+                finally:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+    
+    def __refresh(self):
+        """ replays the journal entries written since the last refresh, or the whole journal if it has been rewritten. 
+        The journal is only read when its inode or its size changed """
+        try:
+            stat = os.stat(self.__path(JOURNAL_FILENAME))
+            if stat.st_ino == self.__journal_inode and stat.st_size == self.__journal_offset:
+                return
+            with open(self.__path(JOURNAL_FILENAME), 'rb') as journal:
+                stat = os.fstat(journal.fileno())
+                inode = stat.st_ino
+                if inode != self.__journal_inode or stat.st_size < self.__journal_offset:
+                    # the segments may have been compacted, or the whole store dropped
+                    self.__index = {}
+                    self.__mmaps = {}
+                    self.__journal_inode = inode
+                    self.__journal_offset = 0
+                journal.seek(self.__journal_offset)
+                for line in journal:
+                    # an entry that is being written
+                    if not line.endswith('\n'):
+                        break
+                    self.__replay(line)
+                    self.__journal_offset += len(line)
+        except (IOError, OSError), ex:
+            if ex.errno != errno.ENOENT:
+                raise
+            self.__index = {}
+            self.__journal_inode = None
+            self.__journal_offset = 0
+    
+    def __replay(self, line):
+        fields = line.rstrip('\n').split(' ')
+        key = urllib.unquote(fields[1])
+        if fields[0] == 'P':
+            self.__index[key] = (int(fields[2]), int(fields[3]), int(fields[4]), float(fields[5]))
+        elif fields[0] == 'D':
+            self.__index.pop(key, None)
+    
+    def __append_to_journal(self, lines):
+        with open(self.__path(JOURNAL_FILENAME), 'ab') as journal:
+            journal.write(''.join(lines))
+        self.__refresh()
+    
+    def __put_line(self, key, segment, offset, length, modification_time):
+        return 'P %s %d %d %d %r\n' % (urllib.quote(key, safe=''), segment, offset, length, float(modification_time))
+    
+    def __segments(self):
+        if not os.path.exists(self.__directory):
+            return []
+        return sorted([int(m.group(1)) for m in [_SEGMENT_PATTERN.match(f) for f in os.listdir(self.__directory)] if m is not None])
+    
+    def __append(self, data):
+        """ @return: the segment and offset where data has been appended """
+        segments = self.__segments()
+        segment = segments[-1] if segments else 0
+        if segments and os.path.getsize(self.__path(SEGMENT_FILENAME % segment)) + len(data) > self.__max_segment_bytes:
+            segment += 1
+        with open(self.__path(SEGMENT_FILENAME % segment), 'ab') as f:
+            f.seek(0, os.SEEK_END)
+            offset = f.tell()
+            f.write(data)
+            f.flush()
+            # the journal must never reference data that could be lost
+            os.fsync(f.fileno())
+        return segment, offset
+    
+    def put(self, key, data, modification_time):
+        with self.__exclusive():
+            segment, offset = self.__append(data)
+            self.__append_to_journal([self.__put_line(key, segment, offset, len(data), modification_time)])
+    
+    def __mmap(self, segment, end):
+        """ the last segment grows : it is mapped again when the requested data is beyond the mapped region. 
+        The previous mappings stay valid until the buffers that use them are released """
+        mapped = self.__mmaps.get(segment)
+        if mapped is None or len(mapped) < end:
+            with open(self.__path(SEGMENT_FILENAME % segment), 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.__mmaps[segment] = mapped
+        return mapped
+    
+    def get(self, key):
+        with self.__lock:
+            self.__refresh()
+            entry = self.__index.get(key)
+            if entry is None:
+                return None
+            segment, offset, length, modification_time = entry
+            try:
+                mapped = self.__mmap(segment, offset + length)
+            except (IOError, OSError, ValueError), ex:
+                # compacted by another process, that has not rewritten the journal yet
+                logger.warning("Impossible to read %s from segment %s: %s" % (key, segment, ex))
+                return None
+            return resources.StoredImage(buffer(mapped, offset, length), modification_time)
+    
+    def contains(self, key):
+        with self.__lock:
+            self.__refresh()
+            return key in self.__index
+    
+    def delete(self, key):
+        with self.__exclusive():
+            if key in self.__index:
+                self.__append_to_journal(['D %s\n' % (urllib.quote(key, safe=''),)])
+    
+    def __live_bytes(self):
+        live_bytes = {}
+        for segment, offset, length, modification_time in self.__index.itervalues():
+            live_bytes[segment] = live_bytes.get(segment, 0) + length
+        return live_bytes
+    
+    def compact(self):
+        with self.__exclusive():
+            segments = self.__segments()
+            live_bytes = self.__live_bytes()
+            sizes = dict([(segment, os.path.getsize(self.__path(SEGMENT_FILENAME % segment))) for segment in segments])
+            # the last segment is still being appended to
+            compacted = [segment for segment in segments[:-1]
+                         if sizes[segment] - live_bytes.get(segment, 0) > self.__compaction_ratio * sizes[segment]]
+            if not compacted:
+                return 0
+            
+            index = dict(self.__index)
+            for key, (segment, offset, length, modification_time) in self.__index.iteritems():
+                if segment in compacted:
+                    data = self.__mmap(segment, offset + length)[offset:offset + length]
+                    new_segment, new_offset = self.__append(data)
+                    index[key] = (new_segment, new_offset, length, modification_time)
+            
+            fd, temporary_filename = tempfile.mkstemp(prefix='.', suffix='.tmp', dir=self.__directory)
+            with os.fdopen(fd, 'wb') as journal:
+                journal.write(''.join([self.__put_line(key, *entry) for (key, entry) in index.iteritems()]))
+            os.rename(temporary_filename, self.__path(JOURNAL_FILENAME))
+            self.__refresh()
+            for segment in compacted:
+                self.__mmaps.pop(segment, None)
+                os.remove(self.__path(SEGMENT_FILENAME % segment))
+            reclaimed = sum([sizes[segment] - live_bytes.get(segment, 0) for segment in compacted])
+            logger.info("Compacted %s segments, reclaimed %s bytes" % (len(compacted), reclaimed))
+            return reclaimed
+    
+    def statistics(self):
+        with self.__lock:
+            self.__refresh()
+            segments = self.__segments()
+            return {'images': len(self.__index),
+                    'segments': len(segments),
+                    'bytes': sum([os.path.getsize(self.__path(SEGMENT_FILENAME % segment)) for segment in segments]),
+                    'live_bytes': sum(self.__live_bytes().values())}
@@ -0,0 +1,87 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import os
+import hashlib
+from zope.interface import implements
+from pymager import resources
+from pymager.resources.impl.nestedpathgenerator import NestedPathGenerator
+
+DISKS_DIRECTORY = "disks"
+
+class StripedPathGenerator(NestedPathGenerator):
+    """ a NestedPathGenerator that spreads the original and derived images across several data directories 
+    (e.g. one per disk), that are linked into the data directory as DISKS_DIRECTORY/0, DISKS_DIRECTORY/1, ... 
+    The paths stay relative to the data directory. 
+    
+    Each image is assigned to a disk by rendezvous hashing of the SHA-1 hash its filename starts with : 
+    when a disk is added, only the images assigned to the new disk have to move (see DiskRebalancer). 
+    Until they are moved, the images are looked up in the other disks too """
+    implements(resources.PathGenerator)
+    
+    def __init__(self, image_format_mapper, data_directory, disk_count):
+        super(StripedPathGenerator, self).__init__(image_format_mapper, data_directory)
+        self.__disk_count = disk_count
+    
+    def disk(self, image_hash):
+        """ @return: the index of the disk that the image whose filename starts with image_hash is assigned to """
+        return max(range(self.__disk_count), key=lambda disk: hashlib.sha1('%s-%s' % (image_hash, disk)).hexdigest())
+    
+    def __disk_path(self, path, disk):
+        return path.prepend(str(disk)).prepend(DISKS_DIRECTORY)
+    
+    def __disk_paths(self, path, image_hash):
+        """ @return: the path in every disk, starting with the disk the image is assigned to """
+        assigned_disk = self.disk(image_hash)
+        return [self.__disk_path(path, assigned_disk)] + [self.__disk_path(path, disk) for disk in range(self.__disk_count) if disk != assigned_disk]
+    
+    def __existing_or_assigned(self, paths):
+        for path in paths:
+            if os.path.exists(path.absolute()):
+                return path
+        return paths[0]
+    
+    def original_path(self, original_image_metadata):
+        return self.__existing_or_assigned(self.__disk_paths(super(StripedPathGenerator, self).original_path(original_image_metadata), 
+                                                             self._hash(original_image_metadata.id)))
+    
+    def mezzanine_path(self, original_image_metadata):
+        """ the mezzanine is looked up on its own : it may not have been moved with its original image yet """
+        return self.__existing_or_assigned(self.__disk_paths(super(StripedPathGenerator, self).original_path(original_image_metadata) \
+                                                                .parent_directory() \
+                                                                .append(self._mezzanine_filename(original_image_metadata)), 
+                                                             self._hash(original_image_metadata.id)))
+    
+    def derived_path(self, derived_image_metadata):
+        return self.__existing_or_assigned(self.derived_paths(derived_image_metadata))
+    
+    def derived_paths(self, derived_image_metadata):
+        return self.__disk_paths(super(StripedPathGenerator, self).derived_path(derived_image_metadata), 
+                                 self._hash(self._derived_image_filename_without_extension(derived_image_metadata)))
+
+def link_disks(data_directory, data_directories):
+    """ links every directory of data_directories into data_directory, as DISKS_DIRECTORY/<index> """
+    disks_directory = os.path.join(data_directory, DISKS_DIRECTORY)
+    if not os.path.exists(disks_directory):
+        os.makedirs(disks_directory)
+    for disk, directory in enumerate(data_directories):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        link = os.path.join(disks_directory, str(disk))
+        if os.path.realpath(link) != os.path.realpath(directory):
+            if os.path.islink(link):
+                os.remove(link)
+            os.symlink(directory, link)
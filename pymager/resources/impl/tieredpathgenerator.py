@@ -0,0 +1,59 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import os
+from zope.interface import implements
+from pymager import resources
+
+HOT_DIRECTORY = "hot"
+
+class TieredPathGenerator(object):
+    """ a resources.PathGenerator that stores the derived images in two tiers, that have the same layout : 
+    a small and fast hot tier, that is linked into the data directory as HOT_DIRECTORY, 
+    in front of the main data directory. The derived images are looked up in the hot tier first, 
+    and new derived images are created in the hot tier. The paths stay relative to the data directory """
+    implements(resources.PathGenerator)
+    
+    def __init__(self, path_generator):
+        self.__path_generator = resources.PathGenerator(path_generator)
+    
+    def original_path(self, original_image_metadata):
+        return self.__path_generator.original_path(original_image_metadata)
+    
+    def mezzanine_path(self, original_image_metadata):
+        return self.__path_generator.mezzanine_path(original_image_metadata)
+    
+    def placeholder_path(self, size, format):
+        return self.__path_generator.placeholder_path(size, format)
+    
+    def hot_derived_path(self, derived_image_metadata):
+        return self.__path_generator.derived_path(derived_image_metadata).prepend(HOT_DIRECTORY)
+    
+    def main_derived_path(self, derived_image_metadata):
+        return self.__path_generator.derived_path(derived_image_metadata)
+    
+    def derived_path(self, derived_image_metadata):
+        hot_derived_path = self.hot_derived_path(derived_image_metadata)
+        if os.path.exists(hot_derived_path.absolute()):
+            return hot_derived_path
+        main_derived_path = self.main_derived_path(derived_image_metadata)
+        if os.path.exists(main_derived_path.absolute()):
+            return main_derived_path
+        return hot_derived_path
+    
+    def derived_paths(self, derived_image_metadata):
+        main_derived_paths = self.__path_generator.derived_paths(derived_image_metadata)
+        return [path.prepend(HOT_DIRECTORY) for path in main_derived_paths] + main_derived_paths
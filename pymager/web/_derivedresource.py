@@ -14,29 +14,145 @@
    limitations under the License.
 """
 
+from __future__ import with_statement
 import os
+import time
+import mimetypes
 import cherrypy
 import logging
+from cherrypy.lib import cptools, httputil
 from pymager import domain
 from pymager import imgengine 
 from pymager import web
+from pymager import bootstrap
+from pymager import caching
+from pymager import resources
 from pymager.web._derivedimagemetadataurldecoder import DerivedImageMetadataUrlDecoder
 from pymager.web._derivedimagemetadataurldecoder import UrlDecodingError
+from pymager.web._sendfile import serve_data_file
 
-from cherrypy.lib.static import serve_file
 logger = logging.getLogger("web.derivedresource")
+
+RETRY_AFTER_SECONDS = 1
+
 class DerivedResource(object):
     exposed = True
 
-    def __init__(self, config, image_processor, image_format_mapper):
+    def __init__(self, config, image_processor, image_format_mapper, derivation_queue=None, derived_image_cache=None, packed_image_store=None, etag_cache=None):
+        """ @param derivation_queue: the DerivationQueue that prepares the derived images 
+        when config.async_derivation_mode is set 
+        @param derived_image_cache: the caching.Cache that keeps the most requested derived images in memory, 
+        keyed by derived image id 
+        @param packed_image_store: the resources.ImageStore that the small derived images are served from, 
+        keyed by derived image id 
+        @param etag_cache: the caching.Cache of the entity tags of the served derived images, keyed by derived image id, 
+        that answers the conditional requests without calling the image processor """
         super(DerivedResource, self).__init__()
         self.__config = config
         self.__image_processor = image_processor
         self._image_format_mapper = image_format_mapper
+        self.__derivation_queue = derivation_queue
+        self.__derived_image_cache = caching.Cache(derived_image_cache) if derived_image_cache is not None else None
+        self.__packed_image_store = resources.ImageStore(packed_image_store) if packed_image_store is not None else None
+        self.__etag_cache = caching.Cache(etag_cache) if etag_cache is not None else None
     
     def __not_found(self):
         return cherrypy.NotFound(cherrypy.request.path_info)
     
+    def __service_unavailable(self):
+        cherrypy.response.headers['Retry-After'] = str(RETRY_AFTER_SECONDS)
+        return cherrypy.HTTPError(status=503, message="Too many images are being processed, please retry later")
+    
+    def __is_async(self):
+        return self.__derivation_queue is not None and self.__config.async_derivation_mode != bootstrap.ASYNC_DERIVATION_OFF
+    
+    def __prepare_transformation_async(self, derived_urisegment, request):
+        """ @return: the relative path of the derived image, or None if it is queued for creation """
+        relative_path = self.__image_processor.find_transformation(request)
+        if relative_path is None and not self.__derivation_queue.submit(derived_urisegment, lambda: self.__image_processor.prepare_transformation(request)):
+            raise self.__service_unavailable()
+        return relative_path
+    
+    def __serve_derived_image(self, request, relative_path, encoded_image=None, cached_file=None):
+        """ @param encoded_image: the resources.StoredImage of the derived image, if it has just been encoded 
+        @param cached_file: the caching.CachedFile of the derived image, if it is in memory : it is served 
+        without looking at the file, that may have been deleted by another process since it was cached """
+        path = os.path.join(self.__config.data_directory, relative_path)
+        if encoded_image is not None:
+            # sent from memory, the file that has been written at the same time is not read back
+            content_type = mimetypes.types_map.get(os.path.splitext(path)[1].lower())
+            if self.__derived_image_cache is not None:
+                self.__derived_image_cache.put(request.derived_image_id, caching.CachedFile(encoded_image.body, encoded_image.modification_time, content_type))
+            return self.__serve_body(encoded_image.body, encoded_image.modification_time, content_type)
+        if cached_file is not None:
+            return self.__serve_body(cached_file.body, cached_file.modification_time, cached_file.content_type)
+        packed_image = self.__packed_image_store.get(request.derived_image_id) if self.__packed_image_store is not None else None
+        if packed_image is not None:
+            # the body is a slice of the memory mapped segment, that is written to the socket without being copied
+            return self.__serve_body(packed_image.body, packed_image.modification_time, mimetypes.types_map.get(os.path.splitext(path)[1].lower()))
+        if not self.__uses_derived_image_cache():
+            return serve_data_file(self.__config, relative_path)
+        
+        try:
+            with open(path, 'rb') as f:
+                cached_file = caching.CachedFile(f.read(), os.fstat(f.fileno()).st_mtime, mimetypes.types_map.get(os.path.splitext(path)[1].lower()))
+        except IOError:
+            raise self.__not_found()
+        self.__derived_image_cache.put(request.derived_image_id, cached_file)
+        return self.__serve_body(cached_file.body, cached_file.modification_time, cached_file.content_type)
+    
+    def __uses_derived_image_cache(self):
+        """ the front-end server sends the file faster than the in-memory cache """
+        return self.__derived_image_cache is not None and self.__config.sendfile_mode == bootstrap.SENDFILE_OFF
+    
+    def __cached_file(self, request):
+        return self.__derived_image_cache.get(request.derived_image_id) if self.__uses_derived_image_cache() else None
+    
+    def __serve_body(self, body, modification_time, content_type):
+        response = cherrypy.serving.response
+        response.headers['Last-Modified'] = httputil.HTTPDate(modification_time)
+        cptools.validate_since()
+        if content_type is not None:
+            response.headers['Content-Type'] = content_type
+        response.headers['Content-Length'] = len(body)
+        return [body]
+    
+    def __cached_etag(self, request):
+        if self.__etag_cache is None:
+            return None
+        entry = self.__etag_cache.get(request.derived_image_id)
+        return entry[1] if entry is not None and entry[0] > time.time() else None
+    
+    def __etag(self, request, relative_path, stored_image):
+        etag = self.__cached_etag(request)
+        if etag is None:
+            etag = self.__image_processor.get_derived_image_etag(request, relative_path, stored_image)
+            if etag is not None and self.__etag_cache is not None:
+                self.__etag_cache.put(request.derived_image_id, (time.time() + self.__config.etag_cache_ttl_seconds, etag))
+        return etag
+    
+    def __validate_etag(self, etag):
+        """ the derived image of a given etag never changes 
+        @param etag: None if the derived image has no entity tag (e.g. it has been deleted meanwhile), 
+        it is then served without it
+        @raise cherrypy.HTTPRedirect: 304 Not Modified, if the client already has the derived image """
+        if etag is None:
+            return
+        response = cherrypy.serving.response
+        response.headers['ETag'] = etag
+        if self.__config.derived_image_max_age_seconds:
+            response.headers['Cache-Control'] = 'public, max-age=%d, immutable' % (self.__config.derived_image_max_age_seconds,)
+        cptools.validate_etags()
+    
+    def __not_ready(self, request):
+        """ the response must not be cached, so that later requests get the real image """
+        cherrypy.response.headers['Cache-Control'] = 'no-cache'
+        if self.__config.async_derivation_mode == bootstrap.ASYNC_DERIVATION_PLACEHOLDER:
+            return serve_data_file(self.__config, self.__image_processor.prepare_placeholder(request))
+        cherrypy.response.status = 202
+        cherrypy.response.headers['Retry-After'] = str(RETRY_AFTER_SECONDS)
+        return "The requested image is being processed, please retry later"
+    
     #@cherrypy.expose
     #def index(self):
     #    return "Derived Resource!"
@@ -59,11 +175,47 @@ class DerivedResource(object):
                 print e.image_format
                 raise cherrypy.HTTPError(status=400, message="The requested image format is Invalid: %s" % (e.image_format))
             else:
+                cached_etag = self.__cached_etag(request)
+                if cached_etag is not None:
+                    self.__validate_etag(cached_etag)
+                cached_file = self.__cached_file(request)
+                prepared = self.__prepare(derived_urisegment, request, cached_etag, cached_file)
+                if prepared is None:
+                    return self.__not_ready(request)
                 try:
-                    relative_path = self.__image_processor.prepare_transformation(request)
-                except imgengine.ImageMetadataNotFoundException:
-                    raise self.__not_found()
-                except imgengine.SecurityCheckException:
-                    raise cherrypy.HTTPError(status=403, message="The requested image transformation is not allowed (%sx%s)" % (derivedItemUrlDecoder.width, derivedItemUrlDecoder.height))
-                path = os.path.join(self.__config.data_directory, relative_path)
-                return serve_file(path)
+                    return self.__serve_derived_image(request, *prepared)
+                except cherrypy.NotFound:
+                    # the file has been deleted or moved (e.g. by another process) since it was looked up
+                    self.__image_processor.forget_transformation(request)
+                    if self.__etag_cache is not None:
+                        self.__etag_cache.invalidate(request.derived_image_id)
+                    prepared = self.__prepare(derived_urisegment, request, None, None)
+                    if prepared is None:
+                        return self.__not_ready(request)
+                    return self.__serve_derived_image(request, *prepared)
+    
+    def __prepare(self, derived_urisegment, request, cached_etag, cached_file):
+        """ prepares the derived image, and answers the conditional requests
+        @param cached_file: the caching.CachedFile of the derived image, if it is in memory
+        @return: the relative path of the derived image, its resources.StoredImage if it has just been encoded, 
+        and its caching.CachedFile if it is served from memory, or None if it is being prepared in the background """
+        encoded_image = None
+        try:
+            if self.__is_async():
+                relative_path = self.__prepare_transformation_async(derived_urisegment, request)
+                if relative_path is None:
+                    return None
+            else:
+                relative_path, encoded_image = self.__image_processor.prepare_encoded_transformation(request)
+            if encoded_image is not None:
+                cached_file = None
+            etag = cached_etag if cached_etag is not None else self.__etag(request, relative_path, encoded_image if encoded_image is not None else cached_file)
+        except imgengine.ImageMetadataNotFoundException:
+            raise self.__not_found()
+        except imgengine.SecurityCheckException:
+            raise cherrypy.HTTPError(status=403, message="The requested image transformation is not allowed (%sx%s)" % (request.size[0], request.size[1]))
+        except imgengine.DerivationQueueFullException:
+            raise self.__service_unavailable()
+        if cached_etag is None:
+            self.__validate_etag(etag)
+        return relative_path, encoded_image, cached_file
@@ -0,0 +1,112 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import cgi
+
+CHUNK_SIZE = 64 * 1024
+HEADERS_MAX_BYTES = 64 * 1024
+
+class MultipartError(Exception):
+    """ Thrown when a multipart/form-data body is malformed """
+    def __init__(self, message):
+        Exception.__init__(self, message)
+
+class MultipartPart(object):
+    """ The headers of a part of a multipart/form-data body, with lower case names """
+    def __init__(self, headers):
+        self.headers = headers
+        disposition, params = cgi.parse_header(headers.get('content-disposition', ''))
+        self.name = params.get('name')
+        self.filename = params.get('filename')
+
+class MultipartReader(object):
+    """ Parses a multipart/form-data body while it is read, without spooling it : the body of the current 
+    part is returned in chunks, the parts that are not read are skipped. 
+    Only a delimiter length of the body is buffered between two reads """
+    
+    def __init__(self, rfile, boundary):
+        """ @param rfile: the file-like object the body is read from, until its end
+            @param boundary: the boundary parameter of the Content-Type header """
+        self.__rfile = rfile
+        self.__delimiter = '\r\n--' + boundary
+        # the first delimiter does not follow a line break
+        self.__buffer = '\r\n'
+        self.__eof = False
+    
+    def __fill(self):
+        """ @return: False if the end of the body has been reached """
+        if self.__eof:
+            return False
+        data = self.__rfile.read(CHUNK_SIZE)
+        if not data:
+            self.__eof = True
+            return False
+        self.__buffer += data
+        return True
+    
+    def __fill_at_least(self, size):
+        while len(self.__buffer) < size:
+            if not self.__fill():
+                raise MultipartError('Unexpected end of the multipart body')
+    
+    def next_part(self):
+        """ skips the rest of the current part, if any 
+        @return: the next MultipartPart, or None after the last part """
+        while True:
+            index = self.__buffer.find(self.__delimiter)
+            if index >= 0:
+                self.__buffer = self.__buffer[index + len(self.__delimiter):]
+                break
+            self.__buffer = self.__buffer[-(len(self.__delimiter) - 1):]
+            if not self.__fill():
+                return None
+        self.__fill_at_least(2)
+        if self.__buffer.startswith('--'):
+            return None
+        while True:
+            index = self.__buffer.find('\r\n\r\n')
+            if index >= 0:
+                break
+            if len(self.__buffer) > HEADERS_MAX_BYTES:
+                raise MultipartError('The headers of a multipart part are too long')
+            self.__fill_at_least(len(self.__buffer) + 1)
+        headers = {}
+        # the delimiter line ends with (possibly padded) CRLF
+        for line in self.__buffer[:index].split('\r\n')[1:]:
+            if ':' not in line:
+                raise MultipartError('Malformed multipart header: %s' % (line,))
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+        self.__buffer = self.__buffer[index + 4:]
+        return MultipartPart(headers)
+    
+    def read_part(self):
+        """ @return: an iterator over the body of the current part, that must be consumed before the next part is read
+        @raise MultipartError: while it is iterated, if the body ends before the part """
+        while True:
+            index = self.__buffer.find(self.__delimiter)
+            if index >= 0:
+                if index > 0:
+                    yield self.__buffer[:index]
+                self.__buffer = self.__buffer[index:]
+                return
+            # the end of the buffer may be the beginning of the delimiter
+            safe_size = len(self.__buffer) - (len(self.__delimiter) - 1)
+            if safe_size > 0:
+                yield self.__buffer[:safe_size]
+                self.__buffer = self.__buffer[safe_size:]
+            if not self.__fill():
+                raise MultipartError('Unexpected end of the multipart body')
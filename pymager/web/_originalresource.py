@@ -21,9 +21,10 @@ import tempfile
 import hashlib
 import cherrypy
 import logging
-from cherrypy.lib.static import serve_file
 from pymager import config
 from pymager import imgengine
+from pymager.web._sendfile import serve_data_file
+from pymager.web._multipartreader import MultipartReader, MultipartError
 
 FILE_FIELD_NAME = "file"
 PERMISSIONS = 0644
@@ -59,10 +60,22 @@ class OriginalResource(object):
         'tools.disable_body_processing.on' : True,
         'tools.enable_basic_auth.on' : True
     }
-    def __init__(self, app_config, image_processor):
+    def __init__(self, app_config, image_processor, derivation_queue=None):
+        """ @param derivation_queue: the DerivationQueue that pre-generates the derived 
+        images of the uploaded images, when app_config.pregenerate_on_upload is set """
         super(OriginalResource, self).__init__()
         self.__app_config = app_config
         self.__image_processor = image_processor
+        self.__derivation_queue = derivation_queue
+    
+    def __pregenerate(self, image_id):
+        """ the pre-generation is an optimization : the derived images are created on demand if it does not happen """
+        if not self.__app_config.pregenerate_on_upload or self.__derivation_queue is None or not self.__app_config.allowed_sizes:
+            return
+        sizes = self.__app_config.allowed_sizes
+        formats = self.__app_config.pregenerate_formats
+        if not self.__derivation_queue.submit(image_id, lambda: self.__image_processor.pregenerate(image_id, sizes, formats)):
+            logger.warning("Derived images of %s will be created on demand" % (image_id,))
         
     #@cherrypy.expose
     #def index(self):
@@ -84,8 +97,7 @@ class OriginalResource(object):
         except imgengine.ImageMetadataNotFoundException:
             raise cherrypy.NotFound(cherrypy.request.path_info)
         else:
-            path = os.path.join(self.__app_config.data_directory, relative_path)
-            return serve_file(path)
+            return serve_data_file(self.__app_config, relative_path)
     
     #@cherrypy.tools.enable_basic_auth()
     #@cherrypy.tools.disable_body_processing()
@@ -104,28 +116,25 @@ class OriginalResource(object):
         logger.debug("POST %s" % (image_id,))
         cherrypy.response.timeout = 3600
     
-        # convert the header keys to lower case
-        lcHDRS = {}
-        for key, val in cherrypy.request.headers.iteritems():
-            lcHDRS[key.lower()] = val
-
-        # at this point we could limit the upload on content-length...
-        # incomingBytes = int(lcHDRS['content-length'])
+        # the file is parsed from the request body while it is received, and written once by the image processor
+        content_type, params = cgi.parse_header(cherrypy.request.headers.get('Content-Type', ''))
+        if content_type != 'multipart/form-data' or not params.get('boundary'):
+            raise cherrypy.HTTPError(status=400, message="Multipart Request expected")
+        reader = MultipartReader(cherrypy.request.rfile, params['boundary'])
         
-        # create our version of cgi.FieldStorage to parse the MIME encoded
-        # form data where the file is contained
-        formFields = cgi.FieldStorage(fp=cherrypy.request.rfile,
-            headers=lcHDRS,
-            environ={'REQUEST_METHOD':'POST'},
-            keep_blank_values=True)
-        
-        if FILE_FIELD_NAME not in formFields:
+        try:
+            part = reader.next_part()
+            while part is not None and part.name != FILE_FIELD_NAME:
+                part = reader.next_part()
+        except MultipartError, e:
+            raise cherrypy.HTTPError(status=400, message="Malformed Multipart Request: %s" % (e,))
+        if part is None:
             raise cherrypy.HTTPError(status=400, message="Multipart Request does not contain a 'file' parameter")
         
-        theFile = formFields[FILE_FIELD_NAME]  
-            
         try:
-            self.__image_processor.save_file_to_repository(theFile.file, image_id)
+            self.__image_processor.save_stream_to_repository(reader.read_part(), image_id)
+        except MultipartError, e:
+            raise cherrypy.HTTPError(status=400, message="Malformed Multipart Request: %s" % (e,))
         except imgengine.ImageIDAlreadyExistsException:
             raise cherrypy.HTTPError(status=409, message="Image ID Already Exists")
         except imgengine.ImageStreamNotRecognizedException:
@@ -134,5 +143,6 @@ class OriginalResource(object):
             raise cherrypy.HTTPError(status=400, message="Image ID is invalid")
         else:
             #myFieldStorage.strategy.deleteTempFile(theFile)
+            self.__pregenerate(image_id)
             raise cherrypy.HTTPRedirect('%s%s' % (cherrypy.request.script_name, cherrypy.request.path_info)) 
         
@@ -0,0 +1,47 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import os
+import urllib
+import mimetypes
+import cherrypy
+from cherrypy.lib import cptools, httputil
+from cherrypy.lib.static import serve_file
+from pymager import bootstrap
+
+def serve_data_file(app_config, relative_path):
+    """ Serves the file of the data directory at relative_path, either through python, or by letting the 
+    front-end server send it, depending on app_config.sendfile_mode : only the headers are then set here, 
+    and the request thread is released while the front-end server sends the file """
+    path = os.path.join(app_config.data_directory, relative_path)
+    if app_config.sendfile_mode == bootstrap.SENDFILE_OFF:
+        return serve_file(path)
+    
+    try:
+        modification_time = os.stat(path).st_mtime
+    except OSError:
+        raise cherrypy.NotFound(cherrypy.request.path_info)
+    response = cherrypy.serving.response
+    response.headers['Last-Modified'] = httputil.HTTPDate(modification_time)
+    cptools.validate_since()
+    content_type = mimetypes.types_map.get(os.path.splitext(path)[1].lower())
+    if content_type is not None:
+        response.headers['Content-Type'] = content_type
+    if app_config.sendfile_mode == bootstrap.SENDFILE_X_SENDFILE:
+        response.headers['X-Sendfile'] = path
+    else:
+        response.headers['X-Accel-Redirect'] = app_config.sendfile_prefix + urllib.quote(relative_path.replace(os.sep, '/'))
+    return ''
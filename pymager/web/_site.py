@@ -15,6 +15,7 @@
 """
 
 import shutil
+import cherrypy
 
 from pymager.bootstrap import ImageServerFactory, ServiceConfiguration
 from pymager.web._toplevelresource import TopLevelResource
@@ -35,7 +36,56 @@ def create_site(config):
         data_directory=config['data_directory'] if (config.__contains__('data_directory')) else '/tmp/pymager',
         dburi=config['dburi'] if (config.__contains__('dburi')) else 'sqlite:////tmp/db.sqlite',
         allowed_sizes=config['allowed_sizes'] if (config.__contains__('allowed_sizes')) else None,
-        dev_mode=config['dev_mode'] if (config.__contains__('dev_mode')) else False)
+        dev_mode=config['dev_mode'] if (config.__contains__('dev_mode')) else False,
+        lock_manager=config['lock_manager'] if (config.__contains__('lock_manager')) else 'file',
+        lock_timeout_seconds=config['lock_timeout_seconds'] if (config.__contains__('lock_timeout_seconds')) else 10,
+        lock_lease_seconds=config['lock_lease_seconds'] if (config.__contains__('lock_lease_seconds')) else 30,
+        derivation_processes=config['derivation_processes'] if (config.__contains__('derivation_processes')) else 0,
+        derivation_queue_size=config['derivation_queue_size'] if (config.__contains__('derivation_queue_size')) else 100,
+        derivative_source_ratio=config['derivative_source_ratio'] if (config.__contains__('derivative_source_ratio')) else 0,
+        mezzanine_max_size=config['mezzanine_max_size'] if (config.__contains__('mezzanine_max_size')) else 0,
+        background_derivation_workers=config['background_derivation_workers'] if (config.__contains__('background_derivation_workers')) else 0,
+        background_derivation_queue_size=config['background_derivation_queue_size'] if (config.__contains__('background_derivation_queue_size')) else 100,
+        pregenerate_on_upload=config['pregenerate_on_upload'] if (config.__contains__('pregenerate_on_upload')) else False,
+        pregenerate_formats=config['pregenerate_formats'] if (config.__contains__('pregenerate_formats')) else None,
+        async_derivation_mode=config['async_derivation_mode'] if (config.__contains__('async_derivation_mode')) else 'off',
+        derived_image_cache_max_bytes=config['derived_image_cache_max_bytes'] if (config.__contains__('derived_image_cache_max_bytes')) else 0,
+        decoded_image_cache_max_bytes=config['decoded_image_cache_max_bytes'] if (config.__contains__('decoded_image_cache_max_bytes')) else 0,
+        image_metadata_cache_ttl_seconds=config['image_metadata_cache_ttl_seconds'] if (config.__contains__('image_metadata_cache_ttl_seconds')) else 0,
+        image_metadata_cache_max_entries=config['image_metadata_cache_max_entries'] if (config.__contains__('image_metadata_cache_max_entries')) else 10000,
+        negative_lookup_cache_ttl_seconds=config['negative_lookup_cache_ttl_seconds'] if (config.__contains__('negative_lookup_cache_ttl_seconds')) else 0,
+        negative_lookup_cache_max_entries=config['negative_lookup_cache_max_entries'] if (config.__contains__('negative_lookup_cache_max_entries')) else 100000,
+        known_image_ids_rebuild_seconds=config['known_image_ids_rebuild_seconds'] if (config.__contains__('known_image_ids_rebuild_seconds')) else 0,
+        derived_image_index=config['derived_image_index'] if (config.__contains__('derived_image_index')) else False,
+        derived_image_index_rebuild_seconds=config['derived_image_index_rebuild_seconds'] if (config.__contains__('derived_image_index_rebuild_seconds')) else 3600,
+        derived_image_quota_bytes=config['derived_image_quota_bytes'] if (config.__contains__('derived_image_quota_bytes')) else 0,
+        derived_image_collection_seconds=config['derived_image_collection_seconds'] if (config.__contains__('derived_image_collection_seconds')) else 60,
+        hot_directory=config['hot_directory'] if (config.__contains__('hot_directory')) else None,
+        hot_tier_max_bytes=config['hot_tier_max_bytes'] if (config.__contains__('hot_tier_max_bytes')) else 1073741824,
+        hot_tier_promotion_accesses=config['hot_tier_promotion_accesses'] if (config.__contains__('hot_tier_promotion_accesses')) else 3,
+        hot_tier_rebalance_seconds=config['hot_tier_rebalance_seconds'] if (config.__contains__('hot_tier_rebalance_seconds')) else 60,
+        packfile_directory=config['packfile_directory'] if (config.__contains__('packfile_directory')) else None,
+        packfile_max_image_bytes=config['packfile_max_image_bytes'] if (config.__contains__('packfile_max_image_bytes')) else 65536,
+        packfile_segment_bytes=config['packfile_segment_bytes'] if (config.__contains__('packfile_segment_bytes')) else 268435456,
+        packfile_compaction_ratio=config['packfile_compaction_ratio'] if (config.__contains__('packfile_compaction_ratio')) else 0.5,
+        packfile_compaction_seconds=config['packfile_compaction_seconds'] if (config.__contains__('packfile_compaction_seconds')) else 3600,
+        data_directories=config['data_directories'] if (config.__contains__('data_directories')) else None,
+        deduplicate_originals=config['deduplicate_originals'] if (config.__contains__('deduplicate_originals')) else False,
+        sendfile_mode=config['sendfile_mode'] if (config.__contains__('sendfile_mode')) else 'off',
+        sendfile_prefix=config['sendfile_prefix'] if (config.__contains__('sendfile_prefix')) else '/pymager-files/',
+        public_directory=config['public_directory'] if (config.__contains__('public_directory')) else None,
+        derived_image_max_age_seconds=config['derived_image_max_age_seconds'] if (config.__contains__('derived_image_max_age_seconds')) else 0,
+        etag_cache_ttl_seconds=config['etag_cache_ttl_seconds'] if (config.__contains__('etag_cache_ttl_seconds')) else 0,
+        etag_cache_max_entries=config['etag_cache_max_entries'] if (config.__contains__('etag_cache_max_entries')) else 100000)
     pymager.config.set_app_config(app_config)
-    top_level_resource = TopLevelResource(app_config, _init_imageprocessor(app_config), image_server_factory.image_format_mapper)
+    top_level_resource = TopLevelResource(app_config, _init_imageprocessor(app_config), image_server_factory.image_format_mapper, image_server_factory.derivation_queue, image_server_factory.statistics, image_server_factory.derived_image_cache, image_server_factory.packed_image_store, image_server_factory.etag_cache)
+    if image_server_factory.derivation_queue is not None:
+        cherrypy.engine.subscribe('stop', image_server_factory.derivation_queue.shutdown)
+    if image_server_factory.derived_image_collector is not None:
+        cherrypy.engine.subscribe('stop', image_server_factory.derived_image_collector.shutdown)
+    if image_server_factory.derived_image_tiers is not None:
+        cherrypy.engine.subscribe('stop', image_server_factory.derived_image_tiers.shutdown)
+    if image_server_factory.image_store_compactor is not None:
+        cherrypy.engine.subscribe('stop', image_server_factory.image_store_compactor.shutdown)
+    cherrypy.engine.subscribe('stop', image_server_factory.derivation_executor.shutdown)
     return top_level_resource 
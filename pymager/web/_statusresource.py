@@ -0,0 +1,36 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import json
+import cherrypy
+import logging
+
+logger = logging.getLogger("web.statusresource")
+
+class StatusResource(object):
+    """ Exposes the activity of the image server (e.g. the depth of the derivation queue), as JSON """
+    exposed = True
+    
+    def __init__(self, statistics):
+        """ @param statistics: a callable that returns a JSON serializable dictionary """
+        super(StatusResource, self).__init__()
+        self.__statistics = statistics
+    
+    def GET(self):
+        logger.debug("GET status")
+        cherrypy.response.headers['Content-Type'] = 'application/json'
+        cherrypy.response.headers['Cache-Control'] = 'no-cache'
+        return json.dumps(self.__statistics())
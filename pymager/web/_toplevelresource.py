@@ -18,6 +18,7 @@ import cherrypy
 from pkg_resources import resource_filename
 from pymager.web._originalresource import OriginalResource
 from pymager.web._derivedresource import DerivedResource
+from pymager.web._statusresource import StatusResource
 from pymager import config
 
 class TopLevelResource(object):
@@ -25,13 +26,15 @@ class TopLevelResource(object):
         'error_page.400': resource_filename('pymager.web.templates', 'error-default.html'),
         'error_page.403': resource_filename('pymager.web.templates', 'error-default.html'),
         'error_page.404': resource_filename('pymager.web.templates', 'error-default.html'),
-        'error_page.409': resource_filename('pymager.web.templates', 'error-default.html')
+        'error_page.409': resource_filename('pymager.web.templates', 'error-default.html'),
+        'error_page.503': resource_filename('pymager.web.templates', 'error-default.html')
     }
-    def __init__(self, app_config, image_processor, image_format_mapper):
+    def __init__(self, app_config, image_processor, image_format_mapper, derivation_queue=None, statistics=None, derived_image_cache=None, packed_image_store=None, etag_cache=None):
         self.__config = app_config
         self.__image_processor = image_processor
-        self.original = OriginalResource(app_config, image_processor)
-        self.derived = DerivedResource(app_config, image_processor, image_format_mapper)
+        self.original = OriginalResource(app_config, image_processor, derivation_queue)
+        self.derived = DerivedResource(app_config, image_processor, image_format_mapper, derivation_queue, derived_image_cache, packed_image_store, etag_cache)
+        self.status = StatusResource(statistics if statistics is not None else (lambda: {}))
     
     #@cherrypy.expose
     #def index(self):
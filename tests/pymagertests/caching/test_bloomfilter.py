@@ -0,0 +1,36 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import unittest
+from pymager.caching.impl.bloomfilter import BloomFilter
+
+class BloomFilterTestCase(unittest.TestCase):
+    def test_should_contain_added_keys(self):
+        bloom_filter = BloomFilter(1000)
+        for i in xrange(1000):
+            bloom_filter.add('id%s' % i)
+        bloom_filter.add(u'\xe9t\xe9')
+        for i in xrange(1000):
+            self.assertTrue('id%s' % i in bloom_filter)
+        self.assertTrue(u'\xe9t\xe9' in bloom_filter)
+        self.assertEquals(1001, len(bloom_filter))
+    
+    def test_should_not_contain_most_other_keys(self):
+        bloom_filter = BloomFilter(1000, 0.01)
+        for i in xrange(1000):
+            bloom_filter.add('id%s' % i)
+        false_positives = len([i for i in xrange(10000) if 'unknown%s' % i in bloom_filter])
+        self.assertTrue(false_positives < 300, false_positives)
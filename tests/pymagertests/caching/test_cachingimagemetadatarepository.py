@@ -0,0 +1,84 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import unittest
+from zope.interface import implements
+from pymager import domain
+from pymager.caching.impl.lrucache import LruCache
+from pymager.caching.impl.cachingimagemetadatarepository import CachingImageMetadataRepository
+
+class InMemoryImageMetadataRepository(object):
+    implements(domain.ImageMetadataRepository)
+    
+    def __init__(self):
+        self.items = {}
+        self.lookups = 0
+    
+    def find_original_image_metadata_by_id(self, image_id):
+        self.lookups += 1
+        return self.items.get(image_id)
+    
+    def find_original_image_metadata_ids(self):
+        return self.items.keys()
+    
+    def add(self, item):
+        self.items[item.id] = item
+    
+    def delete(self, item):
+        del self.items[item.id]
+
+class CachingImageMetadataRepositoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self._repository = InMemoryImageMetadataRepository()
+        self._cache = LruCache(10, lambda entry: 1)
+        self._caching_repository = CachingImageMetadataRepository(self._repository, self._cache, 60)
+    
+    def test_should_cache_ok_original_image_metadata(self):
+        self._repository.add(domain.OriginalImageMetadata('MYID', domain.STATUS_OK, (800, 600), domain.IMAGE_FORMAT_JPEG))
+        first = self._caching_repository.find_original_image_metadata_by_id('MYID')
+        second = self._caching_repository.find_original_image_metadata_by_id('MYID')
+        self.assertEquals(1, self._repository.lookups)
+        self.assertEquals('MYID', second.id)
+        self.assertEquals(domain.STATUS_OK, second.status)
+        self.assertEquals((800, 600), second.size)
+        self.assertEquals(domain.IMAGE_FORMAT_JPEG, second.format)
+        self.assertTrue(first is not second)
+        self.assertTrue(second is not self._repository.items['MYID'])
+    
+    def test_should_not_cache_inconsistent_original_image_metadata(self):
+        self._repository.add(domain.OriginalImageMetadata('MYID', domain.STATUS_INCONSISTENT, (800, 600), domain.IMAGE_FORMAT_JPEG))
+        self._caching_repository.find_original_image_metadata_by_id('MYID')
+        self._caching_repository.find_original_image_metadata_by_id('MYID')
+        self.assertEquals(2, self._repository.lookups)
+    
+    def test_should_not_cache_missing_original_image_metadata(self):
+        self.assertEquals(None, self._caching_repository.find_original_image_metadata_by_id('MYID'))
+        self._repository.add(domain.OriginalImageMetadata('MYID', domain.STATUS_OK, (800, 600), domain.IMAGE_FORMAT_JPEG))
+        self.assertEquals('MYID', self._caching_repository.find_original_image_metadata_by_id('MYID').id)
+    
+    def test_should_expire_cached_original_image_metadata(self):
+        self._caching_repository = CachingImageMetadataRepository(self._repository, self._cache, -1)
+        self._repository.add(domain.OriginalImageMetadata('MYID', domain.STATUS_OK, (800, 600), domain.IMAGE_FORMAT_JPEG))
+        self._caching_repository.find_original_image_metadata_by_id('MYID')
+        self._caching_repository.find_original_image_metadata_by_id('MYID')
+        self.assertEquals(2, self._repository.lookups)
+    
+    def test_should_invalidate_deleted_original_image_metadata(self):
+        item = domain.OriginalImageMetadata('MYID', domain.STATUS_OK, (800, 600), domain.IMAGE_FORMAT_JPEG)
+        self._repository.add(item)
+        self._caching_repository.find_original_image_metadata_by_id('MYID')
+        self._caching_repository.delete(item)
+        self.assertEquals(None, self._caching_repository.find_original_image_metadata_by_id('MYID'))
@@ -0,0 +1,58 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import unittest
+from pymager.caching.impl.lrucache import LruCache
+
+class LruCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self._cache = LruCache(10)
+    
+    def test_should_return_cached_value(self):
+        self._cache.put('key', 'value')
+        self.assertEquals('value', self._cache.get('key'))
+        self.assertEquals(None, self._cache.get('other'))
+        self.assertEquals(1, self._cache.statistics()['hits'])
+        self.assertEquals(1, self._cache.statistics()['misses'])
+    
+    def test_should_evict_least_recently_used_values(self):
+        self._cache.put('a', 'aaaa')
+        self._cache.put('b', 'bbbb')
+        self._cache.get('a')
+        self._cache.put('c', 'cccc')
+        self.assertEquals('aaaa', self._cache.get('a'))
+        self.assertEquals(None, self._cache.get('b'))
+        self.assertEquals('cccc', self._cache.get('c'))
+        self.assertEquals(8, self._cache.statistics()['size'])
+        self.assertEquals(1, self._cache.statistics()['evictions'])
+    
+    def test_should_not_cache_value_larger_than_budget(self):
+        self._cache.put('key', 'x' * 11)
+        self.assertEquals(None, self._cache.get('key'))
+        self.assertEquals(0, self._cache.statistics()['size'])
+    
+    def test_should_replace_value(self):
+        self._cache.put('key', 'aaaa')
+        self._cache.put('key', 'bb')
+        self.assertEquals('bb', self._cache.get('key'))
+        self.assertEquals(2, self._cache.statistics()['size'])
+    
+    def test_should_invalidate_value(self):
+        self._cache.put('key', 'value')
+        self._cache.invalidate('key')
+        self._cache.invalidate('unknown')
+        self.assertEquals(None, self._cache.get('key'))
+        self.assertEquals(0, self._cache.statistics()['size'])
@@ -0,0 +1,148 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from pymager import domain
+from pymager.caching.impl.lrucache import LruCache
+from pymager.caching.impl import negativelookupimagemetadatarepository
+from pymager.caching.impl.negativelookupimagemetadatarepository import NegativeLookupImageMetadataRepository
+from tests.pymagertests.caching.test_cachingimagemetadatarepository import InMemoryImageMetadataRepository
+
+class NegativeLookupImageMetadataRepositoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self._repository = InMemoryImageMetadataRepository()
+        self._repository.add(domain.OriginalImageMetadata('MYID', domain.STATUS_OK, (800, 600), domain.IMAGE_FORMAT_JPEG))
+    
+        self._journal_directory = tempfile.mkdtemp()
+        self._journal_filename = os.path.join(self._journal_directory, negativelookupimagemetadatarepository.JOURNAL_FILENAME)
+    
+    def tearDown(self):
+        shutil.rmtree(self._journal_directory)
+    
+    def _negative_lookup_repository(self, miss_ttl_seconds, known_ids_rebuild_seconds, journal_filename=None):
+        return NegativeLookupImageMetadataRepository(self._repository, LruCache(10, lambda entry: 1), miss_ttl_seconds, known_ids_rebuild_seconds, journal_filename)
+    
+    def _add(self, image_id):
+        self._repository.add(domain.OriginalImageMetadata(image_id, domain.STATUS_OK, (800, 600), domain.IMAGE_FORMAT_JPEG))
+    
+    def test_should_remember_unknown_ids(self):
+        negative_lookup_repository = self._negative_lookup_repository(60, 0)
+        self.assertEquals(None, negative_lookup_repository.find_original_image_metadata_by_id('unknown'))
+        self.assertEquals(None, negative_lookup_repository.find_original_image_metadata_by_id('unknown'))
+        self.assertEquals(1, self._repository.lookups)
+        self.assertEquals(1, negative_lookup_repository.statistics()['rejected_by_misses'])
+    
+    def test_should_forget_unknown_ids_once_they_expire(self):
+        negative_lookup_repository = self._negative_lookup_repository(-1, 0)
+        negative_lookup_repository.find_original_image_metadata_by_id('unknown')
+        negative_lookup_repository.find_original_image_metadata_by_id('unknown')
+        self.assertEquals(2, self._repository.lookups)
+    
+    def test_should_always_look_known_ids_up(self):
+        negative_lookup_repository = self._negative_lookup_repository(60, 60)
+        negative_lookup_repository.find_original_image_metadata_by_id('MYID')
+        self.assertEquals('MYID', negative_lookup_repository.find_original_image_metadata_by_id('MYID').id)
+        self.assertEquals(2, self._repository.lookups)
+    
+    def test_should_reject_ids_that_are_not_in_the_known_ids(self):
+        negative_lookup_repository = self._negative_lookup_repository(0, 60)
+        self.assertEquals(None, negative_lookup_repository.find_original_image_metadata_by_id('unknown'))
+        self.assertEquals(0, self._repository.lookups)
+        self.assertEquals(1, negative_lookup_repository.statistics()['known_ids'])
+        self.assertEquals(1, negative_lookup_repository.statistics()['rejected_by_known_ids'])
+    
+    def test_saved_ids_should_be_found(self):
+        negative_lookup_repository = self._negative_lookup_repository(60, 60)
+        negative_lookup_repository.find_original_image_metadata_by_id('NEWID')
+        self._repository.add(domain.OriginalImageMetadata('NEWID', domain.STATUS_OK, (800, 600), domain.IMAGE_FORMAT_JPEG))
+        negative_lookup_repository.image_metadata_saved('NEWID')
+        self.assertEquals('NEWID', negative_lookup_repository.find_original_image_metadata_by_id('NEWID').id)
+    
+    def test_should_rebuild_known_ids_in_the_background_once_they_expire(self):
+        negative_lookup_repository = self._negative_lookup_repository(0, -1)
+        negative_lookup_repository.find_original_image_metadata_by_id('NEWID')
+        self._add('NEWID')
+        deadline = time.time() + 5
+        while negative_lookup_repository.find_original_image_metadata_by_id('NEWID') is None and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEquals('NEWID', negative_lookup_repository.find_original_image_metadata_by_id('NEWID').id)
+    
+    def test_should_keep_rejecting_unknown_ids_while_rebuilding(self):
+        negative_lookup_repository = self._negative_lookup_repository(0, 60)
+        negative_lookup_repository.rebuild_known_ids()
+        rebuilding = threading.Event()
+        rebuilt = threading.Event()
+        find_original_image_metadata_ids = self._repository.find_original_image_metadata_ids
+        def find_slowly():
+            rebuilding.set()
+            rebuilt.wait(5)
+            return find_original_image_metadata_ids()
+        self._repository.find_original_image_metadata_ids = find_slowly
+        thread = threading.Thread(target=negative_lookup_repository.rebuild_known_ids)
+        thread.start()
+        try:
+            rebuilding.wait(5)
+            self.assertEquals(None, negative_lookup_repository.find_original_image_metadata_by_id('unknown'))
+            self.assertEquals(0, self._repository.lookups)
+        finally:
+            rebuilt.set()
+            thread.join()
+    
+    def test_ids_saved_by_another_process_should_be_found(self):
+        negative_lookup_repository = self._negative_lookup_repository(60, 60, self._journal_filename)
+        other_negative_lookup_repository = self._negative_lookup_repository(60, 60, self._journal_filename)
+        self.assertEquals(None, negative_lookup_repository.find_original_image_metadata_by_id('NEWID'))
+        self._add('NEWID')
+        other_negative_lookup_repository.image_metadata_saved('NEWID')
+        self.assertEquals('NEWID', negative_lookup_repository.find_original_image_metadata_by_id('NEWID').id)
+        self.assertEquals(None, negative_lookup_repository.find_original_image_metadata_by_id('unknown'))
+        self.assertEquals(1, self._repository.lookups)
+    
+    def test_should_look_ids_up_once_another_process_replaced_the_journal(self):
+        negative_lookup_repository = self._negative_lookup_repository(0, 60, self._journal_filename)
+        other_negative_lookup_repository = self._negative_lookup_repository(0, 60, self._journal_filename)
+        other_negative_lookup_repository.image_metadata_saved('MYID')
+        self.assertEquals(None, negative_lookup_repository.find_original_image_metadata_by_id('NEWID'))
+        self.assertEquals(0, self._repository.lookups)
+        self._add('NEWID')
+        journal_max_bytes = negativelookupimagemetadatarepository.JOURNAL_MAX_BYTES
+        negativelookupimagemetadatarepository.JOURNAL_MAX_BYTES = 0
+        try:
+            other_negative_lookup_repository.rebuild_known_ids()
+        finally:
+            negativelookupimagemetadatarepository.JOURNAL_MAX_BYTES = journal_max_bytes
+        self.assertEquals(0, os.path.getsize(self._journal_filename))
+        self.assertEquals('NEWID', negative_lookup_repository.find_original_image_metadata_by_id('NEWID').id)
+    
+    def test_should_append_an_id_saved_several_times_once(self):
+        negative_lookup_repository = self._negative_lookup_repository(60, 60, self._journal_filename)
+        negative_lookup_repository.image_metadata_saved('MYID')
+        negative_lookup_repository.image_metadata_saved('MYID')
+        self.assertEquals('MYID\n', open(self._journal_filename).read())
+        negative_lookup_repository.image_metadata_deleted('MYID')
+        negative_lookup_repository.image_metadata_saved('MYID')
+        self.assertEquals('MYID\nMYID\n', open(self._journal_filename).read())
+    
+    def test_should_not_journal_when_the_known_ids_are_disabled(self):
+        negative_lookup_repository = self._negative_lookup_repository(60, 0, self._journal_filename)
+        for i in range(100):
+            negative_lookup_repository.image_metadata_saved('MYID%s' % (i,))
+        self.assertFalse(os.path.exists(self._journal_filename))
@@ -15,6 +15,7 @@
 """
 
 import unittest
+from datetime import datetime, timedelta
 from pymager import domain
 
 from tests.pymagertests.abstractintegrationtestcase import AbstractIntegrationTestCase
@@ -41,6 +42,20 @@ class ImageMetadataRepositoryTestCase(AbstractIntegrationTestCase):
         assert found_item.format == domain.IMAGE_FORMAT_JPEG
         _datetimes_should_be_equal(item.last_status_change_date, found_item.last_status_change_date)
     
+    def test_should_find_original_image_metadata_ids(self):
+        self._itemRepository.add(domain.OriginalImageMetadata('MYID1', domain.STATUS_OK, (800, 600), domain.IMAGE_FORMAT_JPEG))
+        original_image_metadata = domain.OriginalImageMetadata('MYID2', domain.STATUS_INCONSISTENT, (800, 600), domain.IMAGE_FORMAT_JPEG)
+        self._itemRepository.add(original_image_metadata)
+        self._itemRepository.add(domain.DerivedImageMetadata(domain.STATUS_OK, (100, 100), domain.IMAGE_FORMAT_JPEG, original_image_metadata))
+        self.assertEquals(['MYID1', 'MYID2'], sorted(self._itemRepository.find_original_image_metadata_ids()))
+    
+    def test_should_find_derived_image_metadata_ids_by_status(self):
+        original_image_metadata = domain.OriginalImageMetadata('MYID', domain.STATUS_OK, (800, 600), domain.IMAGE_FORMAT_JPEG)
+        self._itemRepository.add(original_image_metadata)
+        self._itemRepository.add(domain.DerivedImageMetadata(domain.STATUS_OK, (100, 100), domain.IMAGE_FORMAT_JPEG, original_image_metadata))
+        self._itemRepository.add(domain.DerivedImageMetadata(domain.STATUS_INCONSISTENT, (200, 200), domain.IMAGE_FORMAT_JPEG, original_image_metadata))
+        self.assertEquals(['MYID-100x100-JPEG'], self._itemRepository.find_derived_image_metadata_ids_by_status(domain.STATUS_OK))
+    
     def test_should_update_original_image_metadata(self):
         item = domain.OriginalImageMetadata('MYID12435', domain.STATUS_INCONSISTENT, (800, 600), domain.IMAGE_FORMAT_JPEG)
         self._itemRepository.add(item)
@@ -253,6 +268,36 @@ class ImageMetadataRepositoryTestCase(AbstractIntegrationTestCase):
             assert i.height == 100
             assert i.format == domain.IMAGE_FORMAT_JPEG
 
+    def _add_derived_image_metadatas(self, count, status=domain.STATUS_OK):
+        original_image_metadata = domain.OriginalImageMetadata('MYID', domain.STATUS_OK, (800, 600), domain.IMAGE_FORMAT_JPEG)
+        self._itemRepository.add(original_image_metadata)
+        items = []
+        for i in range(1, count + 1):
+            item = domain.DerivedImageMetadata(status, (100 * i, 100 * i), domain.IMAGE_FORMAT_JPEG, original_image_metadata)
+            self._itemRepository.add(item)
+            items.append(item)
+        return items
+    
+    def test_should_find_least_recently_accessed_derived_image_metadatas(self):
+        items = self._add_derived_image_metadatas(3)
+        self._itemRepository.update_derived_image_metadata_last_access_dates([items[0].id, items[2].id], datetime.utcnow() + timedelta(1))
+        
+        found_items = self._itemRepository.find_least_recently_accessed_derived_image_metadatas(2)
+        self.assertEquals(2, len(found_items))
+        self.assertEquals(items[1].id, found_items[0].id)
+        self.assertTrue(found_items[1].id in [items[0].id, items[2].id])
+    
+    def test_should_not_find_inconsistent_derived_image_metadatas_as_least_recently_accessed(self):
+        self._add_derived_image_metadatas(2, domain.STATUS_INCONSISTENT)
+        self.assertEquals([], self._itemRepository.find_least_recently_accessed_derived_image_metadatas())
+    
+    def test_should_find_unmeasured_derived_image_metadatas_and_sum_file_sizes(self):
+        items = self._add_derived_image_metadatas(3)
+        items[0].file_size = 1000
+        items[1].file_size = 234
+        self.assertEquals([items[2].id], [i.id for i in self._itemRepository.find_unmeasured_derived_image_metadatas()])
+        self.assertEquals(1234, self._itemRepository.sum_derived_image_metadata_file_sizes())
+    
 def _datetimes_should_be_equal(datetime1, datetime2):
     delta = datetime1 - datetime2
     assert delta.days == 0
@@ -0,0 +1,55 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import unittest
+from zope.interface import implements
+from pymager import domain
+from pymager.imgengine.impl import accesstracker
+from pymager.imgengine.impl.accesstracker import AccessTracker
+
+class LastAccessDatesRepository(object):
+    implements(domain.ImageMetadataRepository)
+    
+    def __init__(self):
+        self.updates = []
+    
+    def update_derived_image_metadata_last_access_dates(self, derived_image_ids, last_access_date):
+        self.updates.append(sorted(derived_image_ids))
+
+class AccessTrackerTestCase(unittest.TestCase):
+    def setUp(self):
+        self._repository = LastAccessDatesRepository()
+        self._tracker = AccessTracker(self._repository)
+    
+    def test_should_write_distinct_accesses_on_flush(self):
+        self._tracker.record('a')
+        self._tracker.record('b')
+        self._tracker.record('a')
+        self.assertEquals([], self._repository.updates)
+        self.assertEquals(2, self._tracker.statistics()['pending_accesses'])
+        
+        self._tracker.flush()
+        self.assertEquals([['a', 'b']], self._repository.updates)
+        self.assertEquals({'pending_accesses': 0, 'flushed_accesses': 2}, self._tracker.statistics())
+        
+        self._tracker.flush()
+        self.assertEquals(1, len(self._repository.updates))
+    
+    def test_should_write_accesses_in_batches(self):
+        for i in range(accesstracker.FLUSH_BATCH_SIZE + 1):
+            self._tracker.record('id%s' % i)
+        self._tracker.flush()
+        self.assertEquals([accesstracker.FLUSH_BATCH_SIZE, 1], [len(ids) for ids in self._repository.updates])
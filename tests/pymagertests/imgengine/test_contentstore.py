@@ -0,0 +1,70 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import os
+import shutil
+import hashlib
+import tempfile
+import unittest
+from pymager.imgengine.impl.contentstore import ContentStore
+
+class ContentStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._content_store = ContentStore(os.path.join(self._directory, 'blobs'))
+    
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+    
+    def _filename(self, name):
+        return os.path.join(self._directory, name)
+    
+    def _move(self, content, name):
+        with open(self._filename(name + '.tmp'), 'wb') as f:
+            f.write(content)
+        return self._content_store.move(hashlib.sha1(content).hexdigest(), self._filename(name + '.tmp'), self._filename(name))
+    
+    def test_should_store_same_content_once(self):
+        content_hash = self._move('content', 'a')
+        self.assertEquals(hashlib.sha1('content').hexdigest(), content_hash)
+        self.assertEquals(content_hash, self._move('content', 'b'))
+        
+        self.assertEquals('content', open(self._filename('b')).read())
+        self.assertFalse(os.path.exists(self._filename('a.tmp')))
+        self.assertFalse(os.path.exists(self._filename('b.tmp')))
+        self.assertEquals(os.stat(self._filename('a')).st_ino, os.stat(self._filename('b')).st_ino)
+        self.assertEquals(3, os.stat(self._content_store.blob_path(content_hash)).st_nlink)
+        self.assertEquals({'linked_files': 1, 'stored_blobs': 1, 'released_blobs': 0}, self._content_store.statistics())
+    
+    def test_should_release_blob_with_last_file(self):
+        content_hash = self._move('content', 'a')
+        self._move('content', 'b')
+        os.remove(self._filename('a'))
+        self._content_store.release(content_hash)
+        self.assertTrue(os.path.exists(self._content_store.blob_path(content_hash)))
+        
+        os.remove(self._filename('b'))
+        self._content_store.release(content_hash)
+        self.assertFalse(os.path.exists(self._content_store.blob_path(content_hash)))
+        self._content_store.release(content_hash)
+    
+    def test_should_link_added_file(self):
+        self.assertFalse(self._content_store.link('key', self._filename('b')))
+        with open(self._filename('a'), 'wb') as f:
+            f.write('derived')
+        self._content_store.add('key', self._filename('a'))
+        self.assertTrue(self._content_store.link('key', self._filename('b')))
+        self.assertEquals('derived', open(self._filename('b')).read())
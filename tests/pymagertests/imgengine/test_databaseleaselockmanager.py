@@ -0,0 +1,59 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from datetime import datetime, timedelta
+from pymager import imgengine
+from pymager.imgengine.impl import databaseleaselockmanager
+from pymager.imgengine.impl.databaseleaselockmanager import DatabaseLeaseLockManager
+from tests.pymagertests.abstractintegrationtestcase import AbstractIntegrationTestCase
+
+class DatabaseLeaseLockManagerTestCase(AbstractIntegrationTestCase):
+    
+    def onSetUp(self):
+        self._engine = self._image_server_factory.engine
+        self._lock_manager = DatabaseLeaseLockManager(self._engine, lease_seconds=30, timeout_seconds=0.3)
+    
+    def test_should_acquire_and_release_lock(self):
+        lock = self._lock_manager.acquire('sampleId')
+        lock.release()
+        self._lock_manager.acquire('sampleId').release()
+    
+    def test_should_not_acquire_lock_held_by_somebody_else(self):
+        lock = self._lock_manager.acquire('sampleId')
+        try:
+            self._lock_manager.acquire('sampleId')
+            self.fail()
+        except imgengine.LockTimeoutException, ex:
+            self.assertEquals('sampleId', ex.key)
+        finally:
+            lock.release()
+    
+    def test_should_steal_expired_lease(self):
+        dead_lock = self._lock_manager.acquire('sampleId')
+        # the owner died, and stopped renewing its lease a long time ago
+        self._engine.execute(databaseleaselockmanager._item_lease.update()\
+            .values(last_heartbeat_date=datetime.utcnow() - timedelta(seconds=60)))
+        
+        self._lock_manager.acquire('sampleId').release()
+        dead_lock.release()
+    
+    def test_should_renew_lease(self):
+        lock = self._lock_manager.acquire('sampleId')
+        rows = self._engine.execute(databaseleaselockmanager._item_lease.select()).fetchall()
+        self.assertEquals(1, len(rows))
+        self.assertTrue(self._lock_manager.renew('sampleId', rows[0]['owner']))
+        lock.release()
+        self.assertFalse(self._lock_manager.renew('sampleId', rows[0]['owner']))
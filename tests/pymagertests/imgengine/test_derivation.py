@@ -0,0 +1,114 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import with_statement
+import os
+import shutil
+import unittest
+import Image
+from pkg_resources import resource_filename
+from pymager.imgengine.impl import derivation
+from pymager.caching.impl.lrucache import LruCache
+
+JPG_SAMPLE_IMAGE_FILENAME = resource_filename('pymager.samples', 'sami.jpg')
+JPG_SAMPLE_IMAGE_SIZE = (3264, 2448)
+TARGET_DIRECTORY = '/tmp/pymager-test-derivations'
+
+class DerivationTestCase(unittest.TestCase):
+    def setUp(self):
+        if os.path.exists(TARGET_DIRECTORY):
+            shutil.rmtree(TARGET_DIRECTORY)
+    
+    def tearDown(self):
+        if os.path.exists(TARGET_DIRECTORY):
+            shutil.rmtree(TARGET_DIRECTORY)
+    
+    def test_draft_size_should_oversample_the_cropped_target(self):
+        self.assertEquals((267, 200), derivation.draft_size((800, 600), (100, 100)))
+        self.assertEquals((1600, 1200), derivation.draft_size((3200, 2400), (800, 600)))
+    
+    def test_draft_size_should_cover_the_most_constrained_dimension(self):
+        self.assertEquals((800, 600), derivation.draft_size((3200, 2400), (100, 300)))
+    
+    def test_should_derive_from_larger_derivative_with_same_aspect_ratio(self):
+        self.assertTrue(derivation.can_derive_from((3200, 2400), (800, 600), (100, 75), 2))
+        self.assertTrue(derivation.can_derive_from((3200, 2400), (800, 600), (100, 100), 2))
+    
+    def test_should_not_derive_from_derivative_that_does_not_have_enough_pixels(self):
+        self.assertFalse(derivation.can_derive_from((3200, 2400), (800, 600), (500, 500), 2))
+        self.assertTrue(derivation.can_derive_from((3200, 2400), (800, 600), (500, 500), 1))
+    
+    def test_should_not_derive_from_derivative_that_was_cropped_more_than_the_target(self):
+        # the square derivative lost the sides of the original, that the 4:3 target needs
+        self.assertFalse(derivation.can_derive_from((3200, 2400), (800, 800), (100, 75), 2))
+        self.assertFalse(derivation.can_derive_from((3200, 2400), (600, 800), (100, 100), 2))
+    
+    def test_should_produce_exact_size_when_jpeg_is_decoded_in_draft_mode(self):
+        for size in [(100, 100), (100, 300), (300, 100), (37, 1000), (1000, 37)]:
+            target_filename = os.path.join(TARGET_DIRECTORY, '%sx%s.jpg' % size)
+            derivation.derive(JPG_SAMPLE_IMAGE_FILENAME, target_filename, size, 'JPEG')
+            self.assertEquals(size, Image.open(target_filename).size)
+    
+    def test_should_derive_several_sizes_and_formats_at_once(self):
+        derivations = [(os.path.join(TARGET_DIRECTORY, '100x100.jpg'), (100, 100), 'JPEG'),
+                       (os.path.join(TARGET_DIRECTORY, '800x600.png'), (800, 600), 'PNG'),
+                       (os.path.join(TARGET_DIRECTORY, 'copy.jpg'), JPG_SAMPLE_IMAGE_SIZE, 'JPEG')]
+        self.assertEquals([target_filename for (target_filename, size, format) in derivations], 
+                          derivation.derive_all(JPG_SAMPLE_IMAGE_FILENAME, derivations))
+        for target_filename, size, format in derivations:
+            img = Image.open(target_filename)
+            self.assertEquals(size, img.size)
+            self.assertEquals(format, img.format)
+    
+    def test_should_return_encoded_images_that_are_written_to_target_files(self):
+        derivations = [(os.path.join(TARGET_DIRECTORY, '100x100.jpg'), (100, 100), 'JPEG'),
+                       (os.path.join(TARGET_DIRECTORY, 'copy.jpg'), JPG_SAMPLE_IMAGE_SIZE, 'JPEG')]
+        encoded_images = derivation.encode_all(JPG_SAMPLE_IMAGE_FILENAME, derivations)
+        self.assertEquals(len(derivations), len(encoded_images))
+        for (target_filename, size, format), encoded_image in zip(derivations, encoded_images):
+            with open(target_filename, 'rb') as f:
+                self.assertEquals(f.read(), encoded_image)
+    
+    def test_should_reuse_decoded_image(self):
+        decoded_images = LruCache(JPG_SAMPLE_IMAGE_SIZE[0] * JPG_SAMPLE_IMAGE_SIZE[1] * 3)
+        derivation.derive_all(JPG_SAMPLE_IMAGE_FILENAME, [(os.path.join(TARGET_DIRECTORY, '200x200.jpg'), (200, 200), 'JPEG')], decoded_images)
+        decoded_image = decoded_images.get(JPG_SAMPLE_IMAGE_FILENAME)
+        derivation.derive_all(JPG_SAMPLE_IMAGE_FILENAME, [(os.path.join(TARGET_DIRECTORY, '100x100.jpg'), (100, 100), 'JPEG')], decoded_images)
+        self.assertTrue(decoded_image is decoded_images.get(JPG_SAMPLE_IMAGE_FILENAME))
+        self.assertEquals((100, 100), Image.open(os.path.join(TARGET_DIRECTORY, '100x100.jpg')).size)
+    
+    def test_should_decode_again_when_decoded_image_is_too_small(self):
+        decoded_images = LruCache(JPG_SAMPLE_IMAGE_SIZE[0] * JPG_SAMPLE_IMAGE_SIZE[1] * 3)
+        derivation.derive_all(JPG_SAMPLE_IMAGE_FILENAME, [(os.path.join(TARGET_DIRECTORY, '100x100.jpg'), (100, 100), 'JPEG')], decoded_images)
+        small_decoded_image_size = decoded_images.get(JPG_SAMPLE_IMAGE_FILENAME).image.size
+        
+        derivation.derive_all(JPG_SAMPLE_IMAGE_FILENAME, [(os.path.join(TARGET_DIRECTORY, '1600x1200.jpg'), (1600, 1200), 'JPEG')], decoded_images)
+        self.assertEquals(JPG_SAMPLE_IMAGE_SIZE, decoded_images.get(JPG_SAMPLE_IMAGE_FILENAME).image.size)
+        self.assertTrue(small_decoded_image_size[0] < JPG_SAMPLE_IMAGE_SIZE[0])
+    
+    def test_should_not_leave_temporary_files(self):
+        derivation.derive(JPG_SAMPLE_IMAGE_FILENAME, os.path.join(TARGET_DIRECTORY, '100x100.jpg'), (100, 100), 'JPEG')
+        try:
+            derivation.derive(JPG_SAMPLE_IMAGE_FILENAME, os.path.join(TARGET_DIRECTORY, '100x100.unknown'), (100, 100), 'UNKNOWN')
+            self.fail()
+        except (IOError, KeyError):
+            pass
+        self.assertEquals(['100x100.jpg'], os.listdir(TARGET_DIRECTORY))
+    
+    def test_should_copy_image_when_size_and_format_are_the_same(self):
+        target_filename = os.path.join(TARGET_DIRECTORY, 'copy.jpg')
+        derivation.derive(JPG_SAMPLE_IMAGE_FILENAME, target_filename, JPG_SAMPLE_IMAGE_SIZE, 'JPEG')
+        self.assertEquals(os.path.getsize(JPG_SAMPLE_IMAGE_FILENAME), os.path.getsize(target_filename))
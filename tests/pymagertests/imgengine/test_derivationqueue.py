@@ -0,0 +1,83 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import unittest
+import threading
+from pymager.imgengine.impl.derivationqueue import DerivationQueue
+
+class DerivationQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        self._release_workers = threading.Event()
+        self._queue = DerivationQueue(1, 2)
+    
+    def tearDown(self):
+        self._release_workers.set()
+        self._queue.shutdown()
+    
+    def _blocking_task(self, calls, started=None):
+        def task():
+            if started is not None:
+                started.set()
+            self._release_workers.wait()
+            calls.append(1)
+        return task
+    
+    def _occupy_worker(self, calls):
+        started = threading.Event()
+        self.assertTrue(self._queue.submit('running', self._blocking_task(calls, started)))
+        started.wait()
+    
+    def test_should_execute_submitted_tasks(self):
+        calls = []
+        self._release_workers.set()
+        self.assertTrue(self._queue.submit('key1', self._blocking_task(calls)))
+        self.assertTrue(self._queue.submit('key2', self._blocking_task(calls)))
+        self._queue.join()
+        self.assertEquals(2, len(calls))
+        self.assertEquals(2, self._queue.statistics()['completed_tasks'])
+    
+    def test_should_not_queue_task_whose_key_is_already_pending(self):
+        calls = []
+        self._occupy_worker(calls)
+        self.assertTrue(self._queue.submit('key', self._blocking_task(calls)))
+        self.assertTrue(self._queue.submit('key', self._blocking_task(calls)))
+        self.assertEquals(1, self._queue.statistics()['pending_tasks'])
+        self._release_workers.set()
+        self._queue.join()
+        self.assertEquals(2, len(calls))
+    
+    def test_should_reject_tasks_when_queue_is_full(self):
+        calls = []
+        self._occupy_worker(calls)
+        self.assertTrue(self._queue.submit('key1', self._blocking_task(calls)))
+        self.assertTrue(self._queue.submit('key2', self._blocking_task(calls)))
+        self.assertFalse(self._queue.submit('key3', self._blocking_task(calls)))
+        
+        statistics = self._queue.statistics()
+        self.assertEquals(2, statistics['pending_tasks'])
+        self.assertEquals(1, statistics['running_tasks'])
+        self.assertEquals(1, statistics['rejected_tasks'])
+    
+    def test_failing_task_should_not_stop_worker(self):
+        calls = []
+        def failing_task():
+            raise IOError('broken image')
+        self._release_workers.set()
+        self._queue.submit('failing', failing_task)
+        self._queue.submit('key', self._blocking_task(calls))
+        self._queue.join()
+        self.assertEquals(1, len(calls))
+        self.assertEquals(1, self._queue.statistics()['failed_tasks'])
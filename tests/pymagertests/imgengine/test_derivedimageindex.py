@@ -0,0 +1,95 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import time
+import unittest
+from zope.interface import implements
+from pymager import domain
+from pymager.imgengine.impl.derivedimageindex import DerivedImageIndex
+from pymager.resources.impl.nestedpathgenerator import NestedPathGenerator
+from tests.pymagertests.resources.fake_image_format_mapper import FakeImageFormatMapper
+
+class DerivedImageIdsRepository(object):
+    implements(domain.ImageMetadataRepository)
+    
+    def __init__(self, ids):
+        self.ids = ids
+        self.loads = 0
+    
+    def find_derived_image_metadata_ids_by_status(self, status):
+        assert status == domain.STATUS_OK
+        self.loads += 1
+        return list(self.ids)
+
+class UnavailableRepository(object):
+    implements(domain.ImageMetadataRepository)
+    
+    def find_derived_image_metadata_ids_by_status(self, status):
+        raise Exception('database is down')
+
+class DerivedImageIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self._repository = DerivedImageIdsRepository(['a-100x100-JPEG'])
+        self._path_generator = NestedPathGenerator(FakeImageFormatMapper(), '/tmp/pymager-test')
+    
+    def _index(self, repository, rebuild_seconds=3600):
+        return DerivedImageIndex(repository, self._path_generator, rebuild_seconds)
+    
+    def test_should_load_ids_on_first_lookup(self):
+        index = self._index(self._repository)
+        self.assertTrue('a-100x100-JPEG' in index)
+        self.assertFalse('b-100x100-JPEG' in index)
+        self.assertEquals(1, self._repository.loads)
+        self.assertEquals({'entries': 1, 'hits': 1, 'misses': 1}, index.statistics())
+    
+    def test_should_add_and_discard_ids(self):
+        index = self._index(self._repository)
+        index.rebuild()
+        index.add('b-100x100-JPEG', 'b.jpg')
+        index.discard('a-100x100-JPEG')
+        self.assertFalse('a-100x100-JPEG' in index)
+        self.assertTrue('b-100x100-JPEG' in index)
+        self.assertEquals('b.jpg', index.get('b-100x100-JPEG'))
+        self.assertEquals(None, index.get('a-100x100-JPEG'))
+    
+    def test_should_reload_ids_once_expired(self):
+        index = self._index(self._repository, -1)
+        index.rebuild()
+        self._repository.ids = ['b-100x100-JPEG']
+        # reloaded in the background
+        deadline = time.time() + 5
+        while 'b-100x100-JPEG' not in index and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertFalse('a-100x100-JPEG' in index)
+        self.assertTrue('b-100x100-JPEG' in index)
+    
+    def test_should_load_paths_of_derived_images(self):
+        index = self._index(DerivedImageIdsRepository(['my-id-100x200-JPEG']))
+        derived_image_metadata = domain.DerivedImageMetadata(domain.STATUS_OK, (100, 200), domain.IMAGE_FORMAT_JPEG, 
+                                                             domain.OriginalImageMetadata('my-id', domain.STATUS_OK, (800, 600), domain.IMAGE_FORMAT_JPEG))
+        self.assertEquals(self._path_generator.derived_path(derived_image_metadata).relative(), index.get('my-id-100x200-JPEG'))
+    
+    def test_should_not_reload_ids_when_rebuild_is_disabled(self):
+        index = self._index(self._repository, 0)
+        index.rebuild()
+        self._repository.ids = []
+        self.assertTrue('a-100x100-JPEG' in index)
+        self.assertEquals(1, self._repository.loads)
+    
+    def test_should_report_misses_when_database_is_down(self):
+        index = self._index(UnavailableRepository())
+        self.assertFalse('a-100x100-JPEG' in index)
+        self.assertEquals(None, index.statistics()['entries'])
@@ -0,0 +1,144 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from pymager import domain
+from pymager.imgengine.impl.derivedimagetiers import DerivedImageTiers
+from pymager.resources.impl.nestedpathgenerator import NestedPathGenerator
+from pymager.resources.impl.tieredpathgenerator import TieredPathGenerator
+from tests.pymagertests.resources.fake_image_format_mapper import FakeImageFormatMapper
+
+class DerivedImageTiersTestCase(unittest.TestCase):
+    def setUp(self):
+        self._data_directory = tempfile.mkdtemp()
+        self._hot_directory = tempfile.mkdtemp()
+        self._path_generator = TieredPathGenerator(NestedPathGenerator(FakeImageFormatMapper(), self._data_directory))
+        self._original_image_metadata = domain.OriginalImageMetadata('sampleId', domain.STATUS_OK, (800, 600), domain.IMAGE_FORMAT_JPEG)
+    
+    def tearDown(self):
+        shutil.rmtree(self._data_directory)
+        shutil.rmtree(self._hot_directory)
+    
+    def _tiers(self, hot_max_bytes, promotion_accesses=2):
+        tiers = DerivedImageTiers(self._path_generator, self._data_directory, self._hot_directory, hot_max_bytes, promotion_accesses, 3600)
+        tiers.start()
+        return tiers
+    
+    def _derived_image_metadata(self, width):
+        return domain.DerivedImageMetadata(domain.STATUS_OK, (width, width), domain.IMAGE_FORMAT_JPEG, self._original_image_metadata)
+    
+    def _create(self, derived_image_metadata, size=10, path=None):
+        path = (path if path is not None else self._path_generator.derived_path(derived_image_metadata)).absolute()
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write('x' * size)
+    
+    def _is_hot(self, derived_image_metadata):
+        return os.path.exists(self._path_generator.hot_derived_path(derived_image_metadata).absolute()) \
+            and not os.path.exists(self._path_generator.main_derived_path(derived_image_metadata).absolute())
+    
+    def _is_cold(self, derived_image_metadata):
+        return os.path.exists(self._path_generator.main_derived_path(derived_image_metadata).absolute()) \
+            and not os.path.exists(self._path_generator.hot_derived_path(derived_image_metadata).absolute())
+    
+    def test_should_link_hot_tier_into_data_directory(self):
+        tiers = self._tiers(100)
+        try:
+            self.assertEquals(os.path.realpath(self._hot_directory), os.path.realpath(os.path.join(self._data_directory, 'hot')))
+        finally:
+            tiers.shutdown()
+    
+    def test_should_demote_least_accessed_derived_images(self):
+        tiers = self._tiers(15)
+        try:
+            hot, cold = self._derived_image_metadata(100), self._derived_image_metadata(200)
+            self._create(hot)
+            self._create(cold)
+            tiers.record_access(hot)
+            self.assertEquals((0, 1), tiers.rebalance())
+            tiers.shutdown()
+            self.assertTrue(self._is_hot(hot))
+            self.assertTrue(self._is_cold(cold))
+            self.assertEquals(10, tiers.statistics()['hot_bytes'])
+        finally:
+            tiers.shutdown()
+    
+    def test_should_promote_frequently_accessed_derived_images(self):
+        tiers = self._tiers(15)
+        try:
+            derived_image_metadata = self._derived_image_metadata(100)
+            self._create(derived_image_metadata, path=self._path_generator.main_derived_path(derived_image_metadata))
+            tiers.record_access(derived_image_metadata)
+            self.assertEquals((0, 0), tiers.rebalance())
+            tiers.record_access(derived_image_metadata)
+            tiers.record_access(derived_image_metadata)
+            self.assertEquals((1, 0), tiers.rebalance())
+            tiers.shutdown()
+            self.assertTrue(self._is_hot(derived_image_metadata))
+        finally:
+            tiers.shutdown()
+    
+    def test_hotter_derived_images_should_replace_colder_ones(self):
+        tiers = self._tiers(15)
+        try:
+            cold, hot = self._derived_image_metadata(100), self._derived_image_metadata(200)
+            self._create(cold)
+            self._create(hot, path=self._path_generator.main_derived_path(hot))
+            for i in range(2):
+                tiers.record_access(hot)
+            self.assertEquals((1, 1), tiers.rebalance())
+            tiers.shutdown()
+            self.assertTrue(self._is_hot(hot))
+            self.assertTrue(self._is_cold(cold))
+        finally:
+            tiers.shutdown()
+    
+    def test_should_keep_previous_file_of_moved_derived_image_until_next_rebalancing(self):
+        tiers = self._tiers(15)
+        try:
+            derived_image_metadata = self._derived_image_metadata(100)
+            self._create(derived_image_metadata, path=self._path_generator.main_derived_path(derived_image_metadata))
+            main_derived_path = self._path_generator.main_derived_path(derived_image_metadata).absolute()
+            for i in range(2):
+                tiers.record_access(derived_image_metadata)
+            self.assertEquals((1, 0), tiers.rebalance())
+            self.assertTrue(os.path.exists(main_derived_path))
+            self.assertEquals(self._path_generator.hot_derived_path(derived_image_metadata).relative(), 
+                              self._path_generator.derived_path(derived_image_metadata).relative())
+            self.assertEquals((0, 0), tiers.rebalance())
+            self.assertTrue(self._is_hot(derived_image_metadata))
+        finally:
+            tiers.shutdown()
+    
+    def test_should_not_remove_derived_image_created_again_after_it_moved(self):
+        tiers = self._tiers(15)
+        try:
+            derived_image_metadata = self._derived_image_metadata(100)
+            self._create(derived_image_metadata, path=self._path_generator.main_derived_path(derived_image_metadata))
+            main_derived_path = self._path_generator.main_derived_path(derived_image_metadata).absolute()
+            for i in range(2):
+                tiers.record_access(derived_image_metadata)
+            self.assertEquals((1, 0), tiers.rebalance())
+            os.remove(main_derived_path)
+            with open(main_derived_path, 'w') as f:
+                f.write('y' * 10)
+            tiers.rebalance()
+            self.assertTrue(os.path.exists(main_derived_path))
+        finally:
+            tiers.shutdown()
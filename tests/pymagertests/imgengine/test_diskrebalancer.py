@@ -0,0 +1,57 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from pymager import domain
+from pymager.imgengine.impl.diskrebalancer import DiskRebalancer
+from pymager.resources.impl.stripedpathgenerator import StripedPathGenerator, link_disks
+from tests.pymagertests.resources.fake_image_format_mapper import FakeImageFormatMapper
+from tests.pymagertests import objectmothers
+
+class DiskRebalancerTestCase(unittest.TestCase):
+    def setUp(self):
+        self._data_directory = tempfile.mkdtemp()
+        self._disk_directories = [os.path.join(self._data_directory, 'disk%s' % disk) for disk in range(2)]
+        link_disks(self._data_directory, self._disk_directories)
+        original_image_metadata = objectmothers.original_yemmagouraya_metadata()
+        self._derived_image_metadatas = [domain.DerivedImageMetadata(domain.STATUS_OK, (100 * i, 100 * i), domain.IMAGE_FORMAT_JPEG, original_image_metadata) for i in range(1, 9)]
+    
+    def tearDown(self):
+        shutil.rmtree(self._data_directory)
+    
+    def _write(self, path):
+        os.makedirs(os.path.dirname(path.absolute()))
+        with open(path.absolute(), 'w') as f:
+            f.write('data')
+    
+    def test_should_move_images_to_added_disk(self):
+        path_generator = StripedPathGenerator(FakeImageFormatMapper(), self._data_directory, 1)
+        for derived_image_metadata in self._derived_image_metadatas:
+            self._write(path_generator.derived_path(derived_image_metadata))
+        
+        larger_path_generator = StripedPathGenerator(FakeImageFormatMapper(), self._data_directory, 2)
+        moved = len([d for d in self._derived_image_metadatas if larger_path_generator.derived_paths(d)[0].relative().startswith(os.path.join('disks', '1'))])
+        self.assertTrue(moved > 0)
+        self.assertEquals(moved, DiskRebalancer(larger_path_generator, self._data_directory, 2).rebalance())
+        for derived_image_metadata in self._derived_image_metadatas:
+            derived_paths = larger_path_generator.derived_paths(derived_image_metadata)
+            self.assertTrue(os.path.exists(derived_paths[0].absolute()))
+            self.assertFalse(os.path.exists(derived_paths[1].absolute()))
+            self.assertEquals('data', open(derived_paths[0].absolute()).read())
+        self.assertEquals(0, DiskRebalancer(larger_path_generator, self._data_directory, 2).rebalance())
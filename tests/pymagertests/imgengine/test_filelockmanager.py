@@ -0,0 +1,66 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import os
+import shutil
+import threading
+import unittest
+from pymager import imgengine
+from pymager.imgengine.impl.filelockmanager import FileLockManager
+
+LOCK_DIRECTORY = '/tmp/pymager-test-locks'
+
+class FileLockManagerTestCase(unittest.TestCase):
+    def setUp(self):
+        if os.path.exists(LOCK_DIRECTORY):
+            shutil.rmtree(LOCK_DIRECTORY)
+        self._lock_manager = FileLockManager(LOCK_DIRECTORY, timeout_seconds=0.2)
+    
+    def tearDown(self):
+        if os.path.exists(LOCK_DIRECTORY):
+            shutil.rmtree(LOCK_DIRECTORY)
+    
+    def test_should_acquire_and_release_lock(self):
+        lock = self._lock_manager.acquire('sampleId')
+        lock.release()
+        self._lock_manager.acquire('sampleId').release()
+    
+    def test_should_remove_lock_file_on_release(self):
+        self._lock_manager.acquire('sampleId').release()
+        self.assertEquals([], os.listdir(LOCK_DIRECTORY))
+    
+    def test_should_not_acquire_lock_held_by_somebody_else(self):
+        lock = self._lock_manager.acquire('sampleId')
+        try:
+            self._lock_manager.acquire('sampleId')
+            self.fail()
+        except imgengine.LockTimeoutException, ex:
+            self.assertEquals('sampleId', ex.key)
+        finally:
+            lock.release()
+    
+    def test_should_acquire_locks_with_different_keys(self):
+        lock = self._lock_manager.acquire('sampleId')
+        self._lock_manager.acquire('anotherId').release()
+        lock.release()
+    
+    def test_should_wait_for_lock_to_be_released(self):
+        lock_manager = FileLockManager(LOCK_DIRECTORY, timeout_seconds=5)
+        lock = lock_manager.acquire('sampleId')
+        timer = threading.Timer(0.2, lock.release)
+        timer.start()
+        lock_manager.acquire('sampleId').release()
+        timer.join()
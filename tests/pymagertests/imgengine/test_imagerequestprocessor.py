@@ -17,12 +17,21 @@
 from __future__ import with_statement
 import unittest
 import os
+import shutil
 import time
 import random
 import exceptions
+from StringIO import StringIO
+import Image
 from threading import Thread
+from zope.interface import implements
+import mox
+from mox import IgnoreArg
 from pkg_resources import resource_filename
-from pymager import imgengine, domain
+from pymager import imgengine, domain, persistence
+from pymager.persistence import _transactional
+from pymager.imgengine.impl.inlinederivationexecutor import InlineDerivationExecutor
+from pymager.imgengine.impl.derivedimagetiers import DerivedImageTiers
 from tests.pymagertests.abstractintegrationtestcase import AbstractIntegrationTestCase
 
 #JPG_SAMPLE_IMAGE_FILENAME = os.path.join('..', '..', 'samples', 'sami.jpg')
@@ -47,6 +56,23 @@ class ImageRequestProcessorTestCase(AbstractIntegrationTestCase):
         except imgengine.ImageStreamNotRecognizedException, ex:
             pass
     
+    def test_should_save_file_that_has_already_been_read(self):
+        with open(JPG_SAMPLE_IMAGE_FILENAME, 'rb') as fobj:
+            fobj.read(1000)
+            self._image_server.save_file_to_repository(fobj, 'sampleId')
+        with open(os.path.join(AbstractIntegrationTestCase.DATA_DIRECTORY, self._image_server.get_original_image_path('sampleId')), 'rb') as f:
+            self.assertEquals(os.path.getsize(JPG_SAMPLE_IMAGE_FILENAME), len(f.read()))
+    
+    def test_should_not_save_truncated_image(self):
+        png = StringIO()
+        Image.open(JPG_SAMPLE_IMAGE_FILENAME).resize((300, 200)).save(png, 'PNG')
+        try:
+            self._image_server.save_file_to_repository(StringIO(png.getvalue()[:len(png.getvalue()) / 2]), 'sampleId')
+            self.fail()
+        except imgengine.ImageStreamNotRecognizedException, ex:
+            pass
+        self._sample_original_image_should_not_be_present()
+    
     def test_should_not_save_image_with_existing_id(self):
         self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
         try:
@@ -106,6 +132,65 @@ class ImageRequestProcessorTestCase(AbstractIntegrationTestCase):
         result2 = self._image_server.prepare_transformation(request)
         self.assertEquals(result, result2)
     
+    def test_saving_and_deleting_image_should_notify_listeners(self):
+        saved = []
+        deleted = []
+        class Listener(object):
+            implements(imgengine.ImageMetadataListener)
+            def image_metadata_saved(self, image_metadata_id):
+                saved.append(image_metadata_id)
+            def image_metadata_deleted(self, image_metadata_id):
+                deleted.append(image_metadata_id)
+        self._image_server.add_listener(Listener())
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        self.assertEquals(['sampleId', 'sampleId'], saved)
+        self._image_server.prepare_transformation(imgengine.TransformationRequest(self._image_format_mapper, 'sampleId', (100, 100), domain.IMAGE_FORMAT_JPEG))
+        
+        self._image_server.delete('sampleId')
+        self.assertEquals(['sampleId-100x100-JPEG', 'sampleId'], deleted)
+    
+    def test_find_transformation_should_not_prepare_transformation(self):
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        request = imgengine.TransformationRequest(self._image_format_mapper, 'sampleId', (100, 100), domain.IMAGE_FORMAT_JPEG)
+        
+        self.assertEquals(None, self._image_server.find_transformation(request))
+        self._sample_100x100_image_should_not_be_present()
+        self.assertEquals(self._image_server.prepare_transformation(request), self._image_server.find_transformation(request))
+    
+    def test_prepare_placeholder_should_create_image_of_requested_size_and_format(self):
+        request = imgengine.TransformationRequest(self._image_format_mapper, 'anyId', (300, 300), 'PNG')
+        path = self._image_server.prepare_placeholder(request)
+        
+        img = Image.open(os.path.join(AbstractIntegrationTestCase.DATA_DIRECTORY, path))
+        self.assertEquals((300, 300), img.size)
+        self.assertEquals('PNG', img.format)
+        self.assertEquals(path, self._image_server.prepare_placeholder(request))
+    
+    def test_pregenerate_should_create_all_sizes_and_formats(self):
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        
+        paths = self._image_server.pregenerate('sampleId', [(100, 100), (800, 600)], [domain.IMAGE_FORMAT_JPEG, 'PNG'])
+        self.assertEquals(4, len(paths))
+        for size in [(100, 100), (800, 600)]:
+            for format in [domain.IMAGE_FORMAT_JPEG, 'PNG']:
+                derived_image_metadata = self._image_metadata_repository.find_derived_image_metadata_by_original_image_metadata_id_size_and_format('sampleId', size, format)
+                self.assertEquals(domain.STATUS_OK, derived_image_metadata.status)
+                self._derived_image_should_exist(derived_image_metadata)
+    
+    def test_pregenerate_should_skip_existing_derived_images(self):
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        request = imgengine.TransformationRequest(self._image_format_mapper, 'sampleId', (100, 100), domain.IMAGE_FORMAT_JPEG)
+        self._image_server.prepare_transformation(request)
+        
+        self.assertEquals([], self._image_server.pregenerate('sampleId', [(100, 100)], [domain.IMAGE_FORMAT_JPEG]))
+    
+    def test_should_not_pregenerate_when_id_does_not_exist(self):
+        try:
+            self._image_server.pregenerate('nonexisting', [(100, 100)], [domain.IMAGE_FORMAT_JPEG])
+            self.fail()
+        except imgengine.ImageMetadataNotFoundException, ex:
+            self.assertEquals('nonexisting', ex.image_id)
+    
     def test_cleanup_should_delete_inconsistent_original_and_derived_image_metadatas(self):    
         # create 10 original items and 4 derived items per original items 
         for i in range(1, 11):
@@ -192,6 +277,41 @@ class ImageRequestProcessorTestCase(AbstractIntegrationTestCase):
         self._sample_100x100_image_should_not_be_present()
         self._sample_200x200_image_should_not_be_present()
     
+    def test_should_save_image_received_in_chunks(self):
+        with open(JPG_SAMPLE_IMAGE_FILENAME, 'rb') as f:
+            data = f.read()
+        self._image_server.save_stream_to_repository([data[i:i + 1000] for i in range(0, len(data), 1000)], 'sampleId')
+        
+        with open(os.path.join(AbstractIntegrationTestCase.DATA_DIRECTORY, self._image_server.get_original_image_path('sampleId')), 'rb') as f:
+            self.assertEquals(data, f.read())
+        original_image_metadata = self._image_metadata_repository.find_original_image_metadata_by_id('sampleId')
+        self.assertEquals(domain.IMAGE_FORMAT_JPEG, original_image_metadata.format)
+        self.assertEquals(JPG_SAMPLE_IMAGE_SIZE, original_image_metadata.size)
+    
+    def test_derived_image_etag_should_change_when_image_id_is_reused(self):
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        request = imgengine.TransformationRequest(self._image_format_mapper, 'sampleId', (100, 100), domain.IMAGE_FORMAT_JPEG)
+        self.assertEquals(None, self._image_server.get_derived_image_etag(request))
+        self._image_server.prepare_transformation(request)
+        etag = self._image_server.get_derived_image_etag(request)
+        self.assertEquals(etag, self._image_server.get_derived_image_etag(request))
+        
+        self._image_server.delete('sampleId')
+        self.assertEquals(None, self._image_server.get_derived_image_etag(request))
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        self._image_server.prepare_transformation(request)
+        self.assertNotEquals(etag, self._image_server.get_derived_image_etag(request))
+    
+    def test_should_return_derived_image_that_has_just_been_encoded(self):
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        request = imgengine.TransformationRequest(self._image_format_mapper, 'sampleId', (100, 100), domain.IMAGE_FORMAT_JPEG)
+        relative_path, encoded_image = self._image_server.prepare_encoded_transformation(request)
+        with open(os.path.join(AbstractIntegrationTestCase.DATA_DIRECTORY, relative_path), 'rb') as f:
+            self.assertEquals(f.read(), encoded_image.body)
+        self.assertEquals(os.path.getmtime(os.path.join(AbstractIntegrationTestCase.DATA_DIRECTORY, relative_path)), encoded_image.modification_time)
+        
+        self.assertEquals((relative_path, None), self._image_server.prepare_encoded_transformation(request))
+    
     def _sample_original_image_should_not_be_present(self):
         assert self._image_metadata_repository.find_original_image_metadata_by_id('sampleId') is None
             
@@ -200,4 +320,589 @@ class ImageRequestProcessorTestCase(AbstractIntegrationTestCase):
     
     def _sample_200x200_image_should_not_be_present(self):
         assert self._image_metadata_repository.find_derived_image_metadata_by_original_image_metadata_id_size_and_format('sampleId', (200, 200), domain.IMAGE_FORMAT_JPEG) is None
+
+class FailingDerivationExecutor(object):
+    """ writes a partial image, and fails """
+    implements(imgengine.DerivationExecutor)
+    
+    def encode_all(self, source_filename, derivations):
+        for target_filename, size, target_format in derivations:
+            if not os.path.exists(os.path.dirname(target_filename)):
+                os.makedirs(os.path.dirname(target_filename))
+            with open(target_filename, 'wb') as f:
+                f.write('partial')
+        raise imgengine.ImageProcessingException('resize failed')
+    
+    def forget(self, source_filename):
+        pass
+    
+    def shutdown(self):
+        pass
+
+class SessionCheckingDerivationExecutor(object):
+    """ records whether a session is bound to the thread, and whether the database can be used, while it derives """
+    implements(imgengine.DerivationExecutor)
+    
+    def __init__(self, image_metadata_repository):
+        self.__image_metadata_repository = image_metadata_repository
+        self.__derivation_executor = InlineDerivationExecutor()
+        self.sessions_bound = []
+        self.database_used = []
+    
+    def derive(self, source_filename, target_filename, size, target_format):
+        return self.encode_all(source_filename, [(target_filename, size, target_format)])[0]
+    
+    def encode_all(self, source_filename, derivations):
+        self.sessions_bound.append(_transactional._session_exists())
+        try:
+            self.__image_metadata_repository.find_original_image_metadata_by_id('sampleId')
+            self.database_used.append(True)
+        except persistence.OutsideSessionException:
+            self.database_used.append(False)
+        return self.__derivation_executor.encode_all(source_filename, derivations)
+    
+    def forget(self, source_filename):
+        pass
+    
+    def shutdown(self):
+        pass
+
+class SourceDeletingDerivationExecutor(object):
+    """ deletes the first source it is asked to derive images from, as if it had been collected while it was read """
+    implements(imgengine.DerivationExecutor)
+    
+    def __init__(self):
+        self.__derivation_executor = InlineDerivationExecutor()
+        self.source_filenames = []
+    
+    def encode_all(self, source_filename, derivations):
+        self.source_filenames.append(source_filename)
+        if len(self.source_filenames) == 1:
+            os.remove(source_filename)
+        return self.__derivation_executor.encode_all(source_filename, derivations)
+    
+    def forget(self, source_filename):
+        pass
+    
+    def shutdown(self):
+        pass
+
+class UnreadableCopyStream(object):
+    """ a file-like object whose header can be read, but fails when its last bytes are read """
+    def __init__(self, fobj):
+        self.__fobj = fobj
+        self.__size = os.path.getsize(fobj.name)
+        self.__bytes_read = 0
+    
+    def read(self, *args):
+        data = self.__fobj.read(*args)
+        self.__bytes_read += len(data)
+        if self.__bytes_read >= self.__size:
+            raise IOError('connection reset')
+        return data
+    
+    def __getattr__(self, name):
+        return getattr(self.__fobj, name)
+
+class CountingLockManager(object):
+    """ records the largest number of locks that are held at the same time """
+    implements(imgengine.LockManager)
+    
+    def __init__(self, lock_manager):
+        self.__lock_manager = lock_manager
+        self.held_locks = 0
+        self.max_held_locks = 0
+    
+    def acquire(self, key):
+        lock = self.__lock_manager.acquire(key)
+        self.held_locks += 1
+        self.max_held_locks = max(self.max_held_locks, self.held_locks)
+        release = lock.release
+        def counting_release():
+            self.held_locks -= 1
+            release()
+        lock.release = counting_release
+        return lock
+
+class ShortTransactionsImageRequestProcessorTestCase(AbstractIntegrationTestCase):
+    CONFIGURATION_OPTIONS = {'lock_timeout_seconds': 0.2}
+    
+    def onSetUp(self):
+        self._image_format_mapper = self._image_server_factory.image_format_mapper
+        self._path_generator = self._image_server_factory.path_generator
+        self._lock_manager = self._image_server_factory.lock_manager
+        self._request = imgengine.TransformationRequest(self._image_format_mapper, 'sampleId', (100, 100), domain.IMAGE_FORMAT_JPEG)
+    
+    def _image_server_with_derivation_executor(self, derivation_executor, image_metadata_repository=None):
+        from pymager.imgengine.impl.defaultimagerequestprocessor import DefaultImageRequestProcessor
+        return DefaultImageRequestProcessor(image_metadata_repository if image_metadata_repository is not None else self._image_metadata_repository, 
+                                            self._path_generator, self._image_format_mapper, 
+                                            self._image_server_factory.schema_migrator, AbstractIntegrationTestCase.DATA_DIRECTORY, 
+                                            self._image_server_factory.session_template, lock_manager=self._lock_manager,
+                                            derivation_executor=derivation_executor)
+    
+    def _derived_image_metadata(self):
+        return self._image_metadata_repository.find_derived_image_metadata_by_original_image_metadata_id_size_and_format('sampleId', (100, 100), domain.IMAGE_FORMAT_JPEG)
+    
+    def test_failed_derivation_should_not_leave_partial_file(self):
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        try:
+            self._image_server_with_derivation_executor(FailingDerivationExecutor()).prepare_transformation(self._request)
+            self.fail()
+        except imgengine.ImageProcessingException:
+            pass
+        self.assertEquals(domain.STATUS_INCONSISTENT, self._derived_image_metadata().status)
+        self.assertEquals(None, self._image_server.find_transformation(self._request))
+    
+    def test_should_repair_derived_image_after_failed_derivation(self):
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        try:
+            self._image_server_with_derivation_executor(FailingDerivationExecutor()).prepare_transformation(self._request)
+        except imgengine.ImageProcessingException:
+            pass
+        path = self._image_server.prepare_transformation(self._request)
+        self.assertEquals(domain.STATUS_OK, self._derived_image_metadata().status)
+        self.assertEquals((100, 100), Image.open(os.path.join(AbstractIntegrationTestCase.DATA_DIRECTORY, path)).size)
+    
+    def test_pregenerate_should_hold_one_lock_at_a_time(self):
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        from pymager.imgengine.impl.defaultimagerequestprocessor import DefaultImageRequestProcessor
+        lock_manager = CountingLockManager(self._lock_manager)
+        image_server = DefaultImageRequestProcessor(self._image_metadata_repository, self._path_generator, self._image_format_mapper, 
+                                                    self._image_server_factory.schema_migrator, AbstractIntegrationTestCase.DATA_DIRECTORY, 
+                                                    self._image_server_factory.session_template, lock_manager=lock_manager)
+        
+        paths = image_server.pregenerate('sampleId', [(100, 100), (800, 600)], [domain.IMAGE_FORMAT_JPEG, 'PNG'])
+        
+        self.assertEquals(4, len(paths))
+        self.assertEquals(1, lock_manager.max_held_locks)
+        self.assertEquals(0, lock_manager.held_locks)
+        self.assertEquals((100, 100), Image.open(os.path.join(AbstractIntegrationTestCase.DATA_DIRECTORY, paths[0])).size)
+    
+    def test_cleanup_should_not_delete_items_that_are_being_created(self):
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        try:
+            self._image_server_with_derivation_executor(FailingDerivationExecutor()).prepare_transformation(self._request)
+        except imgengine.ImageProcessingException:
+            pass
+        lock = self._lock_manager.acquire(self._derived_image_metadata().id)
+        try:
+            self._image_server.cleanup_inconsistent_items()
+        finally:
+            lock.release()
+        self.assertNotEquals(None, self._derived_image_metadata())
+        
+        self._image_server.cleanup_inconsistent_items()
+        self.assertEquals(None, self._derived_image_metadata())
+    
+    def test_cached_derived_image_should_be_served_without_database(self):
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        path = self._image_server.prepare_transformation(self._request)
+        
+        mocker = mox.Mox()
+        image_metadata_repository = mocker.CreateMockAnything()
+        image_metadata_repository.__conform__(IgnoreArg()).InAnyOrder().AndReturn(image_metadata_repository)
+        # startup cleanup only
+        image_metadata_repository.find_inconsistent_derived_image_metadatas().AndReturn([])
+        image_metadata_repository.find_inconsistent_original_image_metadatas().AndReturn([])
+        mocker.ReplayAll()
+        
+        image_server = self._image_server_with_derivation_executor(FailingDerivationExecutor(), image_metadata_repository)
+        self.assertEquals(path, image_server.prepare_transformation(self._request))
+        self.assertEquals(path, image_server.find_transformation(self._request))
+        mocker.VerifyAll()
+    
+    def test_images_should_be_derived_outside_of_the_session(self):
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        derivation_executor = SessionCheckingDerivationExecutor(self._image_metadata_repository)
+        self._image_server_with_derivation_executor(derivation_executor).prepare_transformation(self._request)
+        self.assertEquals([False], derivation_executor.sessions_bound)
+        self.assertEquals([False], derivation_executor.database_used)
+        self.assertTrue(_transactional._session_exists())
+        self.assertEquals(domain.STATUS_OK, self._derived_image_metadata().status)
+    
+    def test_failed_save_should_not_keep_image_id(self):
+        with open(JPG_SAMPLE_IMAGE_FILENAME, 'rb') as fobj:
+            try:
+                self._image_server.save_file_to_repository(UnreadableCopyStream(fobj), 'sampleId')
+                self.fail()
+            except imgengine.ImageProcessingException:
+                pass
+        self.assertEquals(None, self._image_metadata_repository.find_original_image_metadata_by_id('sampleId'))
+        for directory, directories, filenames in os.walk(AbstractIntegrationTestCase.DATA_DIRECTORY):
+            self.assertEquals([], [f for f in filenames if f.endswith('.tmp')])
+
+class MezzanineImageRequestProcessorTestCase(AbstractIntegrationTestCase):
+    CONFIGURATION_OPTIONS = {'mezzanine_max_size': 1024}
+    
+    def onSetUp(self):
+        self._image_format_mapper = self._image_server_factory.image_format_mapper
+        self._path_generator = self._image_server_factory.path_generator
+    
+    def _mezzanine_filename(self):
+        return self._path_generator.mezzanine_path(self._image_metadata_repository.find_original_image_metadata_by_id('sampleId')).absolute()
+    
+    def test_saving_image_should_create_mezzanine(self):
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        self.assertEquals((1024, 768), Image.open(self._mezzanine_filename()).size)
+    
+    def test_mezzanine_should_be_encoded_at_high_quality_without_chroma_subsampling(self):
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        mezzanine = Image.open(self._mezzanine_filename())
+        self.assertEquals('JPEG', mezzanine.format)
+        self.assertEquals([1], list(set([layer[1] for layer in mezzanine.layer] + [layer[2] for layer in mezzanine.layer])))
+        self.assertTrue(max(mezzanine.quantization[0]) <= 12)
+    
+    def test_should_derive_image_from_mezzanine(self):
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        os.remove(self._path_generator.original_path(self._image_metadata_repository.find_original_image_metadata_by_id('sampleId')).absolute())
+        
+        path = self._image_server.prepare_transformation(imgengine.TransformationRequest(self._image_format_mapper, 'sampleId', (400, 400), domain.IMAGE_FORMAT_JPEG))
+        self.assertTrue(os.path.exists(os.path.join(AbstractIntegrationTestCase.DATA_DIRECTORY, path)))
+    
+    def test_should_not_derive_image_from_mezzanine_that_is_too_small(self):
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        os.remove(self._path_generator.original_path(self._image_metadata_repository.find_original_image_metadata_by_id('sampleId')).absolute())
+        try:
+            self._image_server.prepare_transformation(imgengine.TransformationRequest(self._image_format_mapper, 'sampleId', (800, 800), domain.IMAGE_FORMAT_JPEG))
+            self.fail()
+        except imgengine.ImageProcessingException:
+            pass
+    
+    def test_deleting_image_should_delete_mezzanine(self):
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        mezzanine_filename = self._mezzanine_filename()
+        self._image_server.delete('sampleId')
+        self.assertFalse(os.path.exists(mezzanine_filename))
+
+class DerivativeSourceImageRequestProcessorTestCase(AbstractIntegrationTestCase):
+    CONFIGURATION_OPTIONS = {'derivative_source_ratio': 2}
+    
+    def onSetUp(self):
+        self._image_format_mapper = self._image_server_factory.image_format_mapper
+        self._path_generator = self._image_server_factory.path_generator
+    
+    def test_should_derive_image_from_larger_derived_image(self):
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        self._image_server.prepare_transformation(imgengine.TransformationRequest(self._image_format_mapper, 'sampleId', (800, 800), domain.IMAGE_FORMAT_JPEG))
+        # the original is not needed anymore
+        original_image_metadata = self._image_metadata_repository.find_original_image_metadata_by_id('sampleId')
+        os.remove(self._path_generator.original_path(original_image_metadata).absolute())
+        
+        path = self._image_server.prepare_transformation(imgengine.TransformationRequest(self._image_format_mapper, 'sampleId', (100, 100), domain.IMAGE_FORMAT_JPEG))
+        self.assertTrue(os.path.exists(os.path.join(AbstractIntegrationTestCase.DATA_DIRECTORY, path)))
+    
+    def test_should_derive_image_from_original_when_larger_derived_image_disappears(self):
+        from pymager.imgengine.impl.defaultimagerequestprocessor import DefaultImageRequestProcessor
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        self._image_server.prepare_transformation(imgengine.TransformationRequest(self._image_format_mapper, 'sampleId', (800, 800), domain.IMAGE_FORMAT_JPEG))
+        derivation_executor = SourceDeletingDerivationExecutor()
+        image_server = DefaultImageRequestProcessor(self._image_metadata_repository, self._path_generator, self._image_format_mapper, 
+                                                    self._image_server_factory.schema_migrator, AbstractIntegrationTestCase.DATA_DIRECTORY, 
+                                                    self._image_server_factory.session_template, lock_manager=self._image_server_factory.lock_manager,
+                                                    derivation_executor=derivation_executor, derivative_source_ratio=2)
+        
+        path = image_server.prepare_transformation(imgengine.TransformationRequest(self._image_format_mapper, 'sampleId', (100, 100), domain.IMAGE_FORMAT_JPEG))
+        original_image_metadata = self._image_metadata_repository.find_original_image_metadata_by_id('sampleId')
+        self.assertEquals(2, len(derivation_executor.source_filenames))
+        self.assertEquals(self._path_generator.original_path(original_image_metadata).absolute(), derivation_executor.source_filenames[-1])
+        self.assertEquals((100, 100), Image.open(os.path.join(AbstractIntegrationTestCase.DATA_DIRECTORY, path)).size)
                   
+
+class NegativeLookupImageRequestProcessorTestCase(AbstractIntegrationTestCase):
+    CONFIGURATION_OPTIONS = {'negative_lookup_cache_ttl_seconds': 60, 'known_image_ids_rebuild_seconds': 60}
+    
+    def onSetUp(self):
+        self._image_format_mapper = self._image_server_factory.image_format_mapper
+    
+    def test_saved_image_should_be_found_and_unknown_image_rejected(self):
+        # the known ids are loaded before the image is saved
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        self.assertTrue(self._image_server.get_original_image_path('sampleId') is not None)
+        self.assertTrue(self._image_server.prepare_transformation(imgengine.TransformationRequest(self._image_format_mapper, 'sampleId', (100, 100), domain.IMAGE_FORMAT_JPEG)) is not None)
+        
+        for i in range(2):
+            try:
+                self._image_server.prepare_transformation(imgengine.TransformationRequest(self._image_format_mapper, 'unknownId', (100, 100), domain.IMAGE_FORMAT_JPEG))
+                self.fail()
+            except imgengine.ImageMetadataNotFoundException:
+                pass
+        self.assertEquals(2, self._image_server_factory.statistics()['negative_lookups']['rejected_by_known_ids'])
+
+class DerivedImageIndexImageRequestProcessorTestCase(AbstractIntegrationTestCase):
+    CONFIGURATION_OPTIONS = {'derived_image_index': True}
+    
+    def onSetUp(self):
+        self._image_format_mapper = self._image_server_factory.image_format_mapper
+        self._derived_image_index = self._image_server_factory.derived_image_index
+    
+    def test_created_derived_image_should_be_served_from_index(self):
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        request = imgengine.TransformationRequest(self._image_format_mapper, 'sampleId', (100, 100), domain.IMAGE_FORMAT_JPEG)
+        path = self._image_server.prepare_transformation(request)
+        self.assertEquals(path, self._derived_image_index.get('sampleId-100x100-JPEG'))
+        self.assertEquals(path, self._image_server.find_transformation(request))
+    
+    def test_derived_image_deleted_by_another_process_should_be_created_again(self):
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        request = imgengine.TransformationRequest(self._image_format_mapper, 'sampleId', (100, 100), domain.IMAGE_FORMAT_JPEG)
+        path = self._image_server.prepare_transformation(request)
+        
+        os.remove(os.path.join(AbstractIntegrationTestCase.DATA_DIRECTORY, path))
+        # trusted until its file is found missing while it is served
+        self.assertEquals(path, self._image_server.find_transformation(request))
+        self._image_server.forget_transformation(request)
+        self.assertFalse('sampleId-100x100-JPEG' in self._derived_image_index)
+        self.assertEquals(None, self._image_server.find_transformation(request))
+        path = self._image_server.prepare_transformation(request)
+        self.assertTrue(os.path.exists(os.path.join(AbstractIntegrationTestCase.DATA_DIRECTORY, path)))
+        self.assertEquals(path, self._derived_image_index.get('sampleId-100x100-JPEG'))
+    
+    def test_indexed_derived_image_should_be_found_without_filesystem(self):
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        request = imgengine.TransformationRequest(self._image_format_mapper, 'sampleId', (100, 100), domain.IMAGE_FORMAT_JPEG)
+        path = self._image_server.prepare_transformation(request)
+        # the paths are computed when the index is loaded
+        self._derived_image_index.rebuild()
+        self.assertEquals(path, self._derived_image_index.get('sampleId-100x100-JPEG'))
+        
+        def filesystem_is_not_consulted(*args):
+            raise AssertionError('the filesystem has been consulted')
+        exists, stat = os.path.exists, os.stat
+        os.path.exists = os.stat = filesystem_is_not_consulted
+        try:
+            for i in range(3):
+                self.assertEquals(path, self._image_server.find_transformation(request))
+        finally:
+            os.path.exists, os.stat = exists, stat
+    
+    def test_deleted_derived_image_should_be_removed_from_index(self):
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        self._image_server.prepare_transformation(imgengine.TransformationRequest(self._image_format_mapper, 'sampleId', (100, 100), domain.IMAGE_FORMAT_JPEG))
+        self._image_server.delete('sampleId')
+        self.assertFalse('sampleId-100x100-JPEG' in self._derived_image_index)
+
+class DerivedImageQuotaImageRequestProcessorTestCase(AbstractIntegrationTestCase):
+    # the collections are triggered by the tests
+    CONFIGURATION_OPTIONS = {'derived_image_quota_bytes': 1, 'derived_image_collection_seconds': 3600}
+    
+    def onSetUp(self):
+        self._image_format_mapper = self._image_server_factory.image_format_mapper
+        self._collector = self._image_server_factory.derived_image_collector
+    
+    def onTearDown(self):
+        self._collector.shutdown()
+    
+    def _prepare(self, size):
+        path = self._image_server.prepare_transformation(imgengine.TransformationRequest(self._image_format_mapper, 'sampleId', size, domain.IMAGE_FORMAT_JPEG))
+        return os.path.join(AbstractIntegrationTestCase.DATA_DIRECTORY, path)
+    
+    def test_should_collect_least_recently_accessed_derived_images(self):
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        filenames = [self._prepare(size) for size in [(100, 100), (200, 200), (300, 300)]]
+        self._prepare((100, 100))
+        self.assertEquals(1, self._collector.statistics()['pending_accesses'])
+        
+        self._image_server_factory.access_tracker.flush()
+        self.assertEquals(2, self._image_server.collect_derived_images(os.path.getsize(filenames[0])))
+        self.assertTrue(os.path.exists(filenames[0]))
+        self.assertFalse(os.path.exists(filenames[1]))
+        self.assertFalse(os.path.exists(filenames[2]))
+        self.assertEquals(1, self._collector.statistics()['flushed_accesses'])
+        
+        # collected derived images are created again when requested
+        self.assertEquals(filenames[1], self._prepare((200, 200)))
+        self.assertTrue(os.path.exists(filenames[1]))
+    
+    def test_collector_should_keep_derived_images_under_quota(self):
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        filename = self._prepare((100, 100))
+        self.assertEquals(1, self._collector.collect())
+        self.assertFalse(os.path.exists(filename))
+        self.assertEquals(1, self._collector.statistics()['collected_images'])
+    
+    def test_should_not_collect_derived_images_under_quota(self):
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        filename = self._prepare((100, 100))
+        self.assertEquals(0, self._image_server.collect_derived_images(os.path.getsize(filename)))
+        self.assertTrue(os.path.exists(filename))
+    
+    def test_should_measure_derived_images_created_before_their_size_was_recorded(self):
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        filename = self._prepare((100, 100))
+        derived_image_metadata = self._image_metadata_repository.find_derived_image_metadata_by_original_image_metadata_id_size_and_format('sampleId', (100, 100), domain.IMAGE_FORMAT_JPEG)
+        derived_image_metadata.file_size = None
+        self.assertEquals(1, self._image_server.collect_derived_images(0))
+        self.assertFalse(os.path.exists(filename))
+
+class DerivedImageTiersImageRequestProcessorTestCase(AbstractIntegrationTestCase):
+    HOT_DIRECTORY = '/tmp/pymager-test-hot'
+    CONFIGURATION_OPTIONS = {'hot_directory': HOT_DIRECTORY, 'hot_tier_rebalance_seconds': 3600}
+    
+    def onSetUp(self):
+        self._image_format_mapper = self._image_server_factory.image_format_mapper
+        self._path_generator = self._image_server_factory.path_generator
+        self._tiers = self._image_server_factory.derived_image_tiers
+    
+    def onTearDown(self):
+        self._tiers.shutdown()
+    
+    def test_derived_image_should_be_created_in_hot_tier(self):
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        path = self._image_server.prepare_transformation(imgengine.TransformationRequest(self._image_format_mapper, 'sampleId', (100, 100), domain.IMAGE_FORMAT_JPEG))
+        self.assertTrue(os.path.exists(os.path.join(self.HOT_DIRECTORY, os.path.relpath(path, 'hot'))))
+        self.assertTrue(os.path.exists(os.path.join(AbstractIntegrationTestCase.DATA_DIRECTORY, path)))
+    
+    def test_deleting_image_should_delete_derived_images_from_all_tiers(self):
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        request = imgengine.TransformationRequest(self._image_format_mapper, 'sampleId', (100, 100), domain.IMAGE_FORMAT_JPEG)
+        hot_filename = os.path.join(AbstractIntegrationTestCase.DATA_DIRECTORY, self._image_server.prepare_transformation(request))
+        derived_image_metadata = self._image_metadata_repository.find_derived_image_metadata_by_original_image_metadata_id_size_and_format('sampleId', (100, 100), domain.IMAGE_FORMAT_JPEG)
+        main_filename = self._path_generator.main_derived_path(derived_image_metadata).absolute()
+        os.makedirs(os.path.dirname(main_filename))
+        shutil.copyfile(hot_filename, main_filename)
+        
+        self._image_server.delete('sampleId')
+        self.assertFalse(os.path.exists(hot_filename))
+        self.assertFalse(os.path.exists(main_filename))
+    
+    def test_demoted_derived_image_should_be_found_in_main_tier(self):
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        request = imgengine.TransformationRequest(self._image_format_mapper, 'sampleId', (100, 100), domain.IMAGE_FORMAT_JPEG)
+        self._image_server.prepare_transformation(request)
+        
+        tiers = DerivedImageTiers(self._path_generator, AbstractIntegrationTestCase.DATA_DIRECTORY, self.HOT_DIRECTORY, 0, 3, 3600)
+        self.assertEquals((0, 1), tiers.rebalance())
+        # the requests that found it in the hot tier can still read it until the next rebalancing
+        hot_path = self._image_server.prepare_transformation(request)
+        self.assertTrue(os.path.exists(os.path.join(AbstractIntegrationTestCase.DATA_DIRECTORY, hot_path)))
+        tiers.shutdown()
+        self.assertFalse(os.path.exists(os.path.join(AbstractIntegrationTestCase.DATA_DIRECTORY, hot_path)))
+        path = self._image_server.prepare_transformation(request)
+        self.assertFalse(path.startswith('hot'))
+        self.assertTrue(os.path.exists(os.path.join(AbstractIntegrationTestCase.DATA_DIRECTORY, path)))
+
+class PackedImageRequestProcessorTestCase(AbstractIntegrationTestCase):
+    PACKFILE_DIRECTORY = '/tmp/pymager-test-packs'
+    CONFIGURATION_OPTIONS = {'packfile_directory': PACKFILE_DIRECTORY, 'packfile_max_image_bytes': 10000, 'packfile_compaction_seconds': 3600}
+    
+    def onSetUp(self):
+        self._image_format_mapper = self._image_server_factory.image_format_mapper
+        self._packed_image_store = self._image_server_factory.packed_image_store
+    
+    def onTearDown(self):
+        self._image_server_factory.image_store_compactor.shutdown()
+    
+    def _prepare(self, size):
+        return self._image_server.prepare_transformation(imgengine.TransformationRequest(self._image_format_mapper, 'sampleId', size, domain.IMAGE_FORMAT_JPEG))
+    
+    def test_small_derived_image_should_be_packed(self):
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        path = self._prepare((100, 100))
+        self.assertFalse(os.path.exists(os.path.join(AbstractIntegrationTestCase.DATA_DIRECTORY, path)))
+        packed_image = self._packed_image_store.get('sampleId-100x100-JPEG')
+        self.assertEquals('JPEG', Image.open(StringIO(str(packed_image.body))).format)
+        derived_image_metadata = self._image_metadata_repository.find_derived_image_metadata_by_original_image_metadata_id_size_and_format('sampleId', (100, 100), domain.IMAGE_FORMAT_JPEG)
+        self.assertEquals(len(packed_image), derived_image_metadata.file_size)
+        
+        # packed images are not created again
+        self.assertEquals(path, self._prepare((100, 100)))
+        self.assertEquals(packed_image.modification_time, self._packed_image_store.get('sampleId-100x100-JPEG').modification_time)
+    
+    def test_large_derived_image_should_not_be_packed(self):
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        path = self._prepare((800, 800))
+        self.assertTrue(os.path.exists(os.path.join(AbstractIntegrationTestCase.DATA_DIRECTORY, path)))
+        self.assertFalse(self._packed_image_store.contains('sampleId-800x800-JPEG'))
+    
+    def test_deleting_image_should_delete_packed_derived_images(self):
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        self._prepare((100, 100))
+        self._image_server.delete('sampleId')
+        self.assertFalse(self._packed_image_store.contains('sampleId-100x100-JPEG'))
+
+class StripedImageRequestProcessorTestCase(AbstractIntegrationTestCase):
+    DATA_DIRECTORIES = ['/tmp/pymager-test-disk0', '/tmp/pymager-test-disk1']
+    CONFIGURATION_OPTIONS = {'data_directories': DATA_DIRECTORIES}
+    
+    def onSetUp(self):
+        self._image_format_mapper = self._image_server_factory.image_format_mapper
+    
+    def _disk_filename(self, relative_path):
+        """ @return: the filename of the image in the data directory it is stored in """
+        disk = int(relative_path.split(os.sep)[1])
+        return os.path.join(self.DATA_DIRECTORIES[disk], *relative_path.split(os.sep)[2:])
+    
+    def test_images_should_be_stored_in_data_directories(self):
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        original_path = self._image_server.get_original_image_path('sampleId')
+        self.assertTrue(os.path.exists(self._disk_filename(original_path)))
+        
+        derived_paths = [self._image_server.prepare_transformation(imgengine.TransformationRequest(self._image_format_mapper, 'sampleId', (100 * i, 100 * i), domain.IMAGE_FORMAT_JPEG)) 
+                         for i in range(1, 5)]
+        for derived_path in derived_paths:
+            self.assertTrue(os.path.exists(self._disk_filename(derived_path)))
+            self.assertTrue(os.path.exists(os.path.join(AbstractIntegrationTestCase.DATA_DIRECTORY, derived_path)))
+        
+        self._image_server.delete('sampleId')
+        for path in [original_path] + derived_paths:
+            self.assertFalse(os.path.exists(self._disk_filename(path)))
+
+class DeduplicatingImageRequestProcessorTestCase(AbstractIntegrationTestCase):
+    CONFIGURATION_OPTIONS = {'deduplicate_originals': True, 'mezzanine_max_size': 1000}
+    
+    def onSetUp(self):
+        self._image_format_mapper = self._image_server_factory.image_format_mapper
+        self._path_generator = self._image_server_factory.path_generator
+        self._content_store = self._image_server_factory.content_store
+    
+    def _inode(self, relative_path):
+        return os.stat(os.path.join(AbstractIntegrationTestCase.DATA_DIRECTORY, relative_path)).st_ino
+    
+    def _prepare(self, image_id):
+        return self._image_server.prepare_transformation(imgengine.TransformationRequest(self._image_format_mapper, image_id, (100, 100), domain.IMAGE_FORMAT_JPEG))
+    
+    def test_images_with_same_content_should_share_their_files(self):
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        self._image_server.save_file_to_repository(open(JPG_SAMPLE_IMAGE_FILENAME, 'rb'), 'otherSampleId')
+        self.assertEquals(self._inode(self._image_server.get_original_image_path('sampleId')), 
+                          self._inode(self._image_server.get_original_image_path('otherSampleId')))
+        original_image_metadatas = [self._image_metadata_repository.find_original_image_metadata_by_id(image_id) for image_id in ('sampleId', 'otherSampleId')]
+        self.assertEquals(original_image_metadatas[0].content_hash, original_image_metadatas[1].content_hash)
+        self.assertEquals(os.stat(self._path_generator.mezzanine_path(original_image_metadatas[0]).absolute()).st_ino, 
+                          os.stat(self._path_generator.mezzanine_path(original_image_metadatas[1]).absolute()).st_ino)
+        self.assertEquals(self._inode(self._prepare('sampleId')), self._inode(self._prepare('otherSampleId')))
+    
+    def test_shared_files_should_be_deleted_with_last_image(self):
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'otherSampleId')
+        content_hash = self._image_metadata_repository.find_original_image_metadata_by_id('sampleId').content_hash
+        self._prepare('sampleId')
+        other_path = self._prepare('otherSampleId')
+        
+        self._image_server.delete('sampleId')
+        self.assertTrue(os.path.exists(os.path.join(AbstractIntegrationTestCase.DATA_DIRECTORY, other_path)))
+        self.assertTrue(os.path.exists(self._content_store.blob_path(content_hash)))
+        self._image_server.delete('otherSampleId')
+        self.assertEquals([], [filenames for (directory, subdirectories, filenames) in os.walk(os.path.join(AbstractIntegrationTestCase.DATA_DIRECTORY, 'blobs')) if filenames])
+
+class PublicTreeImageRequestProcessorTestCase(AbstractIntegrationTestCase):
+    PUBLIC_DIRECTORY = '/tmp/pymager-test-public'
+    CONFIGURATION_OPTIONS = {'public_directory': PUBLIC_DIRECTORY}
+    
+    def onSetUp(self):
+        self._image_format_mapper = self._image_server_factory.image_format_mapper
+    
+    def test_derived_image_should_be_published_until_deleted(self):
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        path = self._image_server.prepare_transformation(imgengine.TransformationRequest(self._image_format_mapper, 'sampleId', (100, 100), domain.IMAGE_FORMAT_JPEG))
+        public_filename = os.path.join(self.PUBLIC_DIRECTORY, 'sa', 'sampleId-100x100.jpg')
+        self.assertEquals(os.stat(os.path.join(AbstractIntegrationTestCase.DATA_DIRECTORY, path)).st_ino, os.stat(public_filename).st_ino)
+        
+        # published again when requested
+        os.remove(public_filename)
+        self._image_server.find_transformation(imgengine.TransformationRequest(self._image_format_mapper, 'sampleId', (100, 100), domain.IMAGE_FORMAT_JPEG))
+        self.assertTrue(os.path.exists(public_filename))
+        
+        self._image_server.delete('sampleId')
+        self.assertFalse(os.path.exists(public_filename))
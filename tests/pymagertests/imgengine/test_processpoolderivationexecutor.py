@@ -0,0 +1,70 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import os
+import shutil
+import unittest
+import Image
+from pkg_resources import resource_filename
+from pymager import imgengine
+from pymager.imgengine.impl.processpoolderivationexecutor import ProcessPoolDerivationExecutor
+
+JPG_SAMPLE_IMAGE_FILENAME = resource_filename('pymager.samples', 'sami.jpg')
+BROKEN_IMAGE_FILENAME = resource_filename('pymager.samples', 'brokenImage.jpg')
+TARGET_DIRECTORY = '/tmp/pymager-test-derivations'
+
+class ProcessPoolDerivationExecutorTestCase(unittest.TestCase):
+    def setUp(self):
+        if os.path.exists(TARGET_DIRECTORY):
+            shutil.rmtree(TARGET_DIRECTORY)
+        self._executor = ProcessPoolDerivationExecutor(processes=2, max_pending_derivations=4)
+    
+    def tearDown(self):
+        self._executor.shutdown()
+        if os.path.exists(TARGET_DIRECTORY):
+            shutil.rmtree(TARGET_DIRECTORY)
+    
+    def test_should_derive_image_in_worker_process(self):
+        target_filename = os.path.join(TARGET_DIRECTORY, 'sub', 'sami-100x100.jpg')
+        result = self._executor.derive(JPG_SAMPLE_IMAGE_FILENAME, target_filename, (100, 100), 'JPEG')
+        
+        self.assertEquals(target_filename, result)
+        img = Image.open(target_filename)
+        self.assertEquals((100, 100), img.size)
+        self.assertEquals('JPEG', img.format)
+    
+    def test_should_return_image_encoded_in_worker_process(self):
+        target_filename = os.path.join(TARGET_DIRECTORY, 'sami-100x100.jpg')
+        [encoded_image] = self._executor.encode_all(JPG_SAMPLE_IMAGE_FILENAME, [(target_filename, (100, 100), 'JPEG')])
+        
+        self.assertEquals(os.path.getsize(target_filename), len(encoded_image))
+    
+    def test_should_report_errors_of_worker_process(self):
+        try:
+            self._executor.derive(BROKEN_IMAGE_FILENAME, os.path.join(TARGET_DIRECTORY, 'broken.jpg'), (100, 100), 'JPEG')
+            self.fail()
+        except imgengine.ImageProcessingException:
+            pass
+    
+    def test_should_reject_derivations_when_queue_is_full(self):
+        executor = ProcessPoolDerivationExecutor(processes=1, max_pending_derivations=0)
+        try:
+            executor.derive(JPG_SAMPLE_IMAGE_FILENAME, os.path.join(TARGET_DIRECTORY, 'sami.jpg'), (100, 100), 'JPEG')
+            self.fail()
+        except imgengine.DerivationQueueFullException, ex:
+            self.assertEquals(0, ex.max_pending_derivations)
+        finally:
+            executor.shutdown()
@@ -0,0 +1,50 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from pymager.imgengine.impl.publictree import PublicTree
+from tests.pymagertests.resources.fake_image_format_mapper import FakeImageFormatMapper
+
+class PublicTreeTestCase(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._public_tree = PublicTree(os.path.join(self._directory, 'public'), FakeImageFormatMapper())
+        self._filename = os.path.join(self._directory, 'derived.jpg')
+        with open(self._filename, 'wb') as f:
+            f.write('derived')
+    
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+    
+    def test_public_path_should_match_url(self):
+        self.assertEquals(os.path.join(self._directory, 'public', 'sa', 'sampleId-100x100.jpg'), self._public_tree.public_path('sampleId', (100, 100), 'JPEG'))
+    
+    def test_should_publish_derived_image(self):
+        self.assertTrue(self._public_tree.publish('sampleId', (100, 100), 'JPEG', self._filename))
+        self.assertEquals('derived', open(self._public_tree.public_path('sampleId', (100, 100), 'JPEG')).read())
+        self.assertFalse(self._public_tree.publish('sampleId', (100, 100), 'JPEG', self._filename))
+    
+    def test_should_not_publish_missing_derived_image(self):
+        self.assertFalse(self._public_tree.publish('sampleId', (100, 100), 'JPEG', os.path.join(self._directory, 'missing.jpg')))
+    
+    def test_should_unpublish_derived_image(self):
+        self._public_tree.publish('sampleId', (100, 100), 'JPEG', self._filename)
+        self._public_tree.unpublish('sampleId', (100, 100), 'JPEG')
+        self.assertFalse(os.path.exists(self._public_tree.public_path('sampleId', (100, 100), 'JPEG')))
+        self.assertEquals({'published_images': 1, 'unpublished_images': 1}, self._public_tree.statistics())
@@ -0,0 +1,81 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import unittest
+import threading
+import time
+from pymager.imgengine.impl.singleflight import SingleFlight
+
+class SingleFlightTestCase(unittest.TestCase):
+    def setUp(self):
+        self._single_flight = SingleFlight()
+        
+    def test_should_return_result_of_call(self):
+        self.assertEquals(42, self._single_flight.do('key', lambda: 42))
+        self.assertEquals(0, self._single_flight.pending_calls())
+    
+    def test_should_execute_call_again_once_previous_call_is_done(self):
+        calls = []
+        self._single_flight.do('key', lambda: calls.append(1))
+        self._single_flight.do('key', lambda: calls.append(1))
+        self.assertEquals(2, len(calls))
+        
+    def test_concurrent_calls_with_same_key_should_be_executed_only_once(self):
+        calls = []
+        results = []
+        release_leader = threading.Event()
+        def slow_call():
+            calls.append(1)
+            release_leader.wait()
+            return 'result'
+        def run():
+            results.append(self._single_flight.do('key', slow_call))
+        
+        threads = [threading.Thread(target=run) for i in range(10)]
+        for t in threads:
+            t.start()
+        while self._single_flight.pending_calls() == 0:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        release_leader.set()
+        for t in threads:
+            t.join()
+        
+        self.assertEquals(1, len(calls))
+        self.assertEquals(['result'] * 10, results)
+    
+    def test_followers_should_receive_exception_of_leader(self):
+        errors = []
+        release_leader = threading.Event()
+        def failing_call():
+            release_leader.wait()
+            raise ValueError('failed')
+        def run():
+            try:
+                self._single_flight.do('key', failing_call)
+            except ValueError, ex:
+                errors.append(ex)
+        
+        threads = [threading.Thread(target=run) for i in range(5)]
+        for t in threads:
+            t.start()
+        time.sleep(0.1)
+        release_leader.set()
+        for t in threads:
+            t.join()
+        
+        self.assertEquals(5, len(errors))
+        self.assertEquals(0, self._single_flight.pending_calls())
@@ -30,6 +30,16 @@ class NestedPathGeneratorTestCase(unittest.TestCase):
             os.path.abspath("/basedir/pictures/66/b1/fb/ce/ca/25/b9/95/78/0a/7a/6f/8f/ea/79/b6/97/ce/cc/66b1fbceca25b995780a7a6f8fea79b697ceccb0.jpg"),
             self._path_generator.original_path(objectmothers.original_yemmagouraya_metadata()).absolute())
         
+    def test_should_return_mezzanine_path_next_to_original_image(self):
+        self.assertEquals(
+            os.path.abspath("/basedir/pictures/66/b1/fb/ce/ca/25/b9/95/78/0a/7a/6f/8f/ea/79/b6/97/ce/cc/66b1fbceca25b995780a7a6f8fea79b697ceccb0-mezzanine.jpg"),
+            self._path_generator.mezzanine_path(objectmothers.original_yemmagouraya_metadata()).absolute())
+    
+    def test_should_return_placeholder_path(self):
+        self.assertEquals(
+            os.path.abspath("/basedir/placeholders/100x100.jpg"),
+            self._path_generator.placeholder_path((100, 100), 'JPEG').absolute())
+    
     def test_should_return_derived_image_path(self):
         self.assertEquals(
             os.path.abspath("/basedir/cache/d8/ae/48/bd/0c/62/ea/68/2c/df/e5/26/ce/df/68/6a/48/04/5a/d8ae48bd0c62ea682cdfe526cedf686a48045a7d-100x100.jpg"),
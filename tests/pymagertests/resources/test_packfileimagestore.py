@@ -0,0 +1,109 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from pymager.resources.impl import packfileimagestore
+from pymager.resources.impl.packfileimagestore import PackfileImageStore
+
+class PackfileImageStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._store = PackfileImageStore(self._directory, 10)
+    
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+    
+    def _segment_files(self):
+        return sorted([f for f in os.listdir(self._directory) if f.endswith('.pack')])
+    
+    def test_should_get_stored_image(self):
+        self._store.put('id1', 'abcd', 1234.5)
+        stored_image = self._store.get('id1')
+        self.assertEquals('abcd', str(stored_image.body))
+        self.assertEquals(1234.5, stored_image.modification_time)
+        self.assertEquals(4, len(stored_image))
+        self.assertTrue(self._store.contains('id1'))
+    
+    def test_should_not_get_unknown_image(self):
+        self.assertEquals(None, self._store.get('id1'))
+        self.assertFalse(self._store.contains('id1'))
+    
+    def test_should_replace_stored_image(self):
+        self._store.put('id1', 'abcd', 1)
+        self._store.put('id1', 'efgh', 2)
+        self.assertEquals('efgh', str(self._store.get('id1').body))
+    
+    def test_should_delete_stored_image(self):
+        self._store.put('id1', 'abcd', 1)
+        self._store.delete('id1')
+        self.assertEquals(None, self._store.get('id1'))
+        self._store.delete('id1')
+    
+    def test_should_append_to_new_segment_when_last_segment_is_full(self):
+        self._store.put('id1', 'abcdef', 1)
+        self._store.put('id2', 'ghijkl', 1)
+        self.assertEquals(2, len(self._segment_files()))
+        self.assertEquals('abcdef', str(self._store.get('id1').body))
+        self.assertEquals('ghijkl', str(self._store.get('id2').body))
+    
+    def test_compaction_should_reclaim_space_of_deleted_images(self):
+        self._store.put('id1', 'abcdef', 1)
+        self._store.put('id2', 'ghij', 2)
+        self._store.put('id3', 'klmnop', 3)
+        self._store.delete('id1')
+        self.assertEquals(6, self._store.compact())
+        self.assertEquals(['segment-00000001.pack'], self._segment_files())
+        self.assertEquals(None, self._store.get('id1'))
+        self.assertEquals('ghij', str(self._store.get('id2').body))
+        self.assertEquals(2, self._store.get('id2').modification_time)
+        self.assertEquals({'images': 2, 'segments': 1, 'bytes': 10, 'live_bytes': 10}, self._store.statistics())
+        self.assertEquals(0, self._store.compact())
+    
+    def test_should_see_changes_of_other_stores(self):
+        self._store.put('id1', 'abcdef', 1)
+        other_store = PackfileImageStore(self._directory, 10)
+        self.assertEquals('abcdef', str(other_store.get('id1').body))
+        
+        self._store.put('id2', 'ghij', 2)
+        self._store.delete('id1')
+        self.assertEquals(None, other_store.get('id1'))
+        self.assertEquals('ghij', str(other_store.get('id2').body))
+        
+        self._store.put('id3', 'klmnop', 3)
+        self._store.compact()
+        self.assertEquals('ghij', str(other_store.get('id2').body))
+        self.assertEquals('klmnop', str(other_store.get('id3').body))
+        other_store.put('id2', 'ghij', 2)
+        self.assertEquals('ghij', str(self._store.get('id2').body))
+        other_store.delete('id1')
+        self.assertFalse(self._store.contains('id1'))
+    
+    def test_should_not_read_unchanged_journal(self):
+        self._store.put('id1', 'abcd', 1)
+        opened_filenames = []
+        def recording_open(filename, *args):
+            opened_filenames.append(os.path.basename(filename))
+            return open(filename, *args)
+        packfileimagestore.open = recording_open
+        try:
+            self.assertTrue(self._store.contains('id1'))
+            self.assertEquals('abcd', str(self._store.get('id1').body))
+        finally:
+            del packfileimagestore.open
+        self.assertFalse(packfileimagestore.JOURNAL_FILENAME in opened_filenames)
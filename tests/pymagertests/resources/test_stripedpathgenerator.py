@@ -0,0 +1,75 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from pymager.resources.impl.nestedpathgenerator import NestedPathGenerator
+from pymager.resources.impl.stripedpathgenerator import StripedPathGenerator, link_disks
+from tests.pymagertests.resources.fake_image_format_mapper import FakeImageFormatMapper
+from tests.pymagertests import objectmothers
+
+class StripedPathGeneratorTestCase(unittest.TestCase):
+    def setUp(self):
+        self._data_directory = tempfile.mkdtemp()
+        self._path_generator = StripedPathGenerator(FakeImageFormatMapper(), self._data_directory, 3)
+        self._nested_path_generator = NestedPathGenerator(FakeImageFormatMapper(), self._data_directory)
+        self._original_image_metadata = objectmothers.original_yemmagouraya_metadata()
+        self._derived_image_metadata = objectmothers.derived_100x100_yemmagouraya_metadata()
+    
+    def tearDown(self):
+        shutil.rmtree(self._data_directory)
+    
+    def _create(self, relative_path):
+        path = os.path.join(self._data_directory, relative_path)
+        os.makedirs(os.path.dirname(path))
+        open(path, 'w').close()
+    
+    def test_should_spread_images_across_disks(self):
+        disks = [self._path_generator.disk('%040x' % i) for i in range(300)]
+        for disk in range(3):
+            self.assertTrue(70 < disks.count(disk) < 130)
+    
+    def test_adding_disk_should_only_move_images_to_new_disk(self):
+        larger_path_generator = StripedPathGenerator(FakeImageFormatMapper(), self._data_directory, 4)
+        for i in range(100):
+            image_hash = '%040x' % i
+            self.assertTrue(larger_path_generator.disk(image_hash) in (self._path_generator.disk(image_hash), 3))
+    
+    def test_new_original_image_should_be_on_assigned_disk(self):
+        original_hash = '66b1fbceca25b995780a7a6f8fea79b697ceccb0'
+        self.assertEquals(os.path.join('disks', str(self._path_generator.disk(original_hash)), self._nested_path_generator.original_path(self._original_image_metadata).relative()), 
+                          self._path_generator.original_path(self._original_image_metadata).relative())
+    
+    def test_mezzanine_should_be_next_to_original_image(self):
+        self.assertEquals(self._path_generator.original_path(self._original_image_metadata).parent_directory().absolute(), 
+                          self._path_generator.mezzanine_path(self._original_image_metadata).parent_directory().absolute())
+    
+    def test_should_find_derived_image_on_other_disk(self):
+        derived_paths = self._path_generator.derived_paths(self._derived_image_metadata)
+        self.assertEquals(3, len(derived_paths))
+        self.assertEquals(derived_paths[0].absolute(), self._path_generator.derived_path(self._derived_image_metadata).absolute())
+        self._create(derived_paths[2].relative())
+        self.assertEquals(derived_paths[2].absolute(), self._path_generator.derived_path(self._derived_image_metadata).absolute())
+    
+    def test_should_link_disks_into_data_directory(self):
+        disk_directory = tempfile.mkdtemp()
+        try:
+            link_disks(self._data_directory, [os.path.join(disk_directory, 'a'), os.path.join(disk_directory, 'b')])
+            self.assertEquals(os.path.join(disk_directory, 'b'), os.path.realpath(os.path.join(self._data_directory, 'disks', '1')))
+        finally:
+            shutil.rmtree(disk_directory)
@@ -0,0 +1,57 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from pymager.resources.impl.nestedpathgenerator import NestedPathGenerator
+from pymager.resources.impl.tieredpathgenerator import TieredPathGenerator
+from tests.pymagertests.resources.fake_image_format_mapper import FakeImageFormatMapper
+from tests.pymagertests import objectmothers
+
+class TieredPathGeneratorTestCase(unittest.TestCase):
+    def setUp(self):
+        self._data_directory = tempfile.mkdtemp()
+        self._path_generator = TieredPathGenerator(NestedPathGenerator(FakeImageFormatMapper(), self._data_directory))
+        self._derived_image_metadata = objectmothers.derived_100x100_yemmagouraya_metadata()
+    
+    def tearDown(self):
+        shutil.rmtree(self._data_directory)
+    
+    def _create(self, path):
+        os.makedirs(path.parent_directory().absolute())
+        open(path.absolute(), 'w').close()
+    
+    def test_new_derived_image_should_be_in_hot_tier(self):
+        self.assertEquals(os.path.join('hot', self._path_generator.main_derived_path(self._derived_image_metadata).relative()), 
+                          self._path_generator.derived_path(self._derived_image_metadata).relative())
+    
+    def test_should_find_derived_image_in_main_tier(self):
+        main_derived_path = self._path_generator.main_derived_path(self._derived_image_metadata)
+        self._create(main_derived_path)
+        self.assertEquals(main_derived_path.absolute(), self._path_generator.derived_path(self._derived_image_metadata).absolute())
+    
+    def test_should_find_derived_image_in_hot_tier_first(self):
+        self._create(self._path_generator.main_derived_path(self._derived_image_metadata))
+        self._create(self._path_generator.hot_derived_path(self._derived_image_metadata))
+        self.assertEquals(self._path_generator.hot_derived_path(self._derived_image_metadata).absolute(), 
+                          self._path_generator.derived_path(self._derived_image_metadata).absolute())
+    
+    def test_derived_paths_should_include_both_tiers(self):
+        self.assertEquals([self._path_generator.hot_derived_path(self._derived_image_metadata).absolute(), 
+                           self._path_generator.main_derived_path(self._derived_image_metadata).absolute()], 
+                          [path.absolute() for path in self._path_generator.derived_paths(self._derived_image_metadata)])
@@ -0,0 +1,43 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import unittest
+import sqlalchemy
+from pymager import bootstrap
+from tests.pymagertests.abstractintegrationtestcase import AbstractIntegrationTestCase
+
+class ImageServerFactoryTestCase(unittest.TestCase):
+    
+    def setUp(self):
+        sqlalchemy.orm.clear_mappers()
+    
+    def _create_image_server(self, **options):
+        config = bootstrap.ServiceConfiguration(
+            data_directory=AbstractIntegrationTestCase.DATA_DIRECTORY,
+            dburi=AbstractIntegrationTestCase.SAURI,
+            allowed_sizes=[(100, 100)],
+            dev_mode=True,
+            **options)
+        return bootstrap.ImageServerFactory(config).create_image_server()
+    
+    def test_should_reject_public_directory_with_quota(self):
+        self.assertRaises(ValueError, self._create_image_server, public_directory='/tmp/pymager-test-public', derived_image_quota_bytes=1024)
+    
+    def test_should_reject_public_directory_with_hot_tier(self):
+        self.assertRaises(ValueError, self._create_image_server, public_directory='/tmp/pymager-test-public', hot_directory='/tmp/pymager-test-hot')
+    
+    def test_should_reject_asynchronous_derivation_without_background_workers(self):
+        self.assertRaises(ValueError, self._create_image_server, async_derivation_mode=bootstrap.ASYNC_DERIVATION_ACCEPTED)
@@ -0,0 +1,92 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import os
+import cherrypy
+from cherrypy.lib import httputil
+from pkg_resources import resource_filename
+from pymager import bootstrap
+from pymager import domain
+from pymager import imgengine
+from pymager.caching.impl.lrucache import LruCache
+from pymager.web._derivedresource import DerivedResource
+from tests.pymagertests.abstractintegrationtestcase import AbstractIntegrationTestCase
+
+JPG_SAMPLE_IMAGE_FILENAME = resource_filename('pymager.samples', 'sami.jpg')
+
+class DerivedResourceTestCase(AbstractIntegrationTestCase):
+    def onSetUp(self):
+        config = bootstrap.ServiceConfiguration(AbstractIntegrationTestCase.DATA_DIRECTORY, AbstractIntegrationTestCase.SAURI, None, True)
+        self._resource = DerivedResource(config, self._image_server, self._image_server_factory.image_format_mapper)
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        self._image_server.prepare_transformation(imgengine.TransformationRequest(self._image_server_factory.image_format_mapper, 'sampleId', (100, 100), domain.IMAGE_FORMAT_JPEG))
+        cherrypy.serving.request = cherrypy._cprequest.Request(httputil.Host('127.0.0.1', 80), httputil.Host('127.0.0.1', 1234))
+        cherrypy.serving.response = cherrypy._cprequest.Response()
+    
+    def test_cached_derived_image_should_be_served_with_etag_while_database_is_down(self):
+        def database_is_down(*args):
+            raise IOError('database is down')
+        self._image_metadata_repository.find_original_image_metadata_by_id = database_is_down
+        
+        body = self._resource.GET('sampleId-100x100.jpg')
+        
+        self.assertTrue(len(''.join([str(b) for b in body])) > 0)
+        self.assertTrue(cherrypy.serving.response.headers['ETag'].startswith('"'))
+
+class IndexedDerivedResourceTestCase(AbstractIntegrationTestCase):
+    CONFIGURATION_OPTIONS = {'derived_image_index': True}
+    
+    def onSetUp(self):
+        config = bootstrap.ServiceConfiguration(AbstractIntegrationTestCase.DATA_DIRECTORY, AbstractIntegrationTestCase.SAURI, None, True)
+        self._resource = DerivedResource(config, self._image_server, self._image_server_factory.image_format_mapper)
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        self._path = self._image_server.prepare_transformation(imgengine.TransformationRequest(self._image_server_factory.image_format_mapper, 'sampleId', (100, 100), domain.IMAGE_FORMAT_JPEG))
+        cherrypy.serving.request = cherrypy._cprequest.Request(httputil.Host('127.0.0.1', 80), httputil.Host('127.0.0.1', 1234))
+        cherrypy.serving.response = cherrypy._cprequest.Response()
+    
+    def test_indexed_derived_image_deleted_by_another_process_should_be_created_again(self):
+        filename = os.path.join(AbstractIntegrationTestCase.DATA_DIRECTORY, self._path)
+        os.remove(filename)
+        
+        body = self._resource.GET('sampleId-100x100.jpg')
+        
+        self.assertTrue(len(''.join([str(b) for b in body])) > 0)
+        self.assertTrue(os.path.exists(filename))
+
+class CachedDerivedResourceTestCase(AbstractIntegrationTestCase):
+    CONFIGURATION_OPTIONS = {'derived_image_index': True}
+    
+    def onSetUp(self):
+        config = bootstrap.ServiceConfiguration(AbstractIntegrationTestCase.DATA_DIRECTORY, AbstractIntegrationTestCase.SAURI, None, True)
+        self._resource = DerivedResource(config, self._image_server, self._image_server_factory.image_format_mapper, derived_image_cache=LruCache(1024 * 1024))
+        self._image_server.save_file_to_repository(JPG_SAMPLE_IMAGE_FILENAME, 'sampleId')
+        self._image_server.prepare_transformation(imgengine.TransformationRequest(self._image_server_factory.image_format_mapper, 'sampleId', (100, 100), domain.IMAGE_FORMAT_JPEG))
+        cherrypy.serving.request = cherrypy._cprequest.Request(httputil.Host('127.0.0.1', 80), httputil.Host('127.0.0.1', 1234))
+        cherrypy.serving.response = cherrypy._cprequest.Response()
+    
+    def test_derived_image_in_memory_should_be_served_without_filesystem(self):
+        body = ''.join([str(b) for b in self._resource.GET('sampleId-100x100.jpg')])
+        etag = cherrypy.serving.response.headers['ETag']
+        cherrypy.serving.response = cherrypy._cprequest.Response()
+        def filesystem_is_not_consulted(*args):
+            raise AssertionError('the filesystem has been consulted')
+        stat, exists = os.stat, os.path.exists
+        os.stat = os.path.exists = filesystem_is_not_consulted
+        try:
+            self.assertEquals(body, ''.join([str(b) for b in self._resource.GET('sampleId-100x100.jpg')]))
+        finally:
+            os.stat, os.path.exists = stat, exists
+        self.assertEquals(etag, cherrypy.serving.response.headers['ETag'])
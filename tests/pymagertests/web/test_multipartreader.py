@@ -0,0 +1,68 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import unittest
+from StringIO import StringIO
+from pymager.web._multipartreader import MultipartReader, MultipartError
+
+BOUNDARY = '----boundary'
+
+def multipart_body(parts):
+    """ @param parts: the (name, filename, content) of the parts """
+    body = 'preamble\r\n'
+    for name, filename, content in parts:
+        body += '--%s\r\n' % (BOUNDARY,)
+        body += 'Content-Disposition: form-data; name="%s"%s\r\n' % (name, '; filename="%s"' % (filename,) if filename else '')
+        body += 'Content-Type: application/octet-stream\r\n\r\n'
+        body += content + '\r\n'
+    return body + '--%s--\r\n' % (BOUNDARY,)
+
+class SmallReadsFile(object):
+    """ returns a few bytes per read, so that the delimiters are split between reads """
+    def __init__(self, data, size):
+        self.__fobj = StringIO(data)
+        self.__size = size
+    
+    def read(self, size):
+        return self.__fobj.read(self.__size)
+
+class MultipartReaderTestCase(unittest.TestCase):
+    def test_should_read_file_part_after_other_parts(self):
+        content = ''.join([chr(i % 256) for i in range(5000)]) + '\r\n--' + BOUNDARY[:-1]
+        for read_size in [1, 7, 100, 1 << 20]:
+            reader = MultipartReader(SmallReadsFile(multipart_body([('id', None, 'sampleId'), ('file', 'sami.jpg', content)]), read_size), BOUNDARY)
+            part = reader.next_part()
+            self.assertEquals('id', part.name)
+            part = reader.next_part()
+            self.assertEquals('file', part.name)
+            self.assertEquals('sami.jpg', part.filename)
+            self.assertEquals('application/octet-stream', part.headers['content-type'])
+            self.assertEquals(content, ''.join(reader.read_part()))
+            self.assertEquals(None, reader.next_part())
+    
+    def test_should_read_empty_part(self):
+        reader = MultipartReader(StringIO(multipart_body([('file', 'empty.jpg', '')])), BOUNDARY)
+        self.assertEquals('file', reader.next_part().name)
+        self.assertEquals('', ''.join(reader.read_part()))
+        self.assertEquals(None, reader.next_part())
+    
+    def test_should_fail_when_body_is_truncated(self):
+        reader = MultipartReader(StringIO(multipart_body([('file', 'sami.jpg', 'content')])[:-20]), BOUNDARY)
+        reader.next_part()
+        self.assertRaises(MultipartError, lambda: ''.join(reader.read_part()))
+    
+    def test_should_not_find_parts_in_other_body(self):
+        self.assertEquals(None, MultipartReader(StringIO('not multipart'), BOUNDARY).next_part())
@@ -0,0 +1,53 @@
+"""
+   Copyright 2010 Sami Dalouche
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import cherrypy
+from cherrypy.lib import httputil
+from pymager import bootstrap
+from pymager.web._sendfile import serve_data_file
+
+class SendfileTestCase(unittest.TestCase):
+    def setUp(self):
+        self._data_directory = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self._data_directory, 'cache'))
+        with open(os.path.join(self._data_directory, 'cache', 'image 1.jpg'), 'wb') as f:
+            f.write('image')
+        cherrypy.serving.request = cherrypy._cprequest.Request(httputil.Host('127.0.0.1', 80), httputil.Host('127.0.0.1', 1234))
+        cherrypy.serving.response = cherrypy._cprequest.Response()
+    
+    def tearDown(self):
+        shutil.rmtree(self._data_directory)
+    
+    def _config(self, sendfile_mode):
+        return bootstrap.ServiceConfiguration(self._data_directory, 'sqlite:///:memory:', None, False, sendfile_mode=sendfile_mode, sendfile_prefix='/internal/')
+    
+    def test_should_offload_file_to_apache(self):
+        self.assertEquals('', serve_data_file(self._config(bootstrap.SENDFILE_X_SENDFILE), os.path.join('cache', 'image 1.jpg')))
+        headers = cherrypy.serving.response.headers
+        self.assertEquals(os.path.join(self._data_directory, 'cache', 'image 1.jpg'), headers['X-Sendfile'])
+        self.assertEquals('image/jpeg', headers['Content-Type'])
+        self.assertTrue('Last-Modified' in headers)
+    
+    def test_should_offload_file_to_nginx(self):
+        serve_data_file(self._config(bootstrap.SENDFILE_X_ACCEL_REDIRECT), os.path.join('cache', 'image 1.jpg'))
+        self.assertEquals('/internal/cache/image%201.jpg', cherrypy.serving.response.headers['X-Accel-Redirect'])
+    
+    def test_should_not_offload_missing_file(self):
+        self.assertRaises(cherrypy.NotFound, serve_data_file, self._config(bootstrap.SENDFILE_X_SENDFILE), os.path.join('cache', 'missing.jpg'))